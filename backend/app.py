@@ -1,15 +1,32 @@
 import os
 from dotenv import load_dotenv
-from flask import Flask, request, jsonify, session, redirect, url_for, abort
+from flask import Flask, Response, request, jsonify, session, redirect, url_for, abort, stream_with_context, g
 from flask_cors import CORS
 from flask_session import Session
-from google_auth_oauthlib.flow import Flow
-from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
-from services import save_credentials_to_session, get_credentials_from_session, validate_event_input
-from datetime import datetime, timedelta
+from services import save_credentials_to_session, validate_event_input, get_user_key, iter_items, TASKS_PAGE_SIZE
+from services import BATCH_LIMIT, execute_batch, batch_item_result, schedule_tasks
+from freebusy import WorkingHours, to_epoch
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+from event_store import PAGE_SIZE as EVENTS_PAGE_SIZE, get_event_store, list_window
+from google_clients import PRELOAD_CLIENTS, get_calendar_service, get_tasks_service, preload_clients
+from credential_cache import credential_cache, get_cached_credentials
+from session_store import create_session_cache
+from metrics import PROFILING_ENABLED, SamplingProfiler, registry, request_latency
+from http_cache import COMPRESS_MIN_SIZE, COMPRESSIBLE_MIMETYPES, choose_encoding, compress, encoded_etag
+from http_cache import items_etag, make_etag, matching_etag
+from projection import EVENT_COMPACT_FIELDS, TASK_COMPACT_FIELDS, ListView, project
+from outbox import WRITE_BEHIND, create_outbox, is_provisional_id, overlay_pending, pending_etag
+from watch_channels import create_watch_registry
+from change_feed import CHANGE_ACTIONS, STREAM_HEARTBEAT_SECONDS, STREAM_RETRY_MS, feed, format_sse
+from mirror import MAX_SEARCH_LIMIT, SEARCH_LIMIT, create_search_mirror, fts_query
+from bulk_transfer import TRANSFER_FORMATS, format_ics, format_ndjson, import_items, iter_export, iter_text_lines
+from bulk_transfer import parse_ics, parse_ndjson
+import itertools
 import logging
 import json
+import threading
+import time
 
 # Load environment variables from .env file
 load_dotenv()
@@ -19,6 +36,8 @@ CLIENT_SECRETS_FILE = "credentials.json"  # Path to the client secret JSON file
 SCOPES = ["https://www.googleapis.com/auth/calendar",
           "https://www.googleapis.com/auth/calendar.events",
           "https://www.googleapis.com/auth/tasks"]  # Required Google API scopes
+CORS_ORIGINS = ["http://localhost:3000"]  # Frontend origins allowed to call the API
+
 # Retrieve application secret key from .env file
 APP_SECRET_KEY = os.getenv('APP_SECRET_KEY')
 
@@ -31,15 +50,156 @@ app.config['SESSION_COOKIE_SECURE'] = True
 app.config['SESSION_COOKIE_HTTPONLY'] = True
 # SameSite cookie setting to avoid CSRF
 app.config['SESSION_COOKIE_SAMESITE'] = 'None'
-app.config['SESSION_TYPE'] = 'filesystem'  # Session storage type
+app.config['SESSION_TYPE'] = 'cachelib'  # Session storage type
+# In-memory LRU backed by SQLite (WAL) instead of one pickle file per session
+app.config['SESSION_CACHELIB'] = create_session_cache()
 
 Session(app)  # Initialize session management
-CORS(app, supports_credentials=True, origins=["http://localhost:3000"], methods=[
-     'GET', 'POST', 'PUT', 'DELETE', 'OPTIONS'], allow_headers=['Content-Type', 'Authorization', 'X-Requested-With'])
+CORS(app, supports_credentials=True, origins=CORS_ORIGINS, methods=[
+     'GET', 'POST', 'PUT', 'DELETE', 'OPTIONS'],
+     allow_headers=['Content-Type', 'Authorization', 'X-Requested-With', 'Prefer'], expose_headers=['Location'])
+outbox = create_outbox()  # Write-behind queue for event and task mutations
+watches = create_watch_registry()  # Calendar push notification channels
+mirror = create_search_mirror(watches.sequence)  # Indexed local copy of events and tasks behind /search
+feed.listen(mirror.task_changed)
+# Threads do not survive a fork, so each forked worker resumes the outbox's unfinished operations itself
+os.register_at_fork(after_in_child=outbox.resume)
+if PRELOAD_CLIENTS:
+    preload_clients()  # Parse the discovery documents now, before any worker processes are forked
+else:
+    outbox.resume()  # Send operations left unfinished by an earlier run or a crash
+
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    if PROFILING_ENABLED and request.args.get('profile') == '1':
+        g.profiler = SamplingProfiler().start()
+
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.get('request_started')
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        request_latency.observe(time.perf_counter() - started, route, request.method, str(response.status_code))
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        # The profile replaces the body; streamed bodies are generated after this point
+        profiler.stop()
+        response = Response(profiler.collapsed(), mimetype='text/plain')
+        response.headers['X-Profile-Samples'] = str(profiler.samples)
+    return response
+
+
+@app.after_request
+def compress_response(response):
+    """Compress large JSON bodies for clients that accept brotli or gzip."""
+    if (response.is_streamed or response.direct_passthrough or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+    payload = response.get_data()
+    if len(payload) < COMPRESS_MIN_SIZE:
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = choose_encoding(request.accept_encodings)
+    if encoding is None:
+        return response
+    response.set_data(compress(payload, encoding))
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(encoded_etag(etag, encoding))
+    return response
+
+
+@app.route('/metrics')
+def metrics():
+    """Expose request, upstream and cache metrics in the Prometheus text format."""
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+
+def wants_ndjson():
+    """Whether the client asked for a streamed NDJSON response."""
+    if request.args.get('format') == 'ndjson':
+        return True
+    return request.accept_mimetypes.best == 'application/x-ndjson'
+
+
+def get_list_view(compact_fields):
+    """Read the fields and format=compact query parameters of a list route."""
+    return ListView(request.args.get('fields'), request.args.get('format') == 'compact', compact_fields)
+
+
+def is_paginated():
+    """Whether the client asked for a single page rather than the full list."""
+    return 'cursor' in request.args or 'page_size' in request.args
+
+
+def get_page_size(maximum):
+    """Read the page_size query parameter, capped at the upstream maximum."""
+    page_size = int(request.args.get('page_size', maximum))
+    if page_size < 1:
+        raise ValueError("page_size must be positive")
+    return min(page_size, maximum)
+
+
+def ndjson_response(items):
+    """Stream items as newline-delimited JSON while upstream pages arrive."""
+    def generate():
+        try:
+            for item in items:
+                yield json.dumps(item) + '\n'
+        except HttpError as error:
+            # Headers are already sent, so report the failure in-band
+            yield json.dumps({"error": "API call failed", "details": str(error)}) + '\n'
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
+def not_modified(etag):
+    """A 304 response if the client's cached copy still matches etag, otherwise None."""
+    matched = matching_etag(request.if_none_match, etag)
+    if matched is None:
+        return None
+    response = Response(status=304)
+    response.set_etag(matched)
+    response.vary.add('Accept-Encoding')
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+
+def etagged_json(body, etag):
+    """JSON response that clients must revalidate with If-None-Match before reuse."""
+    response = jsonify(body)
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+
+# Queue a mutation instead of sending it now when write-behind is on for every request, the client
+# sent Prefer: respond-async, the target only has a provisional id, or earlier writes to it are queued
+def wants_write_behind(kind, target=None):
+    if WRITE_BEHIND or 'respond-async' in request.headers.get('Prefer', '').lower():
+        return True
+    return target is not None and (
+        is_provisional_id(target) or outbox.has_pending(get_user_key(session), kind, target))
+
+
+# Store a mutation in the outbox and answer 202 Accepted with the id the client should use for it
+def queue_mutation(kind, op, collection, target=None, body=None):
+    operation_id, resource_id = outbox.enqueue(
+        get_user_key(session), session['credentials'], kind, op, collection, target, body)
+    response = jsonify({"id": resource_id, "status": "pending", "operation": operation_id})
+    response.headers['Location'] = url_for('outbox_status', operation_id=operation_id)
+    return response, 202
 
 
 def get_google_oauth_flow(state=None):
     """Create and return a Google OAuth Flow object."""
+    # Only the login routes need the OAuth client library, so it is not imported at startup
+    from google_auth_oauthlib.flow import Flow
     return Flow.from_client_secrets_file(
         CLIENT_SECRETS_FILE, scopes=SCOPES, state=state,
         redirect_uri=url_for('oauth2callback', _external=True)
@@ -61,7 +221,6 @@ def login():
     authorization_url, state = flow.authorization_url(
         access_type='offline', include_granted_scopes='true')
     session['state'] = state
-    print(f"Login State Set: {state}")  # Debug log
     return redirect(authorization_url)
 
 
@@ -74,8 +233,9 @@ def oauth2callback():
     flow = get_google_oauth_flow(state=state)
     flow.fetch_token(authorization_response=request.url)
     credentials = flow.credentials
+    credential_cache.evict(session)
+    session.pop('user_key', None)  # A new login must not see another account's cached data
     save_credentials_to_session(session, credentials)
-    print("Credentials saved to session:", credentials)  # Debug log
     return redirect("http://localhost:3000/events")
 
 
@@ -84,23 +244,51 @@ def events():
     """Fetch and return calendar events."""
     if 'credentials' not in session:
         return jsonify({"error": "Unauthorized"}), 401
-    credentials = get_credentials_from_session(session)
+    credentials = get_cached_credentials(session)
     if not credentials or credentials.expired:
         return jsonify({"error": "Failed to load credentials"}), 500
-    service = build('calendar', 'v3', credentials=credentials)
-
-    now = datetime.utcnow()
-    two_years_ago = (now - timedelta(days=2*365)).isoformat() + 'Z'
-    two_years_from_now = (now + timedelta(days=2*365)).isoformat() + 'Z'
+    service = get_calendar_service(credentials)
 
-    events_result = service.events().list(
-        calendarId='primary',
-        timeMin=two_years_ago,
-        timeMax=two_years_from_now,
-        maxResults=1000,
-        singleEvents=True,
-        orderBy='startTime').execute()
-    return jsonify(events_result.get('items', []))
+    two_years_ago, two_years_from_now = list_window()
+    try:
+        view = get_list_view(EVENT_COMPACT_FIELDS)
+    except ValueError as e:
+        return jsonify({"error": "Invalid fields parameter", "details": str(e)}), 400
+
+    # Only deltas are fetched from Google once the store has done a full sync, so
+    # the projection is applied to the stored events rather than requested upstream
+    user_key = get_user_key(session)
+    store = get_event_store(user_key)
+    # With push notifications on, Google is only asked for deltas after it has reported a change
+    sequence = watches.sequence(user_key, credentials)
+    if wants_ndjson() and not view.compact:
+        return ndjson_response(project(event, view.spec)
+                               for event in store.stream(service, two_years_ago, two_years_from_now, sequence))
+    try:
+        store.sync(service, sequence)
+    except HttpError as error:
+        return jsonify({"error": "API call failed", "details": str(error)}), error.resp.status
+    # Unchanged listings are answered from the cached ETag without serialising anything
+    etag = store.etag(two_years_ago, two_years_from_now)
+    if view.spec is not None:
+        etag = make_etag([etag, view.variant])
+    if not is_paginated():
+        # Queued writes are shown as if already sent, so clients read their own writes
+        pending = outbox.pending_events(user_key)
+        etag = pending_etag(etag, pending)
+        return not_modified(etag) or etagged_json(
+            view.render(overlay_pending(store.list_events(two_years_ago, two_years_from_now), pending)), etag)
+    try:
+        page_size = get_page_size(EVENTS_PAGE_SIZE)
+        etag = make_etag([etag, request.args.get('cursor', ''), str(page_size)])
+        cached = not_modified(etag)
+        if cached:
+            return cached
+        items, next_cursor = store.list_page(
+            two_years_ago, two_years_from_now, cursor=request.args.get('cursor'), page_size=page_size)
+    except ValueError as e:
+        return jsonify({"error": "Invalid pagination parameters", "details": str(e)}), 400
+    return etagged_json({"items": view.render(items), "nextCursor": next_cursor}, etag)
 
 
 @app.route('/create_event', methods=['POST'])
@@ -108,10 +296,10 @@ def create_event():
     """Create a new calendar event."""
     if 'credentials' not in session:
         return jsonify({"error": "No credentials"}), 401
-    credentials = get_credentials_from_session(session)
+    credentials = get_cached_credentials(session)
     if not credentials or credentials.expired:
         return jsonify({"error": "Invalid or expired credentials"}), 401
-    service = build('calendar', 'v3', credentials=credentials)
+    service = get_calendar_service(credentials)
     try:
         event_data = request.json
 
@@ -120,10 +308,13 @@ def create_event():
         if errors:
             logging.error(f"Validation errors: {errors}")
             return jsonify({"error": "Invalid event data", "details": errors}), 400
+        if wants_write_behind('event'):
+            return queue_mutation('event', 'create', 'primary', body=event_data)
 
         # Insert the event
         created_event = service.events().insert(
             calendarId='primary', body=event_data).execute()
+        get_event_store(get_user_key(session)).apply(created_event)
         return jsonify(created_event), 201
     except HttpError as error:
         error_content = error.content.decode('utf-8')
@@ -143,12 +334,12 @@ def update_event(event_id):
         print("No credentials in session")  # Debug log
         return jsonify({"error": "Unauthorized - No credentials"}), 401
 
-    credentials = get_credentials_from_session(session)
+    credentials = get_cached_credentials(session)
     if not credentials or credentials.expired:
         print("Failed to load credentials or credentials expired")  # Debug log
         return jsonify({"error": "Failed to load credentials"}), 500
 
-    service = build('calendar', 'v3', credentials=credentials)
+    service = get_calendar_service(credentials)
 
     try:
         event_data = request.json
@@ -159,9 +350,12 @@ def update_event(event_id):
         if errors:
             logging.error(f"Validation errors: {errors}")
             return jsonify({"error": "Invalid event data", "details": errors}), 400
+        if wants_write_behind('event', event_id):
+            return queue_mutation('event', 'update', 'primary', event_id, event_data)
 
         updated_event = service.events().update(
             calendarId='primary', eventId=event_id, body=event_data).execute()
+        get_event_store(get_user_key(session)).apply(updated_event)
         return jsonify(updated_event), 200
     except HttpError as error:
         logging.error(f"API call failed: {error}")
@@ -174,38 +368,150 @@ def update_event(event_id):
 @app.route('/events/<event_id>', methods=['DELETE', 'OPTIONS'])
 def delete_event(event_id):
     """Delete a specified calendar event."""
-    print("Session Data:", session)  # Debugging print statement
     if request.method == 'OPTIONS':
         return '', 200
 
     if 'credentials' not in session:
         return jsonify({"error": "Unauthorized - No credentials in"}), 401
 
-    credentials = get_credentials_from_session(session)
+    credentials = get_cached_credentials(session)
     if not credentials or credentials.expired:
         return jsonify({"error": "Failed to load credentials"}), 500
 
-    service = build('calendar', 'v3', credentials=credentials)
+    service = get_calendar_service(credentials)
 
+    if wants_write_behind('event', event_id):
+        return queue_mutation('event', 'delete', 'primary', event_id)
     try:
         service.events().delete(calendarId='primary', eventId=event_id).execute()
+        get_event_store(get_user_key(session)).remove(event_id)
         return jsonify({"status": "success"}), 200
     except HttpError as error:
         return jsonify({"error": "Failed to delete event", "details": str(error)}), 400
 
 
+def get_kinds():
+    """Read the kind query parameter of /search and /export."""
+    kind = request.args.get('kind', 'all')
+    if kind not in ('events', 'tasks', 'all'):
+        raise ValueError("kind must be events, tasks or all")
+    return ('events', 'tasks') if kind == 'all' else (kind,)
+
+
+@app.route('/search')
+def search():
+    """Search the user's events and tasks in the local mirror by text and/or time range."""
+    if 'credentials' not in session:
+        return jsonify({"error": "Unauthorized"}), 401
+    credentials = get_cached_credentials(session)
+    if not credentials or credentials.expired:
+        return jsonify({"error": "Failed to load credentials"}), 500
+    try:
+        kinds = get_kinds()
+        time_min, time_max = (to_epoch(request.args[name]) if request.args.get(name) else None
+                              for name in ('timeMin', 'timeMax'))
+        limit = int(request.args.get('limit', SEARCH_LIMIT))
+        if not 1 <= limit <= MAX_SEARCH_LIMIT:
+            raise ValueError(f"limit must be between 1 and {MAX_SEARCH_LIMIT}")
+        text = request.args.get('q', '').strip()
+        query = fts_query(text) if text else None
+    except ValueError as e:
+        return jsonify({"error": "Invalid search parameters", "details": str(e)}), 400
+
+    user_key = get_user_key(session)
+    try:
+        # Google is only asked for changes every SYNC_INTERVAL seconds, or when it has pushed one
+        mirror.refresh(user_key, credentials)
+    except HttpError as error:
+        return jsonify({"error": "API call failed", "details": str(error)}), error.resp.status
+    return jsonify(mirror.search(user_key, query, time_min, time_max, kinds, limit))
+
+
+@app.route('/notifications', methods=['POST'])
+def notifications():
+    """Receive a Calendar push notification and mark the user's events as changed."""
+    user_key = watches.notify(request.headers.get('X-Goog-Channel-ID'), request.headers.get('X-Goog-Channel-Token'),
+                              request.headers.get('X-Goog-Resource-ID'), request.headers.get('X-Goog-Resource-State'))
+    if user_key is None:
+        return jsonify({"error": "Unknown channel"}), 404
+    return '', 204
+
+
+@app.route('/stream')
+def stream():
+    """Push the user's event and task changes as server-sent events."""
+    if 'credentials' not in session:
+        return jsonify({"error": "Unauthorized"}), 401
+    credentials = get_cached_credentials(session)
+    if not credentials or credentials.expired:
+        return jsonify({"error": "Failed to load credentials"}), 500
+    user_key = get_user_key(session)
+    store = get_event_store(user_key)
+    service = get_calendar_service(credentials)
+    # EventSource sends Last-Event-ID when it reconnects; without it the client starts from now
+    start = request.headers.get('Last-Event-ID') or feed.cursor()
+    wakeup = threading.Event()
+
+    def generate():
+        cursor = start
+        feed.subscribe(user_key, wakeup.set)
+        try:
+            yield f'retry: {STREAM_RETRY_MS}\n\n'
+            while True:
+                wakeup.clear()
+                messages, cursor = feed.replay(user_key, cursor)
+                if messages:
+                    yield ''.join(messages)
+                if not wakeup.wait(STREAM_HEARTBEAT_SECONDS):
+                    # Quiet for a while: pick up changes made elsewhere, then keep the connection open
+                    try:
+                        store.sync(service, watches.sequence(user_key, credentials))
+                    except HttpError as error:
+                        logging.error(f"Stream sync failed: {error}")
+                    yield format_sse(comment='heartbeat')
+        finally:
+            feed.unsubscribe(user_key, wakeup.set)
+
+    response = Response(generate(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # Keep reverse proxies from holding events back
+    return response
+
+
 @app.route('/tasks')
 def tasks():
     if 'credentials' not in session:
         return jsonify({"error": "Unauthorized"}), 401
-    credentials = get_credentials_from_session(session)
+    credentials = get_cached_credentials(session)
     if not credentials or credentials.expired:
         return jsonify({"error": "Failed to load credentials"}), 500
 
-    service = build('tasks', 'v1', credentials=credentials)
     try:
-        result = service.tasks().list(tasklist='@default').execute()
-        return jsonify(result.get('items', []))
+        view = get_list_view(TASK_COMPACT_FIELDS)
+    except ValueError as e:
+        return jsonify({"error": "Invalid fields parameter", "details": str(e)}), 400
+
+    service = get_tasks_service(credentials)
+    # Google trims the response to the requested fields before sending it
+    fields = view.upstream_fields()
+    if wants_ndjson() and not view.compact:
+        return ndjson_response(project(task, view.spec) for task in iter_items(
+            service.tasks().list, tasklist='@default', maxResults=TASKS_PAGE_SIZE, fields=fields))
+    try:
+        if not is_paginated():
+            items = list(iter_items(
+                service.tasks().list, tasklist='@default', maxResults=TASKS_PAGE_SIZE, fields=fields))
+            etag = items_etag(items, view.variant)
+            return not_modified(etag) or etagged_json(view.render(items), etag)
+        # The Tasks API page token is handed to the client as the cursor
+        result = service.tasks().list(
+            tasklist='@default', maxResults=get_page_size(TASKS_PAGE_SIZE),
+            pageToken=request.args.get('cursor'), fields=fields).execute()
+        items, next_cursor = result.get('items', []), result.get('nextPageToken')
+        etag = items_etag(items, view.variant, next_cursor or '')
+        return not_modified(etag) or etagged_json({"items": view.render(items), "nextCursor": next_cursor}, etag)
+    except ValueError as e:
+        return jsonify({"error": "Invalid pagination parameters", "details": str(e)}), 400
     except HttpError as error:
         return jsonify({"error": "API call failed", "details": str(error)}), error.resp.status
 
@@ -215,14 +521,17 @@ def create_task_route():
     """Create a new task."""
     if 'credentials' not in session:
         return jsonify({"error": "No credentials"}), 401
-    credentials = get_credentials_from_session(session)
+    credentials = get_cached_credentials(session)
     if not credentials or credentials.expired:
         return jsonify({"error": "Invalid or expired credentials"}), 401
-    service = build('tasks', 'v1', credentials=credentials)
+    service = get_tasks_service(credentials)
     try:
         task_data = request.json
+        if wants_write_behind('task'):
+            return queue_mutation('task', 'create', '@default', body=task_data)
         created_task = service.tasks().insert(
             tasklist='@default', body=task_data).execute()
+        feed.publish(get_user_key(session), 'task', 'created', created_task)
         return jsonify(created_task), 201
     except HttpError as error:
         return jsonify({"error": "API call failed", "details": error}), error.resp.status
@@ -237,16 +546,19 @@ def update_task(task_id):
     if 'credentials' not in session:
         return jsonify({"error": "Unauthorized - No credentials"}), 401
 
-    credentials = get_credentials_from_session(session)
+    credentials = get_cached_credentials(session)
     if not credentials or credentials.expired:
         return jsonify({"error": "Failed to load credentials"}), 500
 
-    service = build('tasks', 'v1', credentials=credentials)
+    service = get_tasks_service(credentials)
 
     try:
         task_data = request.json
+        if wants_write_behind('task', task_id):
+            return queue_mutation('task', 'update', '@default', task_id, task_data)
         updated_task = service.tasks().update(
             tasklist='@default', task=task_id, body=task_data).execute()
+        feed.publish(get_user_key(session), 'task', 'updated', updated_task)
         return jsonify(updated_task), 200
     except HttpError as error:
         logging.error(f"API call failed: {error}")
@@ -265,18 +577,259 @@ def delete_task(task_id):
     if 'credentials' not in session:
         return jsonify({"error": "Unauthorized - No credentials"}), 401
 
-    credentials = get_credentials_from_session(session)
+    credentials = get_cached_credentials(session)
     if not credentials or credentials.expired:
         return jsonify({"error": "Failed to load credentials"}), 500
 
-    service = build('tasks', 'v1', credentials=credentials)
+    service = get_tasks_service(credentials)
 
+    if wants_write_behind('task', task_id):
+        return queue_mutation('task', 'delete', '@default', task_id)
     try:
         service.tasks().delete(tasklist='@default', task=task_id).execute()
+        feed.publish(get_user_key(session), 'task', 'deleted', {'id': task_id})
         return jsonify({"status": "success"}), 200
     except HttpError as error:
         return jsonify({"error": "Failed to delete task", "details": str(error)}), 400
 
 
+@app.route('/outbox/<int:operation_id>')
+def outbox_status(operation_id):
+    """Report the progress of a queued mutation."""
+    if 'credentials' not in session:
+        return jsonify({"error": "Unauthorized"}), 401
+    status = outbox.status(get_user_key(session), operation_id)
+    if status is None:
+        return jsonify({"error": "Unknown operation"}), 404
+    return jsonify(status)
+
+
+def get_working_hours(options):
+    """Build a WorkingHours mask from {"start", "end", "weekdays", "timeZone"}, or None."""
+    if not options:
+        return None
+    if not isinstance(options, dict):
+        raise ValueError("workingHours must be an object")
+    try:
+        tz = ZoneInfo(options.get('timeZone', 'UTC'))
+    except (ZoneInfoNotFoundError, ValueError):
+        raise ValueError(f"Unknown time zone: {options.get('timeZone')}")
+    return WorkingHours(int(options.get('start', 9)), int(options.get('end', 17)),
+                        options.get('weekdays', (0, 1, 2, 3, 4)), tz)
+
+
+@app.route('/schedule_tasks', methods=['POST'])
+def schedule_tasks_route():
+    """Place many tasks into free calendar time at once, by priority and deadline."""
+    if 'credentials' not in session:
+        return jsonify({"error": "Unauthorized"}), 401
+    credentials = get_cached_credentials(session)
+    if not credentials or credentials.expired:
+        return jsonify({"error": "Failed to load credentials"}), 500
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict) or not isinstance(payload.get('tasks'), list):
+        return jsonify({"error": "Invalid schedule request", "details": "Body must have a 'tasks' list"}), 400
+    service = get_calendar_service(credentials)
+    try:
+        plan = schedule_tasks(service, payload['tasks'], payload.get('timeMin'), payload.get('timeMax'),
+                              buffer_minutes=int(payload.get('bufferMinutes', 0)),
+                              working_hours=get_working_hours(payload.get('workingHours')))
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": "Invalid schedule request", "details": str(e)}), 400
+    except HttpError as error:
+        return jsonify({"error": "API call failed", "details": str(error)}), error.resp.status
+    return jsonify({"results": plan}), 200
+
+
+# Status returned to the client for each successful batch operation
+BATCH_SUCCESS_STATUS = {'create': 201, 'update': 200, 'delete': 200}
+MAX_BATCH_OPERATIONS = 20 * BATCH_LIMIT  # Operations accepted by one batch route call
+
+
+def get_batch_operations():
+    """Read and sanity-check the operations list posted to a batch route."""
+    payload = request.get_json(silent=True) or {}
+    operations = payload.get('operations') if isinstance(payload, dict) else None
+    if not isinstance(operations, list) or not operations:
+        raise ValueError("Body must be an object with a non-empty 'operations' list")
+    if len(operations) > MAX_BATCH_OPERATIONS:
+        raise ValueError(f"At most {MAX_BATCH_OPERATIONS} operations are accepted per call")
+    return operations
+
+
+@app.route('/batch/events', methods=['POST'])
+def batch_events():
+    """Create, update and delete calendar events in bulk with per-item results."""
+    if 'credentials' not in session:
+        return jsonify({"error": "Unauthorized"}), 401
+    credentials = get_cached_credentials(session)
+    if not credentials or credentials.expired:
+        return jsonify({"error": "Failed to load credentials"}), 500
+    try:
+        operations = get_batch_operations()
+    except ValueError as e:
+        return jsonify({"error": "Invalid batch request", "details": str(e)}), 400
+
+    service = get_calendar_service(credentials)
+    results = [None] * len(operations)
+    pending = []
+    for index, operation in enumerate(operations):
+        op = operation.get('op') if isinstance(operation, dict) else None
+        if op not in BATCH_SUCCESS_STATUS:
+            results[index] = {"index": index, "status": 400, "error": "op must be create, update or delete"}
+            continue
+        if op != 'create' and not operation.get('id'):
+            results[index] = {"index": index, "status": 400, "error": "id is required"}
+            continue
+        if op == 'delete':
+            pending.append((index, service.events().delete(calendarId='primary', eventId=operation['id'])))
+            continue
+        event_data = operation.get('body') or {}
+        errors = validate_event_input(event_data)
+        if errors:
+            results[index] = {"index": index, "status": 400, "error": "Invalid event data", "details": errors}
+            continue
+        if op == 'create':
+            pending.append((index, service.events().insert(calendarId='primary', body=event_data)))
+        else:
+            pending.append((index, service.events().update(
+                calendarId='primary', eventId=operation['id'], body=event_data)))
+
+    outcomes = execute_batch(service, pending)
+    store = get_event_store(get_user_key(session))
+    for index, _ in pending:
+        op = operations[index]['op']
+        response, exception = outcomes.get(str(index), (None, None))
+        results[index] = batch_item_result(index, response, exception, BATCH_SUCCESS_STATUS[op])
+        if exception is None:
+            if op == 'delete':
+                store.remove(operations[index]['id'])
+            else:
+                store.apply(response)
+    return jsonify({"results": results}), 200
+
+
+@app.route('/batch/tasks', methods=['POST'])
+def batch_tasks():
+    """Create, update and delete tasks in bulk with per-item results."""
+    if 'credentials' not in session:
+        return jsonify({"error": "Unauthorized"}), 401
+    credentials = get_cached_credentials(session)
+    if not credentials or credentials.expired:
+        return jsonify({"error": "Failed to load credentials"}), 500
+    try:
+        operations = get_batch_operations()
+    except ValueError as e:
+        return jsonify({"error": "Invalid batch request", "details": str(e)}), 400
+
+    service = get_tasks_service(credentials)
+    results = [None] * len(operations)
+    pending = []
+    for index, operation in enumerate(operations):
+        op = operation.get('op') if isinstance(operation, dict) else None
+        if op not in BATCH_SUCCESS_STATUS:
+            results[index] = {"index": index, "status": 400, "error": "op must be create, update or delete"}
+            continue
+        if op != 'create' and not operation.get('id'):
+            results[index] = {"index": index, "status": 400, "error": "id is required"}
+            continue
+        tasklist = operation.get('tasklist', '@default')
+        task_data = operation.get('body') or {}
+        if op == 'create':
+            pending.append((index, service.tasks().insert(tasklist=tasklist, body=task_data)))
+        elif op == 'update':
+            pending.append((index, service.tasks().update(
+                tasklist=tasklist, task=operation['id'], body=task_data)))
+        else:
+            pending.append((index, service.tasks().delete(tasklist=tasklist, task=operation['id'])))
+
+    outcomes = execute_batch(service, pending)
+    user_key = get_user_key(session)
+    for index, _ in pending:
+        op = operations[index]['op']
+        response, exception = outcomes.get(str(index), (None, None))
+        results[index] = batch_item_result(index, response, exception, BATCH_SUCCESS_STATUS[op])
+        if exception is None:
+            feed.publish(user_key, 'task', CHANGE_ACTIONS[op], response or {'id': operations[index]['id']})
+    return jsonify({"results": results}), 200
+
+
+@app.route('/export')
+def export():
+    """Stream the user's events and tasks as NDJSON or iCalendar while upstream pages arrive."""
+    if 'credentials' not in session:
+        return jsonify({"error": "Unauthorized"}), 401
+    credentials = get_cached_credentials(session)
+    if not credentials or credentials.expired:
+        return jsonify({"error": "Failed to load credentials"}), 500
+    export_format = request.args.get('format', 'ndjson')
+    try:
+        if export_format not in TRANSFER_FORMATS:
+            raise ValueError("format must be ndjson or ics")
+        kinds = get_kinds()
+    except ValueError as e:
+        return jsonify({"error": "Invalid export parameters", "details": str(e)}), 400
+
+    items = iter_export(get_calendar_service(credentials), get_tasks_service(credentials), kinds)
+    try:
+        # Fetch the first page before answering, so a failing upstream call still gets its status code
+        first = next(items, None)
+    except HttpError as error:
+        return jsonify({"error": "API call failed", "details": str(error)}), error.resp.status
+    items = itertools.chain([first] if first is not None else [], items)
+    chunks = format_ndjson(items) if export_format == 'ndjson' else format_ics(items)
+
+    def generate():
+        try:
+            yield from chunks
+        except HttpError as error:
+            # Headers are already sent: NDJSON reports the failure in-band, iCalendar ends without END:VCALENDAR
+            logging.error(f"Export failed: {error}")
+            if export_format == 'ndjson':
+                yield json.dumps({"error": "API call failed", "details": str(error)}) + '\n'
+
+    response = Response(stream_with_context(generate()), mimetype=TRANSFER_FORMATS[export_format])
+    response.headers['Content-Disposition'] = f'attachment; filename=duratasks.{export_format}'
+    return response
+
+
+@app.route('/import', methods=['POST'])
+def import_items_route():
+    """Create events and tasks from an uploaded NDJSON or iCalendar file, streaming progress as NDJSON.
+
+    The file is sent as the 'file' field of a multipart form or as the raw body.
+    """
+    if 'credentials' not in session:
+        return jsonify({"error": "Unauthorized"}), 401
+    credentials = get_cached_credentials(session)
+    if not credentials or credentials.expired:
+        return jsonify({"error": "Failed to load credentials"}), 500
+    upload = request.files.get('file')
+    # Werkzeug spools large uploads to a temporary file, so they are read from disk rather than memory
+    stream = upload.stream if upload is not None else request.stream
+    import_format = request.args.get('format')
+    if import_format is None:
+        mimetype = upload.mimetype if upload is not None else request.mimetype
+        filename = (upload.filename or '') if upload is not None else ''
+        import_format = 'ics' if mimetype == 'text/calendar' or filename.lower().endswith('.ics') else 'ndjson'
+    if import_format not in TRANSFER_FORMATS:
+        return jsonify({"error": "Invalid import parameters", "details": "format must be ndjson or ics"}), 400
+
+    lines = iter_text_lines(stream)
+    items = parse_ndjson(lines) if import_format == 'ndjson' else parse_ics(lines)
+    user_key = get_user_key(session)
+    store = get_event_store(user_key)
+
+    def created(kind, resource):
+        if kind == 'event':
+            store.apply(resource)
+        else:
+            feed.publish(user_key, 'task', 'created', resource)
+
+    reports = import_items(get_calendar_service(credentials), get_tasks_service(credentials), items,
+                           tasklist=request.args.get('tasklist', '@default'), on_created=created)
+    return ndjson_response(reports)
+
+
 if __name__ == "__main__":
     app.run(debug=True, port=5000, ssl_context=('cert.pem', 'key.pem'))
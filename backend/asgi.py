@@ -0,0 +1,297 @@
+# ASGI entry point: serves GET /events, /tasks and /stream with async handlers and every
+# other route through the Flask app, so one process can keep hundreds of upstream
+# calendar/tasks requests in flight. `python app.py` / `flask run` are unchanged.
+#
+# Run with:
+#     uvicorn asgi:application --port 5000 --ssl-keyfile key.pem --ssl-certfile cert.pem
+import asyncio
+import json
+import logging
+import time
+from http.cookies import SimpleCookie
+from urllib.parse import parse_qs
+from a2wsgi import WSGIMiddleware
+from werkzeug.http import parse_accept_header, parse_etags
+from googleapiclient.errors import HttpError
+from app import app as flask_app, outbox, watches, CORS_ORIGINS
+from async_google import close_async_client, execute_async
+from credential_cache import get_cached_credentials
+from event_store import PAGE_SIZE as EVENTS_PAGE_SIZE, execute_pages, get_event_store, list_window
+from google_clients import get_calendar_service, get_tasks_service
+from metrics import request_latency
+from http_cache import COMPRESS_MIN_SIZE, choose_encoding, compress, encoded_etag
+from http_cache import items_etag, make_etag, matching_etag
+from projection import EVENT_COMPACT_FIELDS, TASK_COMPACT_FIELDS, ListView
+from outbox import overlay_pending, pending_etag
+from change_feed import STREAM_HEARTBEAT_SECONDS, STREAM_RETRY_MS, feed, format_sse
+from services import TASKS_PAGE_SIZE, get_user_key
+
+WSGI_WORKERS = 32  # Threads serving the routes that still run on the Flask app
+
+wsgi_application = WSGIMiddleware(flask_app, workers=WSGI_WORKERS)
+
+
+class AsyncSession(dict):
+    """Session data read straight from the Flask-Session cache for an async handler."""
+
+    def __init__(self, store_id, data):
+        super().__init__(data)
+        self.store_id = store_id
+        self.modified = False
+
+    def __setitem__(self, key, value):
+        self.modified = True
+        super().__setitem__(key, value)
+
+    def pop(self, key, *args):
+        self.modified = True
+        return super().pop(key, *args)
+
+
+def load_session(scope):
+    """Load the session named by the request cookie, or None if there is none."""
+    cookies = SimpleCookie()
+    for name, value in scope['headers']:
+        if name == b'cookie':
+            cookies.load(value.decode('latin-1'))
+    morsel = cookies.get(flask_app.config['SESSION_COOKIE_NAME'])
+    interface = flask_app.session_interface
+    if morsel is None or interface.use_signer:
+        return None
+    store_id = interface.key_prefix + morsel.value
+    data = interface.cache.get(store_id)
+    return AsyncSession(store_id, data) if data else None
+
+
+def save_session(session):
+    if session.modified:
+        lifetime = int(flask_app.permanent_session_lifetime.total_seconds())
+        flask_app.session_interface.cache.set(session.store_id, dict(session), timeout=lifetime)
+
+
+def get_header(scope, name):
+    for key, value in scope['headers']:
+        if key == name:
+            return value.decode('latin-1')
+    return None
+
+
+def cors_headers(scope):
+    origin = get_header(scope, b'origin')
+    if origin not in CORS_ORIGINS:
+        return []
+    return [(b'access-control-allow-origin', origin.encode('latin-1')),
+            (b'access-control-allow-credentials', b'true')]
+
+
+async def send_json(scope, send, body, status=200, etag=None):
+    """Send body as JSON, or a 304 if etag matches If-None-Match; large bodies are compressed."""
+    headers = cors_headers(scope)
+    vary = ['Accept-Encoding']
+    if headers:
+        vary = ['Origin', 'Cookie'] + vary
+    if etag is not None:
+        headers.append((b'cache-control', b'private, no-cache'))
+        matched = matching_etag(parse_etags(get_header(scope, b'if-none-match')), etag)
+        if matched is not None:
+            headers += [(b'etag', f'"{matched}"'.encode()), (b'vary', ', '.join(vary).encode())]
+            await send({'type': 'http.response.start', 'status': 304, 'headers': headers})
+            await send({'type': 'http.response.body', 'body': b''})
+            return
+    payload = json.dumps(body).encode()
+    encoding = None
+    if len(payload) >= COMPRESS_MIN_SIZE:
+        encoding = choose_encoding(parse_accept_header(get_header(scope, b'accept-encoding')))
+    if encoding is not None:
+        payload = compress(payload, encoding)
+        headers.append((b'content-encoding', encoding.encode()))
+    if etag is not None:
+        headers.append((b'etag', f'"{encoded_etag(etag, encoding)}"'.encode()))
+    headers += [(b'content-type', b'application/json'), (b'content-length', str(len(payload)).encode()),
+                (b'vary', ', '.join(vary).encode())]
+    await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': payload})
+
+
+def wants_ndjson(scope, args):
+    if args.get('format') == ['ndjson']:
+        return True
+    return any(name == b'accept' and b'application/x-ndjson' in value for name, value in scope['headers'])
+
+
+def get_page_size(args, maximum):
+    page_size = int(args.get('page_size', [maximum])[0])
+    if page_size < 1:
+        raise ValueError("page_size must be positive")
+    return min(page_size, maximum)
+
+
+def get_list_view(args, compact_fields):
+    return ListView(args.get('fields', [None])[0], args.get('format') == ['compact'], compact_fields)
+
+
+def listing_etag(store, view, time_min, time_max):
+    etag = store.etag(time_min, time_max)
+    return make_etag([etag, view.variant]) if view.spec is not None else etag
+
+
+# Listing, hashing and rendering a calendar is CPU work, so events() runs these in a worker thread
+def render_events(store, view, user_key, time_min, time_max):
+    etag = listing_etag(store, view, time_min, time_max)
+    pending = outbox.pending_events(user_key)
+    items = overlay_pending(store.list_events(time_min, time_max), pending)
+    return view.render(items), pending_etag(etag, pending)
+
+
+def render_events_page(store, view, args, time_min, time_max):
+    cursor = args.get('cursor', [None])[0]
+    page_size = get_page_size(args, EVENTS_PAGE_SIZE)
+    items, next_cursor = store.list_page(time_min, time_max, cursor=cursor, page_size=page_size)
+    etag = make_etag([listing_etag(store, view, time_min, time_max), cursor or '', str(page_size)])
+    return {"items": view.render(items), "nextCursor": next_cursor}, etag
+
+
+async def events(scope, receive, send, session, credentials, args):
+    """Async GET /events: delta-sync the user's event store without blocking a thread."""
+    try:
+        view = get_list_view(args, EVENT_COMPACT_FIELDS)
+    except ValueError as e:
+        return await send_json(scope, send, {"error": "Invalid fields parameter", "details": str(e)}, 400)
+    service = get_calendar_service(credentials)
+    time_min, time_max = list_window()
+    user_key = get_user_key(session)
+    store = get_event_store(user_key)
+    # Opening a watch channel is a blocking Google call, made once per user
+    sequence = await asyncio.to_thread(watches.sequence, user_key, credentials)
+    await store.sync_async(service, lambda http_request: execute_async(http_request, credentials), sequence)
+    if 'cursor' not in args and 'page_size' not in args:
+        body, etag = await asyncio.to_thread(render_events, store, view, user_key, time_min, time_max)
+        return await send_json(scope, send, body, etag=etag)
+    try:
+        body, etag = await asyncio.to_thread(render_events_page, store, view, args, time_min, time_max)
+    except ValueError as e:
+        return await send_json(scope, send, {"error": "Invalid pagination parameters", "details": str(e)}, 400)
+    await send_json(scope, send, body, etag=etag)
+
+
+async def tasks(scope, receive, send, session, credentials, args):
+    """Async GET /tasks: list the default task list without blocking a thread."""
+    try:
+        view = get_list_view(args, TASK_COMPACT_FIELDS)
+    except ValueError as e:
+        return await send_json(scope, send, {"error": "Invalid fields parameter", "details": str(e)}, 400)
+    service = get_tasks_service(credentials)
+    fields = view.upstream_fields()
+
+    async def execute(http_request):
+        return await execute_async(http_request, credentials)
+
+    if 'cursor' not in args and 'page_size' not in args:
+        items = []
+        async for page in execute_pages(
+                service.tasks().list, execute, tasklist='@default', maxResults=TASKS_PAGE_SIZE, fields=fields):
+            items.extend(page.get('items', []))
+        return await send_json(scope, send, view.render(items), etag=items_etag(items, view.variant))
+    try:
+        page_size = get_page_size(args, TASKS_PAGE_SIZE)
+    except ValueError as e:
+        return await send_json(scope, send, {"error": "Invalid pagination parameters", "details": str(e)}, 400)
+    result = await execute(service.tasks().list(
+        tasklist='@default', maxResults=page_size, pageToken=args.get('cursor', [None])[0], fields=fields))
+    items, next_cursor = result.get('items', []), result.get('nextPageToken')
+    await send_json(scope, send, {"items": view.render(items), "nextCursor": next_cursor},
+                    etag=items_etag(items, view.variant, next_cursor or ''))
+
+
+async def stream(scope, receive, send, session, credentials, args):
+    """Async GET /stream: server-sent change events without holding a thread per connected client."""
+    user_key = get_user_key(session)
+    store = get_event_store(user_key)
+    service = get_calendar_service(credentials)
+    cursor = get_header(scope, b'last-event-id') or feed.cursor()
+    loop = asyncio.get_running_loop()
+    wakeup = asyncio.Event()
+
+    def wake():
+        # Changes are published from request and worker threads
+        loop.call_soon_threadsafe(wakeup.set)
+
+    async def wait_for_disconnect():
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+    async def send_text(text):
+        await send({'type': 'http.response.body', 'body': text.encode(), 'more_body': True})
+
+    disconnected = asyncio.ensure_future(wait_for_disconnect())
+    feed.subscribe(user_key, wake)
+    try:
+        headers = cors_headers(scope) + [(b'content-type', b'text/event-stream'), (b'cache-control', b'no-cache'),
+                                         (b'x-accel-buffering', b'no')]
+        await send({'type': 'http.response.start', 'status': 200, 'headers': headers})
+        await send_text(f'retry: {STREAM_RETRY_MS}\n\n')
+        while not disconnected.done():
+            wakeup.clear()
+            messages, cursor = feed.replay(user_key, cursor)
+            if messages:
+                await send_text(''.join(messages))
+            woken = asyncio.ensure_future(wakeup.wait())
+            done, _ = await asyncio.wait({woken, disconnected}, timeout=STREAM_HEARTBEAT_SECONDS,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            woken.cancel()
+            if not done:
+                # Quiet for a while: pick up changes made elsewhere, then keep the connection open
+                try:
+                    sequence = await asyncio.to_thread(watches.sequence, user_key, credentials)
+                    await store.sync_async(
+                        service, lambda http_request: execute_async(http_request, credentials), sequence)
+                except HttpError as error:
+                    logging.error(f"Stream sync failed: {error}")
+                await send_text(format_sse(comment='heartbeat'))
+    finally:
+        feed.unsubscribe(user_key, wake)
+        disconnected.cancel()
+
+
+ASYNC_ROUTES = {'/events': events, '/tasks': tasks, '/stream': stream}
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await close_async_client()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    handler = ASYNC_ROUTES.get(scope.get('path')) if scope['type'] == 'http' and scope['method'] == 'GET' else None
+    args = parse_qs(scope.get('query_string', b'').decode())
+    # Streaming, profiled, unauthenticated and expired-credential requests keep the Flask behaviour
+    session = load_session(scope) if handler and not wants_ndjson(scope, args) and 'profile' not in args else None
+    # Loading credentials may wait on a token refresh, which must not hold up the event loop
+    credentials = await asyncio.to_thread(get_cached_credentials, session) \
+        if session and 'credentials' in session else None
+    if not credentials or credentials.expired:
+        return await wsgi_application(scope, receive, send)
+    started = time.perf_counter()
+    status = 500
+
+    async def send_recorded(message):
+        nonlocal status
+        if message['type'] == 'http.response.start':
+            status = message['status']
+        await send(message)
+
+    try:
+        await handler(scope, receive, send_recorded, session, credentials, args)
+    except HttpError as error:
+        await send_json(scope, send_recorded, {"error": "API call failed", "details": str(error)}, error.resp.status)
+    finally:
+        save_session(session)
+        request_latency.observe(time.perf_counter() - started, scope['path'], 'GET', str(status))
@@ -0,0 +1,54 @@
+# Non-blocking execution of Google API requests over a shared httpx connection pool
+import asyncio
+import time
+import httpx
+from google.auth.transport.requests import Request
+from google_clients import REQUEST_TIMEOUT, get_http_session, to_httplib2_response
+from metrics import record_refresh, record_upstream
+
+MAX_CONNECTIONS = 200  # Upstream requests in flight at once across the process
+MAX_KEEPALIVE_CONNECTIONS = 50
+
+_client = None
+
+
+# Get the process-wide async HTTP client, created inside the running event loop
+def get_async_client():
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=MAX_CONNECTIONS, max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS),
+            timeout=REQUEST_TIMEOUT)
+    return _client
+
+
+async def close_async_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+# Send a googleapiclient HttpRequest without blocking and return its decoded response
+async def execute_async(http_request, credentials):
+    if not credentials.valid:
+        # Refreshing uses google-auth's blocking transport, so keep it off the event loop
+        try:
+            await asyncio.to_thread(credentials.refresh, Request(get_http_session()))
+        except Exception:
+            record_refresh('request', False)
+            raise
+        record_refresh('request', True)
+    headers = dict(http_request.headers)
+    credentials.apply(headers)
+    started = time.perf_counter()
+    status = 'error'
+    try:
+        response = await get_async_client().request(
+            http_request.method, http_request.uri, content=http_request.body, headers=headers)
+        status = response.status_code
+    finally:
+        record_upstream(http_request.methodId or 'unknown', status, time.perf_counter() - started)
+    resp = to_httplib2_response(response.status_code, response.reason_phrase, response.headers)
+    # postproc is the model's response handler: it decodes JSON and raises HttpError
+    return http_request.postproc(resp, response.content)
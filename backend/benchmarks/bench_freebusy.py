@@ -0,0 +1,87 @@
+# Benchmark the free/busy engine against the original linear slot scan
+#
+# Run from the backend directory:
+#     python benchmarks/bench_freebusy.py [--events 10000] [--queries 200]
+import argparse
+import os
+import random
+import sys
+import timeit
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from freebusy import BusyIndex, WorkingHours  # noqa: E402
+
+HORIZON_DAYS = 365
+
+
+# Generate a calendar of random events over the horizon, as Google returns them
+def make_events(count, seed=42):
+    rng = random.Random(seed)
+    origin = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    events = []
+    for i in range(count):
+        start = origin + timedelta(minutes=rng.randrange(HORIZON_DAYS * 24 * 4) * 15)
+        end = start + timedelta(minutes=rng.choice((15, 30, 45, 60, 90, 120)))
+        events.append({
+            'id': f'event{i}',
+            'start': {'dateTime': start.isoformat().replace('+00:00', 'Z')},
+            'end': {'dateTime': end.isoformat().replace('+00:00', 'Z')},
+        })
+    events.sort(key=lambda event: event['start']['dateTime'])
+    return origin, events
+
+
+# The slot scan suggest_time_slots used before the engine: parse and walk every event
+def legacy_free_slots(events, time_min, time_max, duration_minutes):
+    free_times = []
+    last_end_time = time_min
+    for event in events:
+        event_start = datetime.fromisoformat(event['start']['dateTime']).astimezone(timezone.utc)
+        event_end = datetime.fromisoformat(event['end']['dateTime']).astimezone(timezone.utc)
+        if event_end <= time_min or event_start >= time_max:
+            continue
+        if (event_start - last_end_time).total_seconds() >= duration_minutes * 60:
+            free_times.append((last_end_time, event_start))
+        last_end_time = max(last_end_time, event_end)
+    if (time_max - last_end_time).total_seconds() >= duration_minutes * 60:
+        free_times.append((last_end_time, time_max))
+    return free_times
+
+
+def run(event_count, queries):
+    origin, events = make_events(event_count)
+    rng = random.Random(7)
+    build_seconds = timeit.timeit(lambda: BusyIndex.from_events(events), number=5) / 5
+    index = BusyIndex.from_events(events)
+    hours = WorkingHours(9, 17)
+    print(f"{event_count} events, {len(index)} merged busy intervals, index build {build_seconds * 1000:.1f} ms")
+    print(f"{'horizon':>8} {'legacy ms':>10} {'engine ms':>10} {'+hours ms':>10} {'speedup':>8}")
+    for horizon_days in (1, 7, 30, 90):
+        starts = [origin + timedelta(days=rng.uniform(0, HORIZON_DAYS - horizon_days)) for _ in range(queries)]
+        # Google filters by timeMin/timeMax, so the legacy scan only sees events in its window
+        in_window = [[event for event in events
+                      if start.isoformat() <= event['end']['dateTime'].replace('Z', '+00:00')
+                      and event['start']['dateTime'].replace('Z', '+00:00')
+                      < (start + timedelta(days=horizon_days)).isoformat()]
+                     for start in starts]
+        legacy = timeit.timeit(
+            lambda: [legacy_free_slots(window_events, start, start + timedelta(days=horizon_days), 30)
+                     for start, window_events in zip(starts, in_window)], number=1) / queries
+        windows = [(int(start.timestamp()), int(start.timestamp()) + horizon_days * 86400) for start in starts]
+        engine = timeit.timeit(
+            lambda: [index.free_gaps(a, b, 30 * 60) for a, b in windows], number=1) / queries
+        masked = timeit.timeit(
+            lambda: [index.free_gaps(a, b, 30 * 60, buffer_seconds=600, working_hours=hours)
+                     for a, b in windows], number=1) / queries
+        print(f"{horizon_days:>7}d {legacy * 1000:>10.3f} {engine * 1000:>10.3f} {masked * 1000:>10.3f} "
+              f"{legacy / engine:>7.0f}x")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the free/busy engine")
+    parser.add_argument('--events', type=int, default=10000)
+    parser.add_argument('--queries', type=int, default=200)
+    args = parser.parse_args()
+    run(args.events, args.queries)
@@ -0,0 +1,57 @@
+# Benchmark the multi-task scheduler on a busy calendar over a quarter-long horizon
+#
+# Run from the backend directory:
+#     python benchmarks/bench_scheduler.py [--events 10000] [--tasks 500]
+import argparse
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_freebusy import make_events  # noqa: E402
+from freebusy import BusyIndex, WorkingHours  # noqa: E402
+from scheduler import ScheduledTask, schedule  # noqa: E402
+
+HORIZON_DAYS = 90
+
+
+# Random tasks of 15 minutes to 4 hours, a third of them splittable into 30-minute chunks
+def make_tasks(count, window_start, seed=3):
+    rng = random.Random(seed)
+    tasks = []
+    for i in range(count):
+        duration = rng.choice((15, 30, 60, 90, 120, 240)) * 60
+        deadline = window_start + rng.randrange(1, HORIZON_DAYS) * 86400 if rng.random() < 0.7 else None
+        min_chunk = 30 * 60 if duration > 30 * 60 and rng.random() < 0.33 else None
+        tasks.append(ScheduledTask(f'task{i}', duration, rng.randint(1, 3), deadline, min_chunk))
+    return tasks
+
+
+def run(event_count, task_count):
+    origin, events = make_events(event_count)
+    index = BusyIndex.from_events(events)
+    window_start = int(origin.timestamp())
+    window_end = window_start + HORIZON_DAYS * 86400
+    tasks = make_tasks(task_count, window_start)
+    hours = WorkingHours(9, 17)
+
+    def plan():
+        gaps = index.free_gaps(window_start, window_end, 15 * 60, buffer_seconds=300, working_hours=hours)
+        return gaps, schedule(tasks, gaps, clearance=300)
+
+    seconds = timeit.timeit(plan, number=5) / 5
+    gaps, placements = plan()
+    placed = [pieces for pieces in placements if pieces]
+    print(f"{event_count} events, {len(gaps)} free gaps over {HORIZON_DAYS} days, {task_count} tasks")
+    print(f"placed {len(placed)}, unplaced {task_count - len(placed)}, "
+          f"pieces {sum(len(pieces) for pieces in placed)}, {seconds * 1000:.1f} ms per plan")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the multi-task scheduler")
+    parser.add_argument('--events', type=int, default=10000)
+    parser.add_argument('--tasks', type=int, default=500)
+    args = parser.parse_args()
+    run(args.events, args.tasks)
@@ -0,0 +1,90 @@
+# Benchmark worker cold start: importing the app and serving the first /tasks request
+#
+# Compares a freshly spawned worker (the app imported from scratch, with and without
+# PRELOAD_CLIENTS) against a worker forked from a master that already imported the app
+# with its API clients built, as gunicorn's preload_app does. Run from the backend directory:
+#     python benchmarks/bench_startup.py [--runs 7]
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND)
+
+from fake_google import start_fake_google  # noqa: E402
+
+
+# Import the app, then time the first and second GET /tasks (one upstream call each); returns ms
+def measure(started=None):
+    started = time.perf_counter() if started is None else started
+    import app as app_module  # noqa: E402
+    from load_test import create_session  # noqa: E402
+    imported = time.perf_counter()
+    sid, _ = create_session(app_module.app)
+    client = app_module.app.test_client()
+    client.set_cookie('session', sid)
+    timings = {'import': imported - started}
+    for name in ('first_request', 'second_request'):
+        began = time.perf_counter()
+        response = client.get('/tasks')
+        timings[name] = time.perf_counter() - began
+        assert response.status_code == 200, response.status_code
+    timings['ready'] = timings['import'] + timings['first_request']
+    timings['oauth_imported'] = 'google_auth_oauthlib' in sys.modules
+    return {name: value * 1000 if isinstance(value, float) else value for name, value in timings.items()}
+
+
+def spawned(env, preload):
+    result = subprocess.run([sys.executable, __file__, '--child'], cwd=BACKEND, capture_output=True, text=True,
+                            env=dict(env, PRELOAD_CLIENTS='1' if preload else '0'), check=True)
+    return json.loads(result.stdout.splitlines()[-1])
+
+
+# Fork from a process that already imported the app, like a gunicorn worker with preload_app
+def forked(env):
+    script = ('import gc, json, os, sys, time; sys.path.insert(0, "benchmarks"); '
+              'import app; gc.freeze(); read, write = os.pipe(); pid = os.fork()\n'
+              'if pid == 0:\n'
+              '    from bench_startup import measure\n'
+              '    os.write(write, json.dumps(measure()).encode()); os._exit(0)\n'
+              'os.waitpid(pid, 0); print(os.read(read, 65536).decode())')
+    result = subprocess.run([sys.executable, '-c', script], cwd=BACKEND, capture_output=True, text=True,
+                            env=dict(env, PRELOAD_CLIENTS='1'), check=True)
+    return json.loads(result.stdout.splitlines()[-1])
+
+
+def summarize(label, runs):
+    keys = ('import', 'first_request', 'second_request', 'ready')
+    medians = {key: statistics.median(run[key] for run in runs) for key in keys}
+    print(f"{label:<34}" + ''.join(f"{medians[key]:>14.1f}" for key in keys)
+          + f"{'yes' if runs[0]['oauth_imported'] else 'no':>8}")
+
+
+def run(runs):
+    server, _, root_url = start_fake_google(events=10)
+    with tempfile.TemporaryDirectory() as directory:
+        env = dict(os.environ, GOOGLE_API_ROOT_URL=root_url, SESSION_DB_PATH=os.path.join(directory, 'sessions.db'),
+                   OUTBOX_DB_PATH=os.path.join(directory, 'outbox.db'),
+                   WATCH_DB_PATH=os.path.join(directory, 'watch.db'), APP_SECRET_KEY='bench')
+        print(f"median of {runs} runs, ms")
+        print(f"{'worker':<34}{'import':>14}{'1st /tasks':>14}{'2nd /tasks':>14}{'ready':>14}{'oauth':>8}")
+        summarize('spawned, clients built lazily', [spawned(env, False) for _ in range(runs)])
+        summarize('spawned, PRELOAD_CLIENTS=1', [spawned(env, True) for _ in range(runs)])
+        summarize('forked from preloaded master', [forked(env) for _ in range(runs)])
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark backend worker startup")
+    parser.add_argument('--runs', type=int, default=7)
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        print(json.dumps(measure()))
+    else:
+        run(args.runs)
@@ -0,0 +1,465 @@
+# Local stand-in for the Calendar v3 and Tasks v1 endpoints the backend uses
+#
+# Serves synthetic calendars and task lists of configurable size, with optional
+# injected latency and 429 responses. Watch channels are honoured: every change to a
+# watched calendar is posted to the channel's address like a Calendar push notification.
+# Point the backend at it with
+#     GOOGLE_API_ROOT_URL=http://127.0.0.1:8089/
+# and run it standalone with
+#     python benchmarks/fake_google.py --port 8089 --events 10000 --latency-ms 40
+import argparse
+import email
+import json
+import random
+import re
+import threading
+import time
+import urllib.request
+import uuid
+from datetime import datetime, timedelta, timezone
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from zoneinfo import ZoneInfo
+
+DEFAULT_EVENTS_PAGE = 250
+MAX_EVENTS_PAGE = 2500
+DEFAULT_TASKS_PAGE = 20
+MAX_TASKS_PAGE = 100
+
+
+def rfc3339(moment):
+    return moment.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def parse_time(value):
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+
+# An event's start or end as an aware datetime: all-day dates at UTC midnight, local times in their timeZone
+def event_moment(value):
+    if 'date' in value:
+        return datetime.fromisoformat(value['date']).replace(tzinfo=timezone.utc)
+    moment = parse_time(value['dateTime'])
+    return moment if moment.tzinfo else moment.replace(tzinfo=ZoneInfo(value.get('timeZone', 'UTC')))
+
+
+class FakeGoogle:
+    """In-memory Calendar and Tasks data shared by all handler threads."""
+
+    def __init__(self, events=1000, recurring=10, calendars=3, task_lists=5, tasks_per_list=50,
+                 latency_ms=0, jitter_ms=0, error_rate=0.0, seed=1):
+        self.rng = random.Random(seed)
+        self.latency = latency_ms / 1000
+        self.jitter = jitter_ms / 1000
+        self.error_rate = error_rate
+        self.lock = threading.Lock()
+        self.now = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0)
+        self.calendars = {'primary': self._make_events(events, 'p')}
+        for i in range(1, calendars):
+            self.calendars[f'calendar{i}'] = self._make_events(max(events // 10, 1), f'c{i}')
+        self.series = [self._make_series(i) for i in range(recurring)]
+        self.changes = []  # (sequence, event) for sync tokens
+        self.task_lists = [{'kind': 'tasks#taskList', 'id': f'list{i}', 'title': f'List {i}'}
+                           for i in range(task_lists)]
+        self.tasks = {task_list['id']: self._make_tasks(task_list['id'], tasks_per_list)
+                      for task_list in self.task_lists}
+        self.deleted_tasks = {task_list['id']: [] for task_list in self.task_lists}  # Returned with showDeleted
+        self.watches = {}  # channel id -> watch request body, plus calendarId and resourceId
+        self.notifications = 0
+        self.counter = 0
+        self.requests = 0
+        self.last_args = {}  # (method, path) -> query arguments of the latest call, batched or not
+        self.batches = 0
+        self.errors = 0
+
+    def _make_events(self, count, prefix):
+        events = {}
+        for i in range(count):
+            start = self.now + timedelta(minutes=15 * self.rng.randrange(-365 * 96, 365 * 96))
+            end = start + timedelta(minutes=self.rng.choice((15, 30, 60, 90)))
+            event_id = f'{prefix}{i}'
+            events[event_id] = {
+                'kind': 'calendar#event', 'id': event_id, 'status': 'confirmed',
+                'etag': f'"{event_id}-1"', 'updated': rfc3339(self.now),
+                'summary': f'Event {i}', 'description': 'Synthetic event ' * 4,
+                'htmlLink': f'https://calendar.example/event?eid={event_id}',
+                'attendees': [{'email': f'user{j}@example.com'} for j in range(3)],
+                'start': {'dateTime': rfc3339(start)}, 'end': {'dateTime': rfc3339(end)},
+            }
+        return events
+
+    def _make_series(self, i):
+        start = (self.now - timedelta(days=365)).replace(hour=9 + i % 8)
+        return {
+            'kind': 'calendar#event', 'id': f'series{i}', 'status': 'confirmed',
+            'etag': f'"series{i}-1"', 'updated': rfc3339(self.now), 'summary': f'Daily {i}',
+            'start': {'dateTime': rfc3339(start)}, 'end': {'dateTime': rfc3339(start + timedelta(minutes=15))},
+            'recurrence': ['RRULE:FREQ=DAILY'],
+        }
+
+    def _make_tasks(self, list_id, count):
+        tasks = []
+        for i in range(count):
+            due = self.now.replace(hour=0) + timedelta(days=self.rng.randrange(-30, 90))
+            tasks.append({'kind': 'tasks#task', 'id': f'{list_id}-t{i}', 'etag': f'"{list_id}-t{i}-1"',
+                          'title': f'Task {i}', 'notes': 'Synthetic task', 'status': 'needsAction',
+                          'updated': rfc3339(self.now), 'due': rfc3339(due)})
+        return tasks
+
+    def next_id(self, prefix):
+        with self.lock:
+            self.counter += 1
+            return f'{prefix}{self.counter}'
+
+    def record_change(self, event):
+        with self.lock:
+            self.changes.append((len(self.changes) + 1, event))
+
+    # Calendar
+
+    def instances(self, calendar_id, time_min, time_max, single_events):
+        events = list(self.calendars.get(calendar_id, {}).values())
+        masters = []
+        if calendar_id == 'primary':
+            for series in self.series:
+                if not single_events:
+                    # Unexpanded series are returned whole, whatever the window
+                    masters.append(series)
+                    continue
+                start = parse_time(series['start']['dateTime'])
+                length = parse_time(series['end']['dateTime']) - start
+                day = max(0, (time_min - start).days) if time_min else 0
+                moment = start + timedelta(days=day)
+                limit = time_max or self.now + timedelta(days=365)
+                template = {key: value for key, value in series.items() if key != 'recurrence'}
+                while moment < limit:
+                    events.append(dict(template, id=f"{series['id']}_{moment:%Y%m%dT%H%M%SZ}",
+                                       recurringEventId=series['id'],
+                                       start={'dateTime': rfc3339(moment)},
+                                       end={'dateTime': rfc3339(moment + length)}))
+                    moment += timedelta(days=1)
+        results = []
+        for event in events:
+            start = event_moment(event['start'])
+            end = event_moment(event['end'])
+            if (time_min and end <= time_min) or (time_max and start >= time_max):
+                continue
+            results.append((start, event))
+        results.sort(key=lambda item: (item[0], item[1]['id']))
+        return masters + [event for _, event in results]
+
+    def list_events(self, calendar_id, args):
+        page_size = min(int(args.get('maxResults', DEFAULT_EVENTS_PAGE)), MAX_EVENTS_PAGE)
+        offset = int(args.get('pageToken', 0))
+        if 'syncToken' in args:
+            since = int(args['syncToken'])
+            items = [event for sequence, event in self.changes if sequence > since]
+        else:
+            time_min = parse_time(args['timeMin']) if 'timeMin' in args else None
+            time_max = parse_time(args['timeMax']) if 'timeMax' in args else None
+            items = self.instances(calendar_id, time_min, time_max, args.get('singleEvents') == 'true')
+        page = items[offset:offset + page_size]
+        body = {'kind': 'calendar#events', 'etag': f'"{len(self.changes)}"', 'items': page}
+        if offset + page_size < len(items):
+            body['nextPageToken'] = str(offset + page_size)
+        else:
+            body['nextSyncToken'] = str(len(self.changes))
+        return 200, body
+
+    def write_event(self, calendar_id, event_id, body):
+        events = self.calendars.setdefault(calendar_id, {})
+        if event_id is not None and event_id not in events:
+            return 404, error_body(404, 'Not Found')
+        if event_id is None and self.find_ical_uid(calendar_id, body.get('iCalUID')) is not None:
+            return 409, error_body(409, 'The requested identifier already exists.', 'duplicate')
+        event = dict(body, kind='calendar#event', id=event_id or self.next_id('new'), status='confirmed',
+                     updated=rfc3339(datetime.now(timezone.utc)))
+        event['etag'] = f'"{event["id"]}-{time.monotonic_ns()}"'
+        events[event['id']] = event
+        self.record_change(event)
+        self.notify_watchers(calendar_id)
+        return 200, event
+
+    # events.import: add the event, or update the one that already has its iCalUID
+    def import_event(self, calendar_id, body):
+        if not body.get('iCalUID'):
+            return 400, error_body(400, 'Missing iCalUID.', 'required')
+        return self.write_event(calendar_id, self.find_ical_uid(calendar_id, body['iCalUID']), body)
+
+    def find_ical_uid(self, calendar_id, ical_uid):
+        if ical_uid:
+            for event in self.calendars.get(calendar_id, {}).values():
+                if event.get('iCalUID') == ical_uid:
+                    return event['id']
+        return None
+
+    def delete_event(self, calendar_id, event_id):
+        event = self.calendars.get(calendar_id, {}).pop(event_id, None)
+        if event is None:
+            return 404, error_body(404, 'Not Found')
+        self.record_change({'id': event_id, 'status': 'cancelled'})
+        self.notify_watchers(calendar_id)
+        return 204, None
+
+    # Change an event as another client would, notifying any watchers
+    def external_change(self, calendar_id='primary'):
+        events = self.calendars[calendar_id]
+        event = dict(events[self.rng.choice(sorted(events))], updated=rfc3339(datetime.now(timezone.utc)))
+        event['summary'] = f"{event.get('summary', '')} (edited)"
+        event['etag'] = f'"{event["id"]}-{time.monotonic_ns()}"'
+        events[event['id']] = event
+        self.record_change(event)
+        self.notify_watchers(calendar_id)
+        return event
+
+    # Push notifications
+
+    def watch(self, calendar_id, body):
+        channel = dict(body, calendarId=calendar_id, resourceId=f'resource-{calendar_id}', messages=0)
+        ttl = int(body.get('params', {}).get('ttl', 7 * 24 * 60 * 60))
+        expiration = int((time.time() + ttl) * 1000)
+        with self.lock:
+            self.watches[body['id']] = channel
+        # Like Google, confirm the channel with a 'sync' message
+        threading.Thread(target=self.post_notification, args=(channel, 'sync'), daemon=True).start()
+        return 200, {'kind': 'api#channel', 'id': body['id'], 'resourceId': channel['resourceId'],
+                     'resourceUri': f'calendar/v3/calendars/{calendar_id}/events', 'expiration': str(expiration)}
+
+    def stop_channel(self, body):
+        with self.lock:
+            channel = self.watches.get(body.get('id'))
+            if channel is None or channel['resourceId'] != body.get('resourceId'):
+                return 404, error_body(404, 'Channel not found')
+            del self.watches[body['id']]
+        return 204, None
+
+    def notify_watchers(self, calendar_id):
+        with self.lock:
+            channels = [channel for channel in self.watches.values() if channel['calendarId'] == calendar_id]
+        for channel in channels:
+            threading.Thread(target=self.post_notification, args=(channel, 'exists'), daemon=True).start()
+
+    def post_notification(self, channel, state):
+        with self.lock:
+            channel['messages'] += 1
+            number = channel['messages']
+        headers = {'X-Goog-Channel-ID': channel['id'], 'X-Goog-Channel-Token': channel.get('token', ''),
+                   'X-Goog-Resource-ID': channel['resourceId'], 'X-Goog-Resource-State': state,
+                   'X-Goog-Message-Number': str(number), 'X-Goog-Resource-URI': channel['calendarId'],
+                   'X-Goog-Message-ID': uuid.uuid4().hex}
+        request = urllib.request.Request(channel['address'], data=b'', headers=headers, method='POST')
+        try:
+            urllib.request.urlopen(request, timeout=10).close()
+            self.notifications += 1
+        except OSError:
+            pass  # Google also gives up on unreachable webhooks
+
+    def freebusy(self, body):
+        time_min = parse_time(body['timeMin'])
+        time_max = parse_time(body['timeMax'])
+        calendars = {}
+        for item in body.get('items', []):
+            events = self.instances(item['id'], time_min, time_max, True)
+            calendars[item['id']] = {'busy': [{'start': event['start']['dateTime'], 'end': event['end']['dateTime']}
+                                              for event in events]}
+        return 200, {'kind': 'calendar#freeBusy', 'timeMin': body['timeMin'], 'timeMax': body['timeMax'],
+                     'calendars': calendars}
+
+    def calendar_list(self):
+        items = [{'kind': 'calendar#calendarListEntry', 'id': calendar_id, 'selected': True,
+                  'primary': calendar_id == 'primary'} for calendar_id in self.calendars]
+        return 200, {'kind': 'calendar#calendarList', 'items': items}
+
+    # Tasks
+
+    def list_tasks(self, list_id, args):
+        tasks = self.tasks.get(list_id)
+        if tasks is None:
+            return 404, error_body(404, 'Not Found')
+        # Like the real API, a due filter drops tasks without a due date
+        if 'dueMin' in args:
+            tasks = [task for task in tasks if task.get('due') and task['due'] >= args['dueMin']]
+        if 'dueMax' in args:
+            tasks = [task for task in tasks if task.get('due') and task['due'] < args['dueMax']]
+        if args.get('showDeleted') == 'true':
+            tasks = tasks + self.deleted_tasks[list_id]
+        if 'updatedMin' in args:
+            tasks = [task for task in tasks if task['updated'] >= args['updatedMin']]
+        page_size = min(int(args.get('maxResults', DEFAULT_TASKS_PAGE)), MAX_TASKS_PAGE)
+        offset = int(args.get('pageToken', 0))
+        body = {'kind': 'tasks#tasks', 'etag': f'"{list_id}-{len(tasks)}"', 'items': tasks[offset:offset + page_size]}
+        if offset + page_size < len(tasks):
+            body['nextPageToken'] = str(offset + page_size)
+        return 200, body
+
+    def write_task(self, list_id, task_id, body):
+        tasks = self.tasks.get(list_id)
+        if tasks is None:
+            return 404, error_body(404, 'Not Found')
+        task = dict(body, kind='tasks#task', id=task_id or self.next_id('task'),
+                    updated=rfc3339(datetime.now(timezone.utc)))
+        with self.lock:
+            for i, existing in enumerate(tasks):
+                if existing['id'] == task['id']:
+                    tasks[i] = task
+                    break
+            else:
+                if task_id:
+                    return 404, error_body(404, 'Not Found')
+                tasks.append(task)
+        return 200, task
+
+    def delete_task(self, list_id, task_id):
+        tasks = self.tasks.get(list_id, [])
+        with self.lock:
+            remaining = [task for task in tasks if task['id'] != task_id]
+            if len(remaining) == len(tasks):
+                return 404, error_body(404, 'Not Found')
+            self.tasks[list_id] = remaining
+            self.deleted_tasks[list_id].append({'kind': 'tasks#task', 'id': task_id, 'deleted': True,
+                                                'updated': rfc3339(datetime.now(timezone.utc))})
+        return 204, None
+
+
+def error_body(code, message, reason='notFound'):
+    return {'error': {'code': code, 'message': message, 'errors': [{'reason': reason, 'message': message}]}}
+
+
+ROUTES = [
+    ('GET', r'/calendar/v3/calendars/([^/]+)/events', lambda g, m, a, b: g.list_events(m[1], a)),
+    ('POST', r'/calendar/v3/calendars/([^/]+)/events', lambda g, m, a, b: g.write_event(m[1], None, b)),
+    ('PUT', r'/calendar/v3/calendars/([^/]+)/events/([^/]+)', lambda g, m, a, b: g.write_event(m[1], m[2], b)),
+    ('DELETE', r'/calendar/v3/calendars/([^/]+)/events/([^/]+)', lambda g, m, a, b: g.delete_event(m[1], m[2])),
+    ('POST', r'/calendar/v3/calendars/([^/]+)/events/watch', lambda g, m, a, b: g.watch(m[1], b)),
+    ('POST', r'/calendar/v3/calendars/([^/]+)/events/import', lambda g, m, a, b: g.import_event(m[1], b)),
+    ('POST', r'/calendar/v3/channels/stop', lambda g, m, a, b: g.stop_channel(b)),
+    ('POST', r'/calendar/v3/freeBusy', lambda g, m, a, b: g.freebusy(b)),
+    ('GET', r'/calendar/v3/users/me/calendarList', lambda g, m, a, b: g.calendar_list()),
+    ('GET', r'/tasks/v1/users/@me/lists', lambda g, m, a, b: (200, {'kind': 'tasks#taskLists', 'items': g.task_lists})),
+    ('GET', r'/tasks/v1/lists/([^/]+)/tasks', lambda g, m, a, b: g.list_tasks(resolve_list(g, m[1]), a)),
+    ('POST', r'/tasks/v1/lists/([^/]+)/tasks', lambda g, m, a, b: g.write_task(resolve_list(g, m[1]), None, b)),
+    ('PUT', r'/tasks/v1/lists/([^/]+)/tasks/([^/]+)',
+     lambda g, m, a, b: g.write_task(resolve_list(g, m[1]), m[2], b)),
+    ('DELETE', r'/tasks/v1/lists/([^/]+)/tasks/([^/]+)',
+     lambda g, m, a, b: g.delete_task(resolve_list(g, m[1]), m[2])),
+]
+ROUTES = [(method, re.compile(pattern + '$'), handler) for method, pattern, handler in ROUTES]
+
+
+# Route one API call; injected 429s apply to each call, including each call inside a batch
+def dispatch(google, method, path, args, raw):
+    if google.error_rate and google.rng.random() < google.error_rate:
+        google.errors += 1
+        return 429, error_body(429, 'Rate Limit Exceeded', 'rateLimitExceeded')
+    path = path.replace('%40', '@')
+    google.last_args[(method, path)] = args
+    for route_method, pattern, handler in ROUTES:
+        match = pattern.match(path)
+        if match and route_method == method:
+            return handler(google, match, args, json.loads(raw) if raw else {})
+    return 404, error_body(404, f'No fake route for {method} {path}')
+
+
+def resolve_list(google, list_id):
+    return google.task_lists[0]['id'] if list_id == '@default' and google.task_lists else list_id
+
+
+class FakeGoogleHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # Keep-alive, like the real endpoints
+    disable_nagle_algorithm = True  # Headers and body are written separately; don't stall on delayed ACKs
+    google = None
+
+    def handle_any(self):
+        google = self.google
+        url = urlparse(self.path)
+        args = {key: values[0] for key, values in parse_qs(url.query).items()}
+        length = int(self.headers.get('content-length') or 0)
+        raw = self.rfile.read(length) if length else b''
+        google.requests += 1
+        if google.latency or google.jitter:
+            time.sleep(google.latency + google.rng.random() * google.jitter)
+        if (url.path == '/batch' or url.path.startswith('/batch/')) and self.command == 'POST':
+            return self.respond_batch(raw)
+        self.respond(*dispatch(google, self.command, url.path, args, raw))
+
+    def respond(self, status, body):
+        payload = json.dumps(body).encode() if body is not None else b''
+        self.send_response(status)
+        if body is not None:
+            self.send_header('Content-Type', 'application/json; charset=UTF-8')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    # Answer a multipart/mixed batch request (/batch or /batch/<api>/<version>) by dispatching each call in it
+    def respond_batch(self, raw):
+        google = self.google
+        google.batches += 1
+        header = f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode()
+        message = email.message_from_bytes(header + raw)
+        boundary = f'batch_{uuid.uuid4().hex}'
+        parts = []
+        for part in message.get_payload():
+            head, _, body = part.get_payload().replace('\r\n', '\n').partition('\n\n')
+            method, target, _ = head.split('\n', 1)[0].split(' ', 2)
+            url = urlparse(target)
+            args = {key: values[0] for key, values in parse_qs(url.query).items()}
+            status, result = dispatch(google, method, url.path, args, body.strip().encode())
+            payload = json.dumps(result) if result is not None else ''
+            parts.append(f'--{boundary}\r\nContent-Type: application/http\r\n'
+                         f'Content-ID: <response-{part["Content-ID"][1:-1]}>\r\n\r\n'
+                         f'HTTP/1.1 {status} {HTTPStatus(status).phrase}\r\n'
+                         f'Content-Type: application/json; charset=UTF-8\r\n\r\n{payload}\r\n')
+        content = (''.join(parts) + f'--{boundary}--\r\n').encode()
+        self.send_response(200)
+        self.send_header('Content-Type', f'multipart/mixed; boundary={boundary}')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = handle_any
+
+    def log_message(self, format, *args):
+        pass
+
+
+# Start a fake server on a background thread; returns (server, google, root_url)
+def start_fake_google(host='127.0.0.1', port=0, **options):
+    google = FakeGoogle(**options)
+    handler = type('BoundFakeGoogleHandler', (FakeGoogleHandler,), {'google': google})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, google, f'http://{host}:{server.server_port}/'
+
+
+def add_arguments(parser):
+    parser.add_argument('--events', type=int, default=1000, help='single events on the primary calendar')
+    parser.add_argument('--recurring', type=int, default=10, help='daily recurring series on the primary calendar')
+    parser.add_argument('--calendars', type=int, default=3, help='calendars in the calendar list')
+    parser.add_argument('--task-lists', type=int, default=5)
+    parser.add_argument('--tasks-per-list', type=int, default=50)
+    parser.add_argument('--latency-ms', type=float, default=0, help='added to every response')
+    parser.add_argument('--jitter-ms', type=float, default=0, help='random extra latency up to this much')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests answered with 429')
+
+
+def fake_options(args):
+    return dict(events=args.events, recurring=args.recurring, calendars=args.calendars,
+                task_lists=args.task_lists, tasks_per_list=args.tasks_per_list,
+                latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, error_rate=args.error_rate)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Local stand-in for the Google Calendar and Tasks APIs")
+    parser.add_argument('--port', type=int, default=8089)
+    add_arguments(parser)
+    args = parser.parse_args()
+    server, _, root_url = start_fake_google(port=args.port, **fake_options(args))
+    print(f"Fake Google APIs listening on {root_url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,152 @@
+# Load scenarios for the backend against the local fake Google server
+#
+# Starts benchmarks/fake_google.py in-process, serves the backend on a local port
+# (Flask under werkzeug, or the ASGI app under uvicorn with --server asgi), and
+# reports p50/p99 latency and requests/sec per scenario. Run from the backend
+# directory:
+#     python benchmarks/load_test.py --events 10000 --latency-ms 30 --concurrency 16 --requests 400
+import argparse
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_google import add_arguments, fake_options, start_fake_google  # noqa: E402
+
+SCENARIOS = ('events', 'tasks', 'create_event', 'suggest_time_slots')
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+# Store a session holding long-lived fake credentials, returning its session id
+def create_session(flask_app):
+    from google.oauth2.credentials import Credentials
+    from services import save_credentials_to_session
+    credentials = Credentials(token='fake-token', refresh_token=None, token_uri='http://127.0.0.1/token',
+                              client_id='bench', client_secret='bench', scopes=['calendar', 'tasks'],
+                              expiry=datetime.utcnow() + timedelta(days=1))
+    data = {}
+    save_credentials_to_session(data, credentials)
+    interface = flask_app.session_interface
+    sid = 'loadtest'
+    interface.cache.set(interface.key_prefix + sid, data, timeout=24 * 60 * 60)
+    return sid, credentials
+
+
+def serve(server_kind, port):
+    if server_kind == 'asgi':
+        import uvicorn
+        from asgi import application
+        server = uvicorn.Server(uvicorn.Config(application, host='127.0.0.1', port=port, log_level='warning'))
+        threading.Thread(target=server.run, daemon=True).start()
+        while not server.started:
+            time.sleep(0.01)
+        return
+    import logging
+    from werkzeug.serving import make_server
+    from app import app
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)  # No per-request access log
+    server = make_server('127.0.0.1', port, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+
+def make_scenarios(base_url, sid, credentials):
+    import requests
+    from google_clients import get_calendar_service
+    from services import suggest_time_slots
+    local = threading.local()
+    cookies = {'session': sid}
+
+    def http():
+        if not hasattr(local, 'session'):
+            local.session = requests.Session()
+        return local.session
+
+    def events():
+        return http().get(base_url + '/events', cookies=cookies).status_code
+
+    def tasks():
+        return http().get(base_url + '/tasks', cookies=cookies).status_code
+
+    def create_event():
+        start = datetime.now(timezone.utc) + timedelta(days=1)
+        body = {'summary': 'Load test', 'start': {'dateTime': start.isoformat()},
+                'end': {'dateTime': (start + timedelta(minutes=30)).isoformat()}}
+        return http().post(base_url + '/create_event', json=body, cookies=cookies).status_code
+
+    def slots():
+        now = datetime.now(timezone.utc)
+        horizon = (now + timedelta(days=30)).isoformat().replace('+00:00', 'Z')
+        suggest_time_slots(get_calendar_service(credentials), 30, horizon, 1, horizon)
+        return 200
+
+    return {'events': events, 'tasks': tasks, 'create_event': create_event, 'suggest_time_slots': slots}
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def run_scenario(call, total, concurrency):
+    latencies = []
+    failures = 0
+
+    def once(_):
+        started = time.perf_counter()
+        try:
+            status = call()
+        except Exception:
+            status = 599
+        return time.perf_counter() - started, status
+
+    call()  # Warm up (first sync, connection setup) outside the measurement
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for latency, status in executor.map(once, range(total)):
+            latencies.append(latency)
+            failures += status >= 400
+    elapsed = time.perf_counter() - started
+    return percentile(latencies, 0.5), percentile(latencies, 0.99), total / elapsed, failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test backend routes against a fake Google server")
+    add_arguments(parser)
+    parser.add_argument('--server', choices=('wsgi', 'asgi'), default='wsgi')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=200, help='requests per scenario')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    args = parser.parse_args()
+
+    _, google, root_url = start_fake_google(**fake_options(args))
+    # The backend reads these at import time
+    os.environ['GOOGLE_API_ROOT_URL'] = root_url
+    os.environ.setdefault('SESSION_DB_PATH', os.path.join(tempfile.mkdtemp(), 'sessions.db'))
+    from app import app
+    sid, credentials = create_session(app)
+    port = free_port()
+    serve(args.server, port)
+    scenarios = make_scenarios(f'http://127.0.0.1:{port}', sid, credentials)
+
+    print(f"{args.server} server, {args.events} events, {args.task_lists}x{args.tasks_per_list} tasks, "
+          f"upstream latency {args.latency_ms}ms, 429 rate {args.error_rate}, concurrency {args.concurrency}")
+    print(f"{'scenario':<20} {'p50 ms':>9} {'p99 ms':>9} {'req/s':>9} {'errors':>7}")
+    for name in args.scenarios.split(','):
+        p50, p99, rate, failures = run_scenario(scenarios[name], args.requests, args.concurrency)
+        print(f"{name:<20} {p50 * 1000:>9.1f} {p99 * 1000:>9.1f} {rate:>9.1f} {failures:>7}")
+    print(f"upstream requests: {google.requests}, injected 429s: {google.errors}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,364 @@
+# Bulk export and import of events and tasks as NDJSON or iCalendar, streamed one item at a time
+import json
+import re
+import time
+from datetime import date, datetime, timedelta, timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+from googleapiclient.errors import HttpError
+from event_store import PAGE_SIZE as EVENTS_PAGE_SIZE
+from outbox import backoff, is_retryable
+from services import BATCH_LIMIT, TASKS_PAGE_SIZE, batch_item_result, execute_batch, iter_items
+from services import validate_event_input
+
+TRANSFER_FORMATS = {'ndjson': 'application/x-ndjson', 'ics': 'text/calendar'}
+IMPORT_ATTEMPTS = 4  # Sends of an item refused with a retryable status before it is reported as failed
+# Fields Google sets itself; an exported item keeps them, but an insert must not carry them
+EVENT_READ_ONLY_FIELDS = ('kind', 'id', 'etag', 'htmlLink', 'created', 'updated', 'creator', 'organizer',
+                          'sequence', 'hangoutLink')
+TASK_READ_ONLY_FIELDS = ('kind', 'id', 'etag', 'selfLink', 'updated', 'parent', 'position', 'links',
+                         'webViewLink', 'hidden', 'deleted')
+ICS_LINE_OCTETS = 75  # RFC 5545 folds longer content lines
+ICS_TEXT_FIELDS = (('SUMMARY', 'summary'), ('DESCRIPTION', 'description'), ('LOCATION', 'location'))
+ICS_RECURRENCE = ('RRULE', 'EXRULE', 'RDATE', 'EXDATE')
+
+_PROPERTY = re.compile(r'(?P<name>[A-Za-z0-9-]+)(?P<params>(?:;[^;:=]+=(?:"[^"]*"|[^;:"]*))*):(?P<value>.*)')
+_PARAMETER = re.compile(r';([^;:=]+)=("[^"]*"|[^;:"]*)')
+_DURATION = re.compile(r'([+-])?P(?:(\d+)W)?(?:(\d+)D)?(?:T(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?)?$')
+_ESCAPED = re.compile(r'\\(.)')
+
+
+# Export
+
+
+# Yield the user's events (primary calendar) and then their tasks (every list), one upstream page at a time
+def iter_export(calendar_service, tasks_service, kinds=('events', 'tasks')):
+    if 'events' in kinds:
+        yield from iter_items(calendar_service.events().list, calendarId='primary', maxResults=EVENTS_PAGE_SIZE)
+    if 'tasks' in kinds:
+        for task_list in iter_items(tasks_service.tasklists().list, maxResults=TASKS_PAGE_SIZE):
+            yield from iter_items(tasks_service.tasks().list, tasklist=task_list['id'], maxResults=TASKS_PAGE_SIZE,
+                                  showCompleted=True, showHidden=True)
+
+
+def format_ndjson(items):
+    for item in items:
+        yield json.dumps(item) + '\n'
+
+
+# Encode events and tasks as one VCALENDAR, yielding a chunk per component
+def format_ics(items):
+    yield ics_chunk(['BEGIN:VCALENDAR', 'VERSION:2.0', 'PRODID:-//DuraTasks//Export//EN'])
+    for item in items:
+        yield ics_chunk(ics_task(item) if item.get('kind') == 'tasks#task' else ics_event(item))
+    yield ics_chunk(['END:VCALENDAR'])
+
+
+def ics_chunk(lines):
+    return ''.join(fold(line) + '\r\n' for line in lines)
+
+
+# Split a content line into continuation lines of at most 75 octets, never inside a UTF-8 character
+def fold(line):
+    if len(line.encode()) <= ICS_LINE_OCTETS:
+        return line
+    parts, current, size = [], '', 0
+    for char in line:
+        width = len(char.encode())
+        if size + width > ICS_LINE_OCTETS:
+            parts.append(current)
+            current, size = '', 1  # The leading space of a continuation line counts
+        current += char
+        size += width
+    parts.append(current)
+    return '\r\n '.join(parts)
+
+
+def escape_text(value):
+    return (value.replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,')
+            .replace('\r\n', '\\n').replace('\n', '\\n'))
+
+
+def ics_stamp(value=None):
+    moment = datetime.fromisoformat(value.replace('Z', '+00:00')) if value else datetime.now(timezone.utc)
+    return f'{moment.astimezone(timezone.utc):%Y%m%dT%H%M%SZ}'
+
+
+# An event's start, end or originalStartTime as a DTSTART-style property
+def ics_time(name, value):
+    if value.get('date'):
+        return f"{name};VALUE=DATE:{value['date'].replace('-', '')}"
+    moment = datetime.fromisoformat(value['dateTime'].replace('Z', '+00:00'))
+    zone = value.get('timeZone')
+    if zone:
+        try:
+            local = moment.astimezone(ZoneInfo(zone)) if moment.tzinfo else moment
+            return f'{name};TZID={zone}:{local:%Y%m%dT%H%M%S}'
+        except ZoneInfoNotFoundError:
+            pass
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return f'{name}:{moment.astimezone(timezone.utc):%Y%m%dT%H%M%SZ}'
+
+
+def ics_event(event):
+    lines = ['BEGIN:VEVENT', f"UID:{event.get('iCalUID') or event['id'] + '@google.com'}",
+             f"DTSTAMP:{ics_stamp(event.get('updated'))}"]
+    for name, field in (('DTSTART', 'start'), ('DTEND', 'end'), ('RECURRENCE-ID', 'originalStartTime')):
+        if event.get(field):
+            lines.append(ics_time(name, event[field]))
+    lines.extend(f'{name}:{escape_text(event[field])}' for name, field in ICS_TEXT_FIELDS if event.get(field))
+    if event.get('status'):
+        lines.append(f"STATUS:{event['status'].upper()}")
+    # Google keeps recurrence rules as iCalendar lines already
+    lines.extend(event.get('recurrence', []))
+    lines.append('END:VEVENT')
+    return lines
+
+
+def ics_task(task):
+    lines = ['BEGIN:VTODO', f"UID:{task['id']}", f"DTSTAMP:{ics_stamp(task.get('updated'))}"]
+    if task.get('title'):
+        lines.append(f"SUMMARY:{escape_text(task['title'])}")
+    if task.get('notes'):
+        lines.append(f"DESCRIPTION:{escape_text(task['notes'])}")
+    if task.get('due'):
+        # Google Tasks keeps only the date of a due time
+        lines.append(f"DUE;VALUE=DATE:{task['due'][:10].replace('-', '')}")
+    lines.append('STATUS:COMPLETED' if task.get('status') == 'completed' else 'STATUS:NEEDS-ACTION')
+    if task.get('completed'):
+        lines.append(f"COMPLETED:{ics_stamp(task['completed'])}")
+    lines.append('END:VTODO')
+    return lines
+
+
+# Import
+
+
+# Decode an uploaded byte stream line by line, so no more than one line is held at a time
+def iter_text_lines(stream):
+    for number, line in enumerate(stream):
+        text = line.decode('utf-8', errors='replace')
+        yield text.lstrip('\ufeff') if number == 0 else text
+
+
+# Yield (kind, body, errors) for each line of an NDJSON file; kind is 'event' or 'task'
+def parse_ndjson(lines):
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            item = json.loads(line)
+        except ValueError as e:
+            yield None, None, [f"Invalid JSON: {e}"]
+            continue
+        if not isinstance(item, dict):
+            yield None, None, ["Each line must be a JSON object"]
+            continue
+        yield ('task' if item.get('kind') == 'tasks#task' else 'event'), item, []
+
+
+# Join folded continuation lines back onto the line they continue
+def unfold(lines):
+    current = None
+    for line in lines:
+        line = line.rstrip('\r\n')
+        if line[:1] in (' ', '\t') and current is not None:
+            current += line[1:]
+            continue
+        if current:
+            yield current
+        current = line
+    if current:
+        yield current
+
+
+# Yield (kind, body, errors) for each VEVENT and VTODO of an iCalendar file as it is read;
+# components nested inside them (alarms) and everything else in the file are skipped
+def parse_ics(lines):
+    component, properties, nested = None, None, 0
+    for line in unfold(lines):
+        match = _PROPERTY.match(line)
+        if match is None:
+            continue
+        name, value = match['name'].upper(), match['value']
+        if name == 'BEGIN':
+            if component is not None:
+                nested += 1
+            elif value.upper() in ('VEVENT', 'VTODO'):
+                component, properties = value.upper(), []
+        elif name == 'END':
+            if nested:
+                nested -= 1
+            elif component is not None and value.upper() == component:
+                yield ics_resource(component, properties)
+                component = None
+        elif component is not None and not nested:
+            parameters = {key.upper(): value.strip('"') for key, value in _PARAMETER.findall(match['params'])}
+            properties.append((name, parameters, value, line))
+
+
+def ics_resource(component, properties):
+    try:
+        if component == 'VTODO':
+            return 'task', task_from_ics(properties), []
+        return 'event', event_from_ics(properties), []
+    except ValueError as e:
+        return ('task' if component == 'VTODO' else 'event'), None, [f"Invalid {component}: {e}"]
+
+
+def unescape_text(value):
+    return _ESCAPED.sub(lambda match: '\n' if match[1] in 'nN' else match[1], value)
+
+
+# A DTSTART-style value as a Calendar API time: all-day, UTC, or local time in its TZID
+# (floating times, which have no zone, are taken as UTC)
+def parse_ics_time(value, parameters):
+    if parameters.get('VALUE') == 'DATE' or len(value) == 8:
+        return {'date': date(int(value[:4]), int(value[4:6]), int(value[6:8])).isoformat()}
+    moment = datetime.strptime(value.rstrip('Z'), '%Y%m%dT%H%M%S')
+    if value.endswith('Z') or 'TZID' not in parameters:
+        return {'dateTime': f'{moment:%Y-%m-%dT%H:%M:%S}Z'}
+    return {'dateTime': f'{moment:%Y-%m-%dT%H:%M:%S}', 'timeZone': parameters['TZID']}
+
+
+def parse_duration(value):
+    match = _DURATION.match(value)
+    if match is None:
+        raise ValueError(f"unsupported DURATION {value}")
+    sign, weeks, days, hours, minutes, seconds = match.groups()
+    duration = timedelta(weeks=int(weeks or 0), days=int(days or 0), hours=int(hours or 0),
+                         minutes=int(minutes or 0), seconds=int(seconds or 0))
+    return -duration if sign == '-' else duration
+
+
+# The end of an event lasting `duration` from start, in the same form as start
+def shift_time(start, duration):
+    if 'date' in start:
+        return {'date': (date.fromisoformat(start['date']) + timedelta(days=max(duration.days, 1))).isoformat()}
+    utc = start['dateTime'].endswith('Z')
+    moment = datetime.fromisoformat(start['dateTime'].rstrip('Z')) + duration
+    return dict(start, dateTime=f"{moment:%Y-%m-%dT%H:%M:%S}{'Z' if utc else ''}")
+
+
+def event_from_ics(properties):
+    event, recurrence, duration = {}, [], None
+    text_fields = dict(ICS_TEXT_FIELDS)
+    for name, parameters, value, line in properties:
+        if name in text_fields:
+            event[text_fields[name]] = unescape_text(value)
+        elif name == 'UID':
+            event['iCalUID'] = value
+        elif name == 'DTSTART':
+            event['start'] = parse_ics_time(value, parameters)
+        elif name == 'DTEND':
+            event['end'] = parse_ics_time(value, parameters)
+        elif name == 'DURATION':
+            duration = parse_duration(value)
+        elif name == 'RECURRENCE-ID':
+            event['originalStartTime'] = parse_ics_time(value, parameters)
+        elif name in ICS_RECURRENCE:
+            recurrence.append(line)
+        elif name == 'STATUS' and value.lower() in ('confirmed', 'tentative', 'cancelled'):
+            event['status'] = value.lower()
+    if recurrence:
+        event['recurrence'] = recurrence
+    if 'start' in event and 'end' not in event:
+        # RFC 5545: without DTEND an event lasts DURATION, or one day if all-day, or no time at all
+        event['end'] = shift_time(event['start'], duration or timedelta())
+    return event
+
+
+def task_from_ics(properties):
+    task = {'status': 'needsAction'}
+    for name, parameters, value, _ in properties:
+        if name == 'SUMMARY':
+            task['title'] = unescape_text(value)
+        elif name == 'DESCRIPTION':
+            task['notes'] = unescape_text(value)
+        elif name == 'DUE':
+            due = parse_ics_time(value, parameters)
+            task['due'] = f"{due.get('date') or due['dateTime'][:10]}T00:00:00.000Z"
+        elif name == 'STATUS':
+            task['status'] = 'completed' if value.upper() == 'COMPLETED' else 'needsAction'
+        elif name == 'COMPLETED':
+            completed = parse_ics_time(value, {})
+            task['completed'] = completed.get('dateTime') or f"{completed['date']}T00:00:00.000Z"
+    return task
+
+
+# Checks made before an item is sent; the Calendar API cannot insert a changed occurrence on its own
+def import_errors(kind, body):
+    if kind == 'task':
+        return []
+    if body.get('recurringEventId') or body.get('originalStartTime'):
+        return ["Changed occurrences of recurring events cannot be imported"]
+    return validate_event_input(body)
+
+
+def import_items(calendar_service, tasks_service, items, tasklist='@default', on_created=None,
+                 batch_size=BATCH_LIMIT):
+    """Create parsed (kind, body, errors) items upstream in batch requests of batch_size.
+
+    Events carrying an iCalUID, as every exported event does, are sent with
+    events.import, so importing the same file again updates those events
+    instead of failing as duplicates.
+
+    Yields a report for every item that could not be created as soon as it is
+    known, a 'progress' report after each batch and a final 'done' report.
+    Only one batch of items per kind is held in memory. Items refused with a
+    rate limit or server error are resent with backoff, up to IMPORT_ATTEMPTS.
+    """
+    counts = {"processed": 0, "imported": 0, "failed": 0}
+    pending = {'event': [], 'task': []}
+
+    def request(kind, body):
+        if kind == 'event':
+            body = {key: value for key, value in body.items() if key not in EVENT_READ_ONLY_FIELDS}
+            if body.get('iCalUID'):
+                # insert refuses an iCalUID the calendar already has (409); import adds the event or updates it
+                return calendar_service.events().import_(calendarId='primary', body=body)
+            return calendar_service.events().insert(calendarId='primary', body=body)
+        body = {key: value for key, value in body.items() if key not in TASK_READ_ONLY_FIELDS}
+        return tasks_service.tasks().insert(tasklist=tasklist, body=body)
+
+    def send(kind):
+        batch, pending[kind] = pending[kind], []
+        service = calendar_service if kind == 'event' else tasks_service
+        attempt = 1
+        while batch:
+            outcomes = execute_batch(service, [(index, request(kind, body)) for index, body in batch])
+            retry = []
+            for index, body in batch:
+                response, exception = outcomes.get(str(index), (None, None))
+                if (isinstance(exception, HttpError) and is_retryable(exception)
+                        and attempt < IMPORT_ATTEMPTS):
+                    retry.append((index, body))
+                    continue
+                counts["processed"] += 1
+                if exception is None:
+                    counts["imported"] += 1
+                    if on_created is not None:
+                        on_created(kind, response)
+                else:
+                    counts["failed"] += 1
+                    yield dict(batch_item_result(index, None, exception), type='error')
+            if retry:
+                time.sleep(backoff(attempt))
+                attempt += 1
+            batch = retry
+        yield dict(counts, type='progress')
+
+    for index, (kind, body, errors) in enumerate(items):
+        errors = errors or import_errors(kind, body)
+        if errors:
+            counts["processed"] += 1
+            counts["failed"] += 1
+            yield {"type": "error", "index": index, "status": 400, "error": "Invalid item", "details": errors}
+            continue
+        pending[kind].append((index, body))
+        if len(pending[kind]) >= batch_size:
+            yield from send(kind)
+    for kind in pending:
+        if pending[kind]:
+            yield from send(kind)
+    yield dict(counts, type='done')
@@ -0,0 +1,144 @@
+# Per-user feed of event and task changes, replayed to /stream clients by Last-Event-ID
+import json
+import os
+import threading
+import uuid
+from collections import OrderedDict, deque
+
+FEED_LENGTH = 1000  # Changes kept per user for clients resuming with Last-Event-ID
+FEED_USERS = 10000  # Users whose changes are kept; the least recently changed are forgotten first
+STREAM_RETRY_MS = 3000  # Reconnection delay suggested to EventSource clients
+STREAM_HEARTBEAT_SECONDS = 15  # A quiet stream syncs with Google and sends a comment this often
+CHANGE_ACTIONS = {'create': 'created', 'update': 'updated', 'delete': 'deleted'}  # Write operation -> change
+GENERATION = None  # Set per process by new_generation(); ids from another process or run cannot be resumed
+
+
+class ChangeFeed:
+    """Bounded per-user history of changes with wake-ups for waiting streams.
+
+    Subscribers register a callable that is invoked (from whichever thread
+    published) whenever the user has a new change, so both threads and
+    asyncio tasks can wait on the feed without polling it.
+
+    Histories are kept for at most max_users users. A forgotten user's
+    client is told to reset if its cursor is older than the newest change
+    forgotten with any user, since some of those may have been its own.
+    """
+
+    def __init__(self, length=FEED_LENGTH, max_users=FEED_USERS):
+        self.length = length
+        self.max_users = max_users
+        self.lock = threading.Lock()
+        self.changes = OrderedDict()  # user key -> deque of (sequence, change), least recently changed first
+        self.subscribers = {}  # user key -> set of callables
+        self.listeners = []  # callables given (user key, change) for every change of every user
+        self.evicted = {}  # user key -> newest sequence dropped from their deque
+        self.forgotten = 0  # Newest sequence in any history dropped with its user
+        self.sequence = 0
+
+    def publish(self, user_key, kind, action, resource):
+        """Record that a user's event or task was created, updated or deleted ('reset' when everything may have)."""
+        change = {"kind": kind, "action": action}
+        if resource is not None:
+            change["id"] = resource.get('id')
+            if action != 'deleted':
+                change["resource"] = resource
+        with self.lock:
+            self.sequence += 1
+            changes = self.changes.setdefault(user_key, deque(maxlen=self.length))
+            self.changes.move_to_end(user_key)
+            if len(changes) == changes.maxlen:
+                self.evicted[user_key] = changes[0][0]
+            changes.append((self.sequence, change))
+            while len(self.changes) > self.max_users:
+                forgotten_key, forgotten = self.changes.popitem(last=False)
+                self.evicted.pop(forgotten_key, None)
+                self.forgotten = max(self.forgotten, forgotten[-1][0])
+            subscribers = list(self.subscribers.get(user_key, ()))
+        for listener in self.listeners:
+            listener(user_key, change)
+        for wake in subscribers:
+            wake()
+
+    def listen(self, listener):
+        """Call listener(user_key, change) from the publishing thread for every change published."""
+        self.listeners.append(listener)
+
+    def subscribe(self, user_key, wake):
+        with self.lock:
+            self.subscribers.setdefault(user_key, set()).add(wake)
+
+    def unsubscribe(self, user_key, wake):
+        with self.lock:
+            subscribers = self.subscribers.get(user_key)
+            if subscribers is not None:
+                subscribers.discard(wake)
+                if not subscribers:
+                    del self.subscribers[user_key]
+
+    def cursor(self):
+        """The id of the newest change, where a new client starts."""
+        with self.lock:
+            return format_id(self.sequence)
+
+    def since(self, user_key, last_id):
+        """Return [(id, change)] after last_id, or None if that point is no longer covered."""
+        after = parse_id(last_id)
+        with self.lock:
+            if after is None or after > self.sequence:
+                return None
+            changes = self.changes.get(user_key)
+            floor = self.evicted.get(user_key, 0) if changes is not None else self.forgotten
+            if floor > after:
+                return None
+            return [(format_id(sequence), change) for sequence, change in changes or () if sequence > after]
+
+    def replay(self, user_key, cursor):
+        """Server-sent events for the user's changes after cursor, and the cursor to continue from.
+
+        A client whose cursor can no longer be served is sent a 'reset' event
+        and must refetch its lists.
+        """
+        changes = self.since(user_key, cursor)
+        if changes is None:
+            cursor = self.cursor()
+            return [format_sse(cursor, 'reset', '{}')], cursor
+        messages = [format_sse(event_id, 'change', json.dumps(change)) for event_id, change in changes]
+        return messages, changes[-1][0] if changes else cursor
+
+
+def format_id(sequence):
+    return f'{GENERATION}-{sequence}'
+
+
+# The sequence in an id issued by this process, or None for anyone else's id
+def parse_id(event_id):
+    generation, _, sequence = (event_id or '').partition('-')
+    if generation != GENERATION or not sequence.isdigit():
+        return None
+    return int(sequence)
+
+
+# Encode one change (or a comment, for heartbeats) as a server-sent event
+def format_sse(event_id=None, event=None, data=None, comment=None):
+    lines = [f': {comment}'] if comment else []
+    if event_id:
+        lines.append(f'id: {event_id}')
+    if event:
+        lines.append(f'event: {event}')
+    if data is not None:
+        lines.append(f'data: {data}')
+    return '\n'.join(lines) + '\n\n'
+
+
+# Workers forked from a preloading master must not share the master's generation,
+# or an id issued by one worker would be resumed against another's unrelated sequence
+def new_generation():
+    global GENERATION
+    GENERATION = uuid.uuid4().hex[:8]
+
+
+new_generation()
+os.register_at_fork(after_in_child=new_generation)
+
+feed = ChangeFeed()
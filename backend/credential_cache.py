@@ -0,0 +1,136 @@
+# In-process credential cache with proactive token refresh
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from google.auth._helpers import REFRESH_THRESHOLD
+from google.auth.exceptions import RefreshError
+from google.auth.transport.requests import Request
+from google_clients import get_http_session
+from metrics import record_cache, record_refresh
+from services import deserialize_credentials, get_user_key, save_credentials_to_session
+
+REFRESH_MARGIN = timedelta(minutes=5)  # Refresh tokens this long before they expire
+IDLE_TTL = 60 * 60  # Seconds an unused entry is kept before eviction
+SWEEP_INTERVAL = 30  # Seconds between background refresh/eviction passes
+REFRESH_WORKERS = 4
+
+
+class CachedCredentials:
+    """One user's live Credentials plus the session payload they were loaded from."""
+
+    def __init__(self, credentials, blob):
+        self.credentials = credentials
+        self.source_blob = blob  # Payload the entry was built from
+        self.blob = blob  # Payload matching the current token
+        self.token = credentials.token
+        self.last_used = time.monotonic()
+        self.lock = threading.Lock()  # Serialises refreshes for this user
+
+    def needs_refresh(self, margin=REFRESH_MARGIN):
+        expiry = self.credentials.expiry
+        if not self.credentials.refresh_token:
+            return False
+        if self.credentials.token is None:
+            return True
+        if expiry is None:
+            return False
+        # google-auth keeps expiry as a naive UTC datetime
+        return expiry - margin <= datetime.utcnow()
+
+
+class CredentialCache:
+    """Credentials per user key, refreshed in the background shortly before expiry."""
+
+    def __init__(self, refresh_margin=REFRESH_MARGIN, idle_ttl=IDLE_TTL, sweep_interval=SWEEP_INTERVAL):
+        self.refresh_margin = refresh_margin
+        self.idle_ttl = idle_ttl
+        self.sweep_interval = sweep_interval
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=REFRESH_WORKERS, thread_name_prefix='credential-refresh')
+        self._sweeper = None
+
+    def get(self, session):
+        """Return the session's Credentials, writing back any refreshed token."""
+        blob = session.get('credentials')
+        if not blob:
+            return None
+        key = get_user_key(session)
+        entry = self._entries.get(key)
+        hit = entry is not None and blob in (entry.source_blob, entry.blob)
+        record_cache('credentials', hit)
+        if not hit:
+            entry = CachedCredentials(deserialize_credentials(json.loads(blob)), blob)
+            with self._lock:
+                self._entries[key] = entry
+            self._ensure_sweeper()
+        entry.last_used = time.monotonic()
+
+        # Only a token google-auth no longer considers valid is refreshed on the request path. It treats
+        # tokens as expired REFRESH_THRESHOLD before their expiry, so the refresh must use that margin too.
+        if not entry.credentials.valid:
+            self.refresh(entry, margin=REFRESH_THRESHOLD, trigger='expired')
+        if entry.credentials.token != entry.token:
+            entry.token = entry.credentials.token
+            save_credentials_to_session(session, entry.credentials)
+            entry.blob = session['credentials']
+        elif blob != entry.blob:
+            session['credentials'] = entry.blob
+        return entry.credentials
+
+    def refresh(self, entry, margin=None, trigger='background'):
+        """Refresh an entry's access token unless another thread already has."""
+        margin = self.refresh_margin if margin is None else margin
+        with entry.lock:
+            if not entry.needs_refresh(margin):
+                return
+            try:
+                entry.credentials.refresh(Request(get_http_session()))
+                record_refresh(trigger, True)
+            except RefreshError as e:
+                record_refresh(trigger, False)
+                logging.error(f"Credential refresh failed: {e}")
+
+    def evict(self, session):
+        """Drop the cached credentials for this session's user."""
+        with self._lock:
+            self._entries.pop(get_user_key(session), None)
+
+    def sweep(self):
+        """Evict idle entries and refresh those close to expiry in the background."""
+        now = time.monotonic()
+        with self._lock:
+            for key, entry in list(self._entries.items()):
+                if now - entry.last_used > self.idle_ttl:
+                    del self._entries[key]
+            entries = list(self._entries.values())
+        for entry in entries:
+            if entry.needs_refresh(self.refresh_margin):
+                self._executor.submit(self.refresh, entry)
+
+    def _ensure_sweeper(self):
+        if self._sweeper is not None:
+            return
+        with self._lock:
+            if self._sweeper is None:
+                self._sweeper = threading.Thread(target=self._run_sweeper, name='credential-sweeper', daemon=True)
+                self._sweeper.start()
+
+    def _run_sweeper(self):
+        while True:
+            time.sleep(self.sweep_interval)
+            try:
+                self.sweep()
+            except Exception as e:
+                logging.error(f"Credential sweep failed: {e}")
+
+
+credential_cache = CredentialCache()
+
+
+# Get credentials for the current session from the process-wide cache
+def get_cached_credentials(session):
+    return credential_cache.get(session)
@@ -0,0 +1,412 @@
+# Per-user local event store kept current with Calendar sync tokens
+import base64
+import os
+import queue
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from functools import partial
+from googleapiclient.errors import HttpError
+from services import iter_pages
+from change_feed import feed
+from http_cache import items_etag
+from metrics import record_cache
+from recurrence import SeriesExpansions, instance_key, is_recurring_master
+
+SYNC_WINDOW_DAYS = 2 * 365  # Days either side of now covered by a full sync
+RESYNC_AFTER = timedelta(days=1)  # Age after which the window is re-anchored
+PAGE_SIZE = 2500  # Largest page the Calendar API will return
+MAX_EVENT_STORES = int(os.getenv('MAX_EVENT_STORES', '1000'))  # Users whose calendars are kept per process
+# Sync recurring series as masters plus exceptions and expand them locally, instead of
+# having Google send every instance (singleEvents=True)
+EXPAND_RECURRENCE = os.getenv('EXPAND_RECURRENCE', '').lower() in ('1', 'true', 'yes')
+
+
+# The [time_min, time_max) range listed by /events: SYNC_WINDOW_DAYS either side of today (UTC).
+# Anchoring on the day keeps the range, and so the cached listing and its ETag, stable between requests.
+def list_window(now=None):
+    today = (now or datetime.now(timezone.utc)).replace(hour=0, minute=0, second=0, microsecond=0)
+    return today - timedelta(days=SYNC_WINDOW_DAYS), today + timedelta(days=SYNC_WINDOW_DAYS)
+
+
+# Convert an event's start or end field to a UTC datetime
+def event_time(event, field='start'):
+    value = event.get(field, {})
+    if value.get('dateTime'):
+        return datetime.fromisoformat(value['dateTime'].replace('Z', '+00:00')).astimezone(timezone.utc)
+    if value.get('date'):
+        return datetime.fromisoformat(value['date']).replace(tzinfo=timezone.utc)
+    return None
+
+
+def _sort_key(event):
+    return (int(event_time(event, 'start').timestamp()), event['id'])
+
+
+# Cursors are opaque to clients: the (start, id) sort key of the last item sent
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(f"{key[0]}:{key[1]}".encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        start, event_id = base64.urlsafe_b64decode(cursor.encode()).decode().split(':', 1)
+        return (int(start), event_id)
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError("Invalid cursor")
+
+
+# Async counterpart of services.iter_pages: yield each page of a list call
+async def execute_pages(list_method, execute, **params):
+    page_token = None
+    while True:
+        page = await execute(list_method(pageToken=page_token, **params))
+        yield page
+        page_token = page.get('nextPageToken')
+        if not page_token:
+            return
+
+
+class EventStore:
+    """Local copy of one user's primary calendar, refreshed with sync tokens.
+
+    With expand_recurrence, recurring series are stored as their master event
+    plus any modified or cancelled instances, and instances are generated
+    only for the window being listed.
+    """
+
+    def __init__(self, expand_recurrence=EXPAND_RECURRENCE):
+        self.expand_recurrence = expand_recurrence
+        self.events = {}
+        self.exceptions = {}  # master id -> {original start epoch: instance overriding it}
+        self.expansions = SeriesExpansions()
+        self.sync_token = None
+        self.synced_at = None
+        self.window = None
+        self.version = 0  # Bumped on every change so cached listings and the search mirror know to rebuild
+        self.notified = None  # Push notification sequence the contents reflect (see watch_channels)
+        self.on_change = None  # Called with (action, event) for each change, or ('reset', None) after a full sync
+        self._listing = (None, None, None)  # ((version, time_min, time_max), events, etag)
+        self.lock = threading.RLock()
+        # Held for the whole of every sync, threaded or async, so a store is never synced twice at once
+        self.sync_lock = threading.Lock()
+        self._async_lock = None  # Created on first use inside the event loop
+
+    def sync(self, service, sequence=None):
+        """Bring the store up to date, doing a full sync only when required.
+
+        sequence is the user's push notification sequence when Google is
+        watching their calendar; while it is unchanged nothing has changed
+        upstream and no call is made.
+        """
+        # Only sync_lock is held across the upstream calls; the state is swapped under self.lock,
+        # so reads are served from the previous contents meanwhile, as during an async sync
+        with self.sync_lock:
+            if self.is_current(sequence):
+                record_cache('event_store', True)
+                return
+            if self.needs_full_sync():
+                for _ in self.full_sync_pages(service):
+                    pass
+            else:
+                try:
+                    self._incremental_sync(service)
+                except HttpError as error:
+                    # 410 Gone means the sync token expired and must be discarded
+                    if error.resp.status != 410:
+                        raise
+                    for _ in self.full_sync_pages(service):
+                        pass
+            self.notified = sequence
+
+    def is_current(self, sequence):
+        return sequence is not None and sequence == self.notified and not self.needs_full_sync()
+
+    def stream(self, service, time_min=None, time_max=None, sequence=None):
+        """Yield events as they become available.
+
+        A cold store yields each upstream page as it arrives (in upstream
+        order); a warm store syncs deltas and yields its ordered contents.
+        Series must be complete before they can be expanded, so a store that
+        expands recurrence always syncs first.
+        """
+        if self.needs_full_sync() and not self.expand_recurrence and self.sync_lock.acquire(blocking=False):
+            # Another request may have finished a full sync just before the lock was taken
+            if self.needs_full_sync():
+                yield from self._stream_full_sync(service, sequence)
+                return
+            self.sync_lock.release()
+        self.sync(service, sequence)
+        yield from self.list_events(time_min, time_max)
+
+    def _stream_full_sync(self, service, sequence):
+        """Yield the events of a full sync run in its own thread, which holds the already acquired
+        sync_lock only until the last page arrives, however slowly the events are consumed."""
+        pages = queue.SimpleQueue()
+
+        def run():
+            try:
+                for items in self.full_sync_pages(service):
+                    pages.put(items)
+                self.notified = sequence
+                pages.put(None)
+            except Exception as error:
+                pages.put(error)
+            finally:
+                self.sync_lock.release()
+
+        threading.Thread(target=run, name='full-sync', daemon=True).start()
+        while (items := pages.get()) is not None:
+            if isinstance(items, Exception):
+                raise items
+            yield from items
+
+    def needs_full_sync(self):
+        if self.sync_token is None or self.synced_at is None:
+            return True
+        return datetime.now(timezone.utc) - self.synced_at > RESYNC_AFTER
+
+    def _full_sync_params(self):
+        now = datetime.now(timezone.utc)
+        time_min = now - timedelta(days=SYNC_WINDOW_DAYS)
+        time_max = now + timedelta(days=SYNC_WINDOW_DAYS)
+        params = dict(calendarId='primary', timeMin=time_min.isoformat(), timeMax=time_max.isoformat(),
+                      maxResults=PAGE_SIZE, singleEvents=not self.expand_recurrence)
+        return params, now, (time_min, time_max)
+
+    def _delta_params(self):
+        return dict(calendarId='primary', syncToken=self.sync_token, maxResults=PAGE_SIZE,
+                    singleEvents=not self.expand_recurrence)
+
+    def _commit_full_sync(self, items, sync_token, synced_at, window):
+        with self.lock:
+            self.events = {}
+            self.exceptions = {}
+            self.expansions.clear()
+            for event in items:
+                self._apply(event, publish=False)
+            self.sync_token = sync_token
+            self.synced_at = synced_at
+            self.window = window
+            self.version += 1
+            self._publish('reset', None)
+
+    def _apply_delta_page(self, page):
+        with self.lock:
+            for event in page.get('items', []):
+                self._apply(event)
+            self.sync_token = page.get('nextSyncToken', self.sync_token)
+
+    def full_sync_pages(self, service):
+        """Run a full sync, yielding the live events of each page as it arrives.
+
+        The stored state is replaced only once the final page is received.
+        """
+        record_cache('event_store', False)
+        params, now, window = self._full_sync_params()
+        items = []
+        sync_token = None
+        for page in iter_pages(service.events().list, **params):
+            items.extend(page.get('items', []))
+            sync_token = page.get('nextSyncToken')
+            yield [event for event in page.get('items', []) if event.get('status') != 'cancelled']
+        self._commit_full_sync(items, sync_token, now, window)
+
+    def _incremental_sync(self, service):
+        for page in iter_pages(service.events().list, **self._delta_params()):
+            self._apply_delta_page(page)
+        record_cache('event_store', True)
+
+    async def sync_async(self, service, execute, sequence=None):
+        """Async counterpart of sync(); execute(request) awaits one upstream call."""
+        if self._async_lock is None:
+            import asyncio  # Only the ASGI app syncs asynchronously; plain Flask workers never load asyncio
+            self._async_lock = asyncio.Lock()
+        async with self._async_lock:
+            await self._acquire_sync_lock()
+            try:
+                await self._sync_async(service, execute, sequence)
+            finally:
+                self.sync_lock.release()
+
+    async def _acquire_sync_lock(self):
+        """Take sync_lock from the event loop, waiting in a thread while a threaded sync holds it."""
+        import asyncio
+        if self.sync_lock.acquire(blocking=False):
+            return
+        acquiring = asyncio.ensure_future(asyncio.to_thread(self.sync_lock.acquire))
+        try:
+            await asyncio.shield(acquiring)
+        except asyncio.CancelledError:
+            # The thread still gets the lock; give it back as soon as it does
+            acquiring.add_done_callback(lambda _: self.sync_lock.release())
+            raise
+
+    async def _sync_async(self, service, execute, sequence):
+        if self.is_current(sequence):
+            record_cache('event_store', True)
+            return
+        if not self.needs_full_sync():
+            try:
+                async for page in execute_pages(service.events().list, execute, **self._delta_params()):
+                    self._apply_delta_page(page)
+                record_cache('event_store', True)
+                self.notified = sequence
+                return
+            except HttpError as error:
+                if error.resp.status != 410:
+                    raise
+        record_cache('event_store', False)
+        params, now, window = self._full_sync_params()
+        items = []
+        sync_token = None
+        async for page in execute_pages(service.events().list, execute, **params):
+            items.extend(page.get('items', []))
+            sync_token = page.get('nextSyncToken')
+        self._commit_full_sync(items, sync_token, now, window)
+        self.notified = sequence
+
+    def _apply(self, event, publish=True):
+        master_id = event.get('recurringEventId')
+        previous = self.events.get(event['id'])
+        if event.get('status') == 'cancelled':
+            action = 'deleted'
+        elif previous is None:
+            action = 'created'
+        elif previous.get('etag') and previous.get('etag') == event.get('etag'):
+            publish = False  # A delta sync returning a write this app already applied
+            action = 'updated'
+        else:
+            action = 'updated'
+        if self.expand_recurrence and master_id and event.get('originalStartTime'):
+            # A modified or cancelled instance replaces the one generated from the rule
+            self.exceptions.setdefault(master_id, {})[instance_key(event['originalStartTime'])] = event
+            if action == 'created':
+                action = 'updated'  # The instance existed already, generated from the rule
+        elif event.get('status') == 'cancelled':
+            self.events.pop(event['id'], None)
+            self.exceptions.pop(event['id'], None)
+            self.expansions.invalidate(event['id'])
+        else:
+            self.events[event['id']] = event
+        self.version += 1
+        if publish:
+            self._publish(action, event)
+
+    def _publish(self, action, event):
+        if self.on_change is not None:
+            self.on_change(action, event)
+
+    def apply(self, event):
+        """Record an event returned by an insert or update call."""
+        with self.lock:
+            self._apply(event)
+
+    def remove(self, event_id):
+        """Forget an event deleted through this app."""
+        with self.lock:
+            instance = None if event_id in self.events else self.expansions.find(event_id)
+            if instance is not None:
+                self._apply(dict(instance, status='cancelled'))
+                return
+            self.events.pop(event_id, None)
+            self.exceptions.pop(event_id, None)
+            self.version += 1
+            self._publish('deleted', {'id': event_id})
+
+    def _concrete_events(self, time_min=None, time_max=None):
+        """Stored events, with each recurring master replaced by its instances in the window."""
+        if not self.expand_recurrence:
+            return list(self.events.values())
+        if time_min is None or time_max is None:
+            time_min, time_max = self.window or list_window()
+        events = []
+        for event in self.events.values():
+            if not is_recurring_master(event):
+                events.append(event)
+                continue
+            instances = self.expansions.instances(event, time_min, time_max)
+            overridden = self.exceptions.get(event['id'])
+            if overridden:
+                instances = [instance for instance in instances
+                             if instance_key(instance['originalStartTime']) not in overridden]
+            events.extend(instances)
+        for overridden in self.exceptions.values():
+            events.extend(event for event in overridden.values() if event.get('status') != 'cancelled')
+        return events
+
+    def list_events(self, time_min=None, time_max=None):
+        """Return stored events overlapping [time_min, time_max), ordered by start.
+
+        The list is cached until the store changes, so callers must not modify it.
+        """
+        with self.lock:
+            key = (self.version, time_min, time_max)
+            if self._listing[0] == key:
+                return self._listing[1]
+            events = self._concrete_events(time_min, time_max)
+        results = []
+        for event in events:
+            start = event_time(event, 'start')
+            end = event_time(event, 'end') or start
+            if start is None:
+                continue
+            if time_min and end < time_min:
+                continue
+            if time_max and start >= time_max:
+                continue
+            results.append((start, event))
+        results.sort(key=lambda item: (int(item[0].timestamp()), item[1]['id']))
+        listing = [event for _, event in results]
+        with self.lock:
+            if self.version == key[0]:
+                self._listing = (key, listing, None)
+        return listing
+
+    def etag(self, time_min=None, time_max=None):
+        """Strong ETag of list_events(time_min, time_max), built from the events' own etags."""
+        listing = self.list_events(time_min, time_max)
+        with self.lock:
+            key, cached, etag = self._listing
+            if cached is listing and etag is not None:
+                return etag
+        etag = items_etag(listing)
+        with self.lock:
+            if self._listing[1] is listing:
+                self._listing = (key, listing, etag)
+        return etag
+
+    def list_page(self, time_min=None, time_max=None, cursor=None, page_size=250):
+        """Return one page of list_events and the cursor for the next page."""
+        events = self.list_events(time_min, time_max)
+        if cursor:
+            after = decode_cursor(cursor)
+            events = [event for event in events if _sort_key(event) > after]
+        page = events[:page_size]
+        next_cursor = encode_cursor(_sort_key(page[-1])) if len(events) > page_size else None
+        return page, next_cursor
+
+
+_stores = OrderedDict()  # user key -> EventStore, least recently used first
+_stores_lock = threading.Lock()
+
+
+# Get the event store for a user if this process has one
+def find_event_store(user_key):
+    with _stores_lock:
+        return _stores.get(user_key)
+
+
+# Get (or create) the event store for a user. Only the MAX_EVENT_STORES most recently used
+# stores are kept; an evicted user's next request starts again with a full sync.
+def get_event_store(user_key):
+    with _stores_lock:
+        store = _stores.get(user_key)
+        if store is None:
+            store = _stores[user_key] = EventStore()
+            store.on_change = partial(feed.publish, user_key, 'event')
+            while len(_stores) > MAX_EVENT_STORES:
+                _stores.popitem(last=False)
+        else:
+            _stores.move_to_end(user_key)
+        return store
@@ -0,0 +1,140 @@
+# Free/busy engine: merged busy intervals kept as sorted epoch-second arrays
+import heapq
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta, timezone
+
+
+# Convert an ISO timestamp or all-day date string to epoch seconds (UTC)
+def to_epoch(value):
+    if 'T' not in value:
+        return int(datetime.fromisoformat(value).replace(tzinfo=timezone.utc).timestamp())
+    moment = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return int(moment.timestamp())
+
+
+# Get the (start, end) epoch seconds of a Calendar event, or None if it has no times
+def event_bounds(event):
+    start = event.get('start', {})
+    end = event.get('end', {})
+    start_value = start.get('dateTime') or start.get('date')
+    end_value = end.get('dateTime') or end.get('date') or start_value
+    if not start_value:
+        return None
+    return to_epoch(start_value), to_epoch(end_value)
+
+
+def from_epoch(seconds):
+    return datetime.fromtimestamp(seconds, tz=timezone.utc)
+
+
+class BusyIndex:
+    """A user's busy time as merged, non-overlapping intervals.
+
+    Intervals are sorted and merged once on construction, so each query is a
+    binary search to the window followed by a walk over only the intervals
+    inside it.
+    """
+
+    def __init__(self, intervals=(), presorted=False):
+        self.starts = array('q')
+        self.ends = array('q')
+        for start, end in (intervals if presorted else sorted(intervals)):
+            if end <= start:
+                continue
+            if self.ends and start <= self.ends[-1]:
+                if end > self.ends[-1]:
+                    self.ends[-1] = end
+            else:
+                self.starts.append(start)
+                self.ends.append(end)
+
+    @classmethod
+    def from_events(cls, events):
+        """Build an index from Calendar event resources, skipping cancelled ones."""
+        bounds = (event_bounds(event) for event in events if event.get('status') != 'cancelled')
+        return cls(bound for bound in bounds if bound)
+
+    @classmethod
+    def from_busy_lists(cls, busy_lists):
+        """Build an index from per-calendar busy lists that are each already sorted.
+
+        The lists are combined with a k-way heap merge rather than re-sorted.
+        """
+        return cls(heapq.merge(*busy_lists), presorted=True)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def busy(self, window_start, window_end):
+        """Yield merged busy intervals overlapping [window_start, window_end)."""
+        first = bisect_right(self.ends, window_start)
+        last = bisect_left(self.starts, window_end)
+        for i in range(first, last):
+            yield max(self.starts[i], window_start), min(self.ends[i], window_end)
+
+    def free_gaps(self, window_start, window_end, min_seconds, buffer_seconds=0, working_hours=None):
+        """Return free (start, end) epoch gaps of at least min_seconds in the window.
+
+        buffer_seconds keeps that much clearance after and before each busy
+        interval. working_hours, if given, is a WorkingHours mask the gaps are
+        clipped to.
+        """
+        gaps = []
+        cursor = window_start
+        for start, end in self.busy(window_start - buffer_seconds, window_end + buffer_seconds):
+            gap_end = min(start - buffer_seconds, window_end)
+            if gap_end - cursor >= min_seconds:
+                gaps.append((cursor, gap_end))
+            cursor = max(cursor, end + buffer_seconds)
+            if cursor >= window_end:
+                break
+        if window_end - cursor >= min_seconds:
+            gaps.append((cursor, window_end))
+        if working_hours is not None:
+            gaps = [gap for gap in intersect(gaps, working_hours.windows(window_start, window_end))
+                    if gap[1] - gap[0] >= min_seconds]
+        return gaps
+
+
+class WorkingHours:
+    """Daily working-hours mask, e.g. WorkingHours(9, 17) for weekdays 09:00-17:00."""
+
+    def __init__(self, start_hour=9, end_hour=17, weekdays=(0, 1, 2, 3, 4), tz=timezone.utc):
+        self.start = timedelta(hours=start_hour)
+        self.end = timedelta(hours=end_hour)
+        self.weekdays = frozenset(weekdays)
+        self.tz = tz
+
+    def windows(self, window_start, window_end):
+        """Return the working (start, end) epoch intervals overlapping the window."""
+        day = from_epoch(window_start).astimezone(self.tz).replace(hour=0, minute=0, second=0, microsecond=0)
+        windows = []
+        while day.timestamp() < window_end:
+            if day.weekday() in self.weekdays:
+                # Rebuild from the wall clock so DST changes keep local hours
+                midnight = datetime(day.year, day.month, day.day, tzinfo=self.tz)
+                start = int((midnight + self.start).timestamp())
+                end = int((midnight + self.end).timestamp())
+                if end > window_start and start < window_end:
+                    windows.append((max(start, window_start), min(end, window_end)))
+            day = datetime(day.year, day.month, day.day, tzinfo=self.tz) + timedelta(days=1)
+        return windows
+
+
+# Intersect two sorted lists of non-overlapping (start, end) intervals
+def intersect(left, right):
+    results = []
+    i = j = 0
+    while i < len(left) and j < len(right):
+        start = max(left[i][0], right[j][0])
+        end = min(left[i][1], right[j][1])
+        if start < end:
+            results.append((start, end))
+        if left[i][1] < right[j][1]:
+            i += 1
+        else:
+            j += 1
+    return results
@@ -0,0 +1,168 @@
+# Reusable Google API clients bound to a pooled, keep-alive HTTP transport
+import json
+import os
+import threading
+import time
+import httplib2
+import requests
+from requests.adapters import HTTPAdapter
+from google.auth.transport.requests import Request
+from googleapiclient.discovery import build_from_document
+from googleapiclient.discovery_cache import get_static_doc
+from googleapiclient.http import HttpRequest
+from metrics import record_refresh, record_upstream
+
+POOL_CONNECTIONS = 4  # Distinct hosts kept in the pool (www.googleapis.com, oauth2, ...)
+POOL_MAXSIZE = 32  # Keep-alive connections per host, shared by all worker threads
+REQUEST_TIMEOUT = 60  # Seconds before an upstream call is abandoned
+REFRESH_STATUS_CODES = (401,)
+# Send all API calls to another host, e.g. the local stand-in in benchmarks/fake_google.py
+API_ROOT_URL = os.getenv('GOOGLE_API_ROOT_URL')
+# Build the API clients at import time (see gunicorn.conf.py) instead of on the first request
+PRELOAD_CLIENTS = os.getenv('PRELOAD_CLIENTS', '').lower() in ('1', 'true', 'yes')
+SERVICES = (('calendar', 'v3'), ('tasks', 'v1'))  # APIs the backend calls
+
+# One adapter (and so one urllib3 connection pool) for the whole process.
+# pool_block makes threads wait for a free connection instead of opening extras.
+_adapter = HTTPAdapter(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE, pool_block=True)
+_local = threading.local()
+
+
+# Sessions are per thread (their cookie jars are not thread-safe) but share the pooled adapter
+def get_http_session():
+    session = getattr(_local, 'session', None)
+    if session is None:
+        session = requests.Session()
+        session.mount('https://', _adapter)
+        session.mount('http://', _adapter)
+        _local.session = session
+    return session
+
+
+class PooledHttp:
+    """httplib2-compatible transport that authorizes one user's requests over the shared pool."""
+
+    def __init__(self, credentials, api_method=None):
+        self.credentials = credentials
+        self.api_method = api_method  # Discovery method id, e.g. calendar.events.list, for metrics
+
+    def for_method(self, api_method):
+        return PooledHttp(self.credentials, api_method)
+
+    def request(self, uri, method='GET', body=None, headers=None, redirections=None, connection_type=None):
+        session = get_http_session()
+        headers = dict(headers or {})
+        request_headers = dict(headers)
+        if not self.credentials.valid:
+            self._refresh(session, 'request')
+        self.credentials.apply(request_headers)
+        response = self._send(session, method, uri, body, request_headers)
+        if response.status_code in REFRESH_STATUS_CODES and self.credentials.refresh_token:
+            # The access token was rejected; refresh once and retry like AuthorizedHttp does
+            self._refresh(session, 'unauthorized')
+            request_headers = dict(headers)
+            self.credentials.apply(request_headers)
+            response = self._send(session, method, uri, body, request_headers)
+        return to_httplib2_response(response.status_code, response.reason, response.headers), response.content
+
+    def _refresh(self, session, trigger):
+        try:
+            self.credentials.refresh(Request(session))
+        except Exception:
+            record_refresh(trigger, False)
+            raise
+        record_refresh(trigger, True)
+
+    def _send(self, session, method, uri, body, headers):
+        # Batch calls go out through the first queued request's transport
+        api_method = 'batch' if '/batch/' in uri else self.api_method or 'unknown'
+        started = time.perf_counter()
+        status = 'error'
+        try:
+            response = session.request(method, uri, data=body, headers=headers, timeout=REQUEST_TIMEOUT)
+            status = response.status_code
+            return response
+        finally:
+            record_upstream(api_method, status, time.perf_counter() - started)
+
+
+# Build the httplib2.Response googleapiclient expects from another client's response
+def to_httplib2_response(status, reason, headers):
+    info = {key.lower(): value for key, value in headers.items()}
+    # The body has already been decoded, so the encoding no longer applies
+    info.pop('content-encoding', None)
+    info['status'] = str(status)
+    resp = httplib2.Response(info)
+    resp.reason = reason
+    return resp
+
+
+class SharedResource:
+    """A discovery resource tree built once per process and shared by every request."""
+
+    def __init__(self, resource, description):
+        self.resource = resource
+        self.children = {
+            name: SharedResource(getattr(resource, name)(), child)
+            for name, child in description.get('resources', {}).items()
+        }
+
+
+class BoundResource:
+    """View of a SharedResource whose requests are sent with one user's transport."""
+
+    def __init__(self, shared, http):
+        self._shared = shared
+        self._http = http
+
+    def __getattr__(self, name):
+        child = self._shared.children.get(name)
+        if child is not None:
+            return lambda: BoundResource(child, self._http)
+        attr = getattr(self._shared.resource, name)
+        if not callable(attr):
+            return attr
+
+        def bound(*args, **kwargs):
+            result = attr(*args, **kwargs)
+            if isinstance(result, HttpRequest):
+                result.http = self._http.for_method(result.methodId)
+            return result
+        return bound
+
+
+_services = {}
+_services_lock = threading.Lock()
+
+
+# Build (once) the shared resource tree for an API from the bundled discovery document
+def get_shared_resource(api, version):
+    key = (api, version)
+    shared = _services.get(key)
+    if shared is None:
+        with _services_lock:
+            shared = _services.get(key)
+            if shared is None:
+                document = json.loads(get_static_doc(api, version))
+                if API_ROOT_URL:
+                    document['rootUrl'] = API_ROOT_URL
+                # The placeholder transport is never used: every request is rebound per user
+                resource = build_from_document(document, http=httplib2.Http())
+                shared = _services[key] = SharedResource(resource, document)
+    return shared
+
+
+# Build every API's shared resource tree now, so forked workers inherit them ready to use
+def preload_clients():
+    for api, version in SERVICES:
+        get_shared_resource(api, version)
+
+
+# Get a Calendar v3 client for the given user credentials
+def get_calendar_service(credentials):
+    return BoundResource(get_shared_resource('calendar', 'v3'), PooledHttp(credentials))
+
+
+# Get a Tasks v1 client for the given user credentials
+def get_tasks_service(credentials):
+    return BoundResource(get_shared_resource('tasks', 'v1'), PooledHttp(credentials))
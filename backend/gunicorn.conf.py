@@ -0,0 +1,23 @@
+# Gunicorn settings, read automatically when gunicorn is started from this directory:
+#     gunicorn app:app
+#     gunicorn -k uvicorn.workers.UvicornWorker asgi:application
+#
+# The app is imported once in the master with its Google API clients built, then forked
+# into the workers, so a new worker serves its first request without importing anything.
+import gc
+import multiprocessing
+import os
+
+os.environ.setdefault('PRELOAD_CLIENTS', '1')  # Read by google_clients when the app is imported
+
+bind = os.getenv('BIND', '127.0.0.1:5000')
+workers = int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+worker_class = 'gthread'  # Threads, so /stream connections do not each hold a whole worker
+threads = int(os.getenv('GUNICORN_THREADS', 8))
+preload_app = True
+
+
+def pre_fork(server, worker):
+    # Objects that exist before the fork are never collected, so the collector
+    # does not write to (and un-share) the pages holding them in every worker
+    gc.freeze()
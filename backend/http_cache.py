@@ -0,0 +1,48 @@
+# Conditional-GET and response compression helpers shared by the Flask and ASGI routes
+import gzip
+import hashlib
+import brotli
+
+COMPRESS_MIN_SIZE = 1024  # Bodies smaller than this are sent uncompressed
+COMPRESSIBLE_MIMETYPES = ('application/json',)
+ENCODINGS = ('br', 'gzip')  # Preferred first when the client accepts both equally
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 4  # Higher levels compress little better for JSON at several times the CPU
+
+
+# Strong ETag (unquoted) for a representation described by a sequence of strings
+def make_etag(parts):
+    digest = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        digest.update(part.encode())
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+# ETag of a list of Google resources, from each item's own etag (or updated time)
+def items_etag(items, *variant):
+    return make_etag([*variant, *(f"{item.get('id')}:{item.get('etag') or item.get('updated')}" for item in items)])
+
+
+# The tag in an If-None-Match header (werkzeug ETags) naming any encoding of this body, or None
+def matching_etag(if_none_match, etag):
+    for encoding in (None,) + ENCODINGS:
+        if if_none_match.contains(encoded_etag(etag, encoding)):
+            return encoded_etag(etag, encoding)
+    return None
+
+
+# A compressed body is a different representation, so it gets its own strong ETag
+def encoded_etag(etag, encoding):
+    return f'{etag}-{encoding}' if encoding else etag
+
+
+# Pick a content coding from a parsed Accept-Encoding header (werkzeug Accept)
+def choose_encoding(accept_encodings):
+    return accept_encodings.best_match(ENCODINGS)
+
+
+def compress(payload, encoding):
+    if encoding == 'br':
+        return brotli.compress(payload, quality=BROTLI_QUALITY)
+    return gzip.compress(payload, compresslevel=GZIP_LEVEL)
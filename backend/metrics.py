@@ -0,0 +1,188 @@
+# In-process request/upstream metrics exported in the Prometheus text format
+import bisect
+import os
+import sys
+import threading
+from collections import Counter as StackCounter
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# Per-request sampling profiles are only served when this is switched on
+PROFILING_ENABLED = os.getenv('PROFILING_ENABLED', '').lower() in ('1', 'true', 'yes')
+PROFILE_INTERVAL = 0.005  # Seconds between stack samples
+PROFILE_MAX_DEPTH = 64  # Frames kept per sampled stack
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic counter keyed by a tuple of label values."""
+
+    kind = 'counter'
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values):
+        return self._values.get(label_values, 0)
+
+    def render(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        for label_values, value in values:
+            yield f'{self.name}{_format_labels(self.labels, label_values)} {_format_value(value)}'
+
+
+class Histogram:
+    """Cumulative-bucket histogram keyed by a tuple of label values."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, description, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [bucket counts..., overflow count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        slot = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+            series[slot] += 1
+            series[-1] += value
+
+    def render(self):
+        with self._lock:
+            series = sorted((key, list(value)) for key, value in self._series.items())
+        for label_values, counts in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts[:-1]):
+                cumulative += count
+                labels = _format_labels(self.labels, label_values, [('le', bound)])
+                yield f'{self.name}_bucket{labels} {cumulative}'
+            labels = _format_labels(self.labels, label_values)
+            yield f'{self.name}_sum{labels} {_format_value(counts[-1])}'
+            yield f'{self.name}_count{labels} {cumulative}'
+
+
+class Registry:
+    """The set of metrics rendered by the /metrics route."""
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append(f'# HELP {metric.name} {metric.description}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+request_latency = registry.register(Histogram(
+    'duratasks_http_request_duration_seconds', 'Time spent handling a request, by route.',
+    labels=('route', 'method', 'status')))
+upstream_latency = registry.register(Histogram(
+    'duratasks_upstream_request_duration_seconds', 'Latency of Google API calls, by API method.',
+    labels=('api_method',)))
+upstream_requests = registry.register(Counter(
+    'duratasks_upstream_requests_total', 'Google API calls, by API method and HTTP status.',
+    labels=('api_method', 'status')))
+credential_refreshes = registry.register(Counter(
+    'duratasks_credential_refreshes_total', 'OAuth access token refreshes, by trigger and outcome.',
+    labels=('trigger', 'outcome')))
+cache_lookups = registry.register(Counter(
+    'duratasks_cache_lookups_total', 'Lookups in the in-process caches, by cache and result.',
+    labels=('cache', 'result')))
+push_notifications = registry.register(Counter(
+    'duratasks_push_notifications_total', 'Calendar push notifications received, by resource state.',
+    labels=('state',)))
+
+
+# Record one Google API call; status is the HTTP status, or 'error' if none was received
+def record_upstream(api_method, status, seconds):
+    upstream_latency.observe(seconds, api_method)
+    upstream_requests.inc(api_method, str(status))
+
+
+def record_refresh(trigger, ok):
+    credential_refreshes.inc(trigger, 'success' if ok else 'failure')
+
+
+def record_cache(cache, hit):
+    cache_lookups.inc(cache, 'hit' if hit else 'miss')
+
+
+class SamplingProfiler:
+    """Samples one thread's stack at a fixed interval while a request runs.
+
+    Stacks are aggregated in the collapsed format ("outer;inner count")
+    read by flamegraph.pl and speedscope.
+    """
+
+    def __init__(self, thread_id=None, interval=PROFILE_INTERVAL):
+        self.thread_id = thread_id or threading.get_ident()
+        self.interval = interval
+        self.stacks = StackCounter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                return
+            stack = []
+            while frame is not None and len(stack) < PROFILE_MAX_DEPTH:
+                code = frame.f_code
+                stack.append(f'{os.path.basename(code.co_filename)}:{code.co_name}')
+                frame = frame.f_back
+            self.stacks[';'.join(reversed(stack))] += 1
+            self.samples += 1
+
+    def collapsed(self):
+        return ''.join(f'{stack} {count}\n' for stack, count in self.stacks.most_common())
+
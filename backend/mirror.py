@@ -0,0 +1,278 @@
+# Local SQLite mirror of each user's events and tasks, with range indexes and FTS5 search
+import json
+import logging
+import re
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from event_store import event_time, get_event_store, list_window
+from freebusy import to_epoch
+from google_clients import get_calendar_service, get_tasks_service
+from services import TASKS_PAGE_SIZE, fetch_tasks_by_list, iter_items
+from sqlite_store import SQLiteStore, database_path
+
+SYNC_INTERVAL = 60  # Seconds between asking Google for a user's changes, in the background or on a search
+ACTIVE_FOR = 60 * 60  # Seconds after a user's last search that their mirror keeps being synced in the background
+TASKS_SYNC_OVERLAP = timedelta(minutes=5)  # updatedMin reaches back this far to allow for clock skew
+SEARCH_LIMIT = 50
+MAX_SEARCH_LIMIT = 500
+MAX_QUERY_TERMS = 16
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS events (
+    user_key TEXT NOT NULL,
+    id TEXT NOT NULL,
+    etag TEXT,
+    start REAL,
+    end REAL,
+    summary TEXT,
+    description TEXT,
+    location TEXT,
+    body TEXT NOT NULL,
+    UNIQUE (user_key, id)
+);
+CREATE INDEX IF NOT EXISTS events_start ON events (user_key, start);
+CREATE INDEX IF NOT EXISTS events_end ON events (user_key, end);
+CREATE VIRTUAL TABLE IF NOT EXISTS events_fts USING fts5(
+    summary, description, location, content='events', content_rowid='rowid',
+    tokenize='unicode61 remove_diacritics 2', prefix='2 3');
+CREATE TRIGGER IF NOT EXISTS events_fts_insert AFTER INSERT ON events BEGIN
+    INSERT INTO events_fts (rowid, summary, description, location)
+    VALUES (new.rowid, new.summary, new.description, new.location);
+END;
+CREATE TRIGGER IF NOT EXISTS events_fts_delete AFTER DELETE ON events BEGIN
+    INSERT INTO events_fts (events_fts, rowid, summary, description, location)
+    VALUES ('delete', old.rowid, old.summary, old.description, old.location);
+END;
+CREATE TRIGGER IF NOT EXISTS events_fts_update AFTER UPDATE ON events BEGIN
+    INSERT INTO events_fts (events_fts, rowid, summary, description, location)
+    VALUES ('delete', old.rowid, old.summary, old.description, old.location);
+    INSERT INTO events_fts (rowid, summary, description, location)
+    VALUES (new.rowid, new.summary, new.description, new.location);
+END;
+CREATE TABLE IF NOT EXISTS tasks (
+    user_key TEXT NOT NULL,
+    id TEXT NOT NULL,
+    due REAL,
+    status TEXT,
+    title TEXT,
+    notes TEXT,
+    body TEXT NOT NULL,
+    UNIQUE (user_key, id)
+);
+CREATE INDEX IF NOT EXISTS tasks_due ON tasks (user_key, due);
+CREATE VIRTUAL TABLE IF NOT EXISTS tasks_fts USING fts5(
+    title, notes, content='tasks', content_rowid='rowid',
+    tokenize='unicode61 remove_diacritics 2', prefix='2 3');
+CREATE TRIGGER IF NOT EXISTS tasks_fts_insert AFTER INSERT ON tasks BEGIN
+    INSERT INTO tasks_fts (rowid, title, notes) VALUES (new.rowid, new.title, new.notes);
+END;
+CREATE TRIGGER IF NOT EXISTS tasks_fts_delete AFTER DELETE ON tasks BEGIN
+    INSERT INTO tasks_fts (tasks_fts, rowid, title, notes) VALUES ('delete', old.rowid, old.title, old.notes);
+END;
+CREATE TRIGGER IF NOT EXISTS tasks_fts_update AFTER UPDATE ON tasks BEGIN
+    INSERT INTO tasks_fts (tasks_fts, rowid, title, notes) VALUES ('delete', old.rowid, old.title, old.notes);
+    INSERT INTO tasks_fts (rowid, title, notes) VALUES (new.rowid, new.title, new.notes);
+END;
+CREATE TABLE IF NOT EXISTS task_sync (user_key TEXT PRIMARY KEY, synced_at TEXT NOT NULL);
+'''
+
+UPSERT_EVENT = '''
+INSERT INTO events (user_key, id, etag, start, end, summary, description, location, body)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (user_key, id) DO UPDATE SET etag = excluded.etag, start = excluded.start, end = excluded.end,
+    summary = excluded.summary, description = excluded.description, location = excluded.location, body = excluded.body
+'''
+UPSERT_TASK = '''
+INSERT INTO tasks (user_key, id, due, status, title, notes, body) VALUES (?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (user_key, id) DO UPDATE SET due = excluded.due, status = excluded.status, title = excluded.title,
+    notes = excluded.notes, body = excluded.body
+'''
+
+_WORD = re.compile(r'\w+')
+
+
+# Turn free text into an FTS5 query matching every word as a prefix; quoting each word keeps
+# FTS5 operators and punctuation in user input from being interpreted
+def fts_query(text):
+    words = _WORD.findall(text)[:MAX_QUERY_TERMS]
+    if not words:
+        raise ValueError("q must contain at least one word")
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def _event_row(user_key, event):
+    start = event_time(event, 'start')
+    end = event_time(event, 'end') or start
+    return (user_key, event['id'], event.get('etag') or event.get('updated'),
+            start.timestamp() if start else None, end.timestamp() if end else None,
+            event.get('summary'), event.get('description'), event.get('location'), json.dumps(event))
+
+
+def _task_row(user_key, task):
+    return (user_key, task['id'], to_epoch(task['due']) if task.get('due') else None, task.get('status'),
+            task.get('title'), task.get('notes'), json.dumps(task))
+
+
+class SearchMirror(SQLiteStore):
+    """Events and tasks of every user in one SQLite database, indexed for range and text queries.
+
+    Events are copied from the user's EventStore whenever its version has
+    moved, by comparing etags, so writes through this app and delta syncs
+    both reach the mirror. Tasks have no sync tokens, so they are brought up
+    to date with updatedMin queries at most every SYNC_INTERVAL seconds, and
+    task writes made through this app are applied from the change feed.
+    While a user keeps searching, a background thread in each process does
+    the same every SYNC_INTERVAL seconds, so searches rarely wait on Google.
+    """
+
+    schema = SCHEMA
+
+    def __init__(self, path, sequence=None):
+        super().__init__(path)
+        self.sequence = sequence  # sequence(user_key, credentials): the user's push notification sequence, or None
+        self.active = {}  # user key -> (credentials, monotonic time of their last search) in this process
+        self.mirrored = {}  # user key -> (store's full sync time, store version) last copied in this process
+        self.checked = {}  # user key -> monotonic time Google was last asked for changes
+
+    def refresh(self, user_key, credentials):
+        """Bring the user's mirror up to date for a search, and keep it synced while they remain active."""
+        self.active[user_key] = (credentials, time.monotonic())
+        self.ensure_started()
+        self.sync_user(user_key, credentials)
+
+    def sync_user(self, user_key, credentials):
+        """Bring the user's mirror up to date, calling Google only when changes may be waiting."""
+        store = get_event_store(user_key)
+        calendar_service = get_calendar_service(credentials)
+        sequence = self.sequence(user_key, credentials) if self.sequence is not None else None
+        if sequence is not None or store.needs_full_sync():
+            # With push this sync is a local check until a change is reported; a store that has
+            # never synced (new, or recreated after an eviction) must sync before it is mirrored
+            store.sync(calendar_service, sequence)
+        now = time.monotonic()
+        if now - self.checked.get(user_key, float('-inf')) >= SYNC_INTERVAL:
+            if sequence is None:
+                store.sync(calendar_service)
+            self.sync_tasks(user_key, get_tasks_service(credentials))
+            self.checked[user_key] = now
+        self.mirror_events(user_key, store)
+
+    def start_threads(self):
+        threading.Thread(target=self._run, name='search-mirror-sync', daemon=True).start()
+
+    def _run(self):
+        while True:
+            time.sleep(SYNC_INTERVAL)
+            self.sync_active()
+
+    def sync_active(self, now=None):
+        """Sync every user who has searched within ACTIVE_FOR seconds, and forget the others."""
+        now = time.monotonic() if now is None else now
+        for user_key, (credentials, searched) in list(self.active.items()):
+            if now - searched > ACTIVE_FOR:
+                if self.active.get(user_key, (None, None))[1] == searched:
+                    del self.active[user_key]
+                    self.mirrored.pop(user_key, None)
+                    self.checked.pop(user_key, None)
+                continue
+            try:
+                self.sync_user(user_key, credentials)
+            except Exception as e:
+                logging.error(f"Background sync of the search mirror failed: {e}")
+
+    def mirror_events(self, user_key, store):
+        """Copy changed events from the store, skipping the work if it has not changed."""
+        if store.sync_token is None:
+            return  # An empty store that has never synced says nothing about which events were deleted
+        # A store created after an eviction starts over with its own full sync time
+        version = (store.synced_at, store.version)
+        if self.mirrored.get(user_key) == version:
+            return
+        events = store.list_events(*list_window())
+        with self.lock:
+            conn = self.conn
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                stale = dict(conn.execute('SELECT id, etag FROM events WHERE user_key = ?', (user_key,)))
+                changed = []
+                for event in events:
+                    if stale.pop(event['id'], None) != (event.get('etag') or event.get('updated')):
+                        changed.append(_event_row(user_key, event))
+                conn.executemany(UPSERT_EVENT, changed)
+                conn.executemany('DELETE FROM events WHERE user_key = ? AND id = ?',
+                                 [(user_key, event_id) for event_id in stale])
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+        self.mirrored[user_key] = version
+
+    def sync_tasks(self, user_key, tasks_service):
+        """Fetch tasks changed since the last sync (all tasks the first time) from every task list."""
+        with self.lock:
+            row = self.conn.execute('SELECT synced_at FROM task_sync WHERE user_key = ?', (user_key,)).fetchone()
+        started = datetime.now(timezone.utc)
+        filters = dict(showCompleted=True, showHidden=True)
+        if row is not None:
+            updated_min = datetime.fromisoformat(row[0]) - TASKS_SYNC_OVERLAP
+            filters.update(updatedMin=updated_min.strftime('%Y-%m-%dT%H:%M:%SZ'), showDeleted=True)
+        task_lists = list(iter_items(tasks_service.tasklists().list, maxResults=TASKS_PAGE_SIZE))
+        results = fetch_tasks_by_list(tasks_service, task_lists, **filters)
+        tasks = [task for _, items in results for task in items]
+        with self.lock:
+            conn = self.conn
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                if row is None:
+                    conn.execute('DELETE FROM tasks WHERE user_key = ?', (user_key,))
+                conn.executemany(UPSERT_TASK, [_task_row(user_key, task) for task in tasks if not task.get('deleted')])
+                conn.executemany('DELETE FROM tasks WHERE user_key = ? AND id = ?',
+                                 [(user_key, task['id']) for task in tasks if task.get('deleted')])
+                conn.execute('INSERT OR REPLACE INTO task_sync (user_key, synced_at) VALUES (?, ?)',
+                             (user_key, started.isoformat()))
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+
+    def task_changed(self, user_key, change):
+        """Change feed listener applying task writes made through this app."""
+        if change['kind'] != 'task':
+            return
+        with self.lock:
+            if change['action'] == 'deleted':
+                self.conn.execute('DELETE FROM tasks WHERE user_key = ? AND id = ?', (user_key, change['id']))
+            else:
+                self.conn.execute(UPSERT_TASK, _task_row(user_key, change['resource']))
+
+    def search(self, user_key, query=None, time_min=None, time_max=None, kinds=('events', 'tasks'),
+               limit=SEARCH_LIMIT):
+        """Events overlapping and tasks due in [time_min, time_max) (epoch seconds, either optional)
+        that match an fts_query, best matches first, or in time order when there is no query."""
+        results = {}
+        with self.lock:
+            if 'events' in kinds:
+                results['events'] = self._search('events', 'start', 'end', user_key, query, time_min, time_max, limit)
+            if 'tasks' in kinds:
+                results['tasks'] = self._search('tasks', 'due', 'due', user_key, query, time_min, time_max, limit)
+        return results
+
+    def _search(self, table, start, end, user_key, query, time_min, time_max, limit):
+        conditions = ['t.user_key = :user']
+        if time_min is not None:
+            conditions.append(f't.{end} >= :min' if start == end else f't.{end} > :min')
+        if time_max is not None:
+            conditions.append(f't.{start} < :max')
+        if query is None:
+            sql = f"SELECT t.body FROM {table} t WHERE {' AND '.join(conditions)} ORDER BY t.{start}, t.id LIMIT :limit"
+        else:
+            sql = (f"SELECT t.body FROM {table}_fts f JOIN {table} t ON t.rowid = f.rowid "
+                   f"WHERE {table}_fts MATCH :query AND {' AND '.join(conditions)} ORDER BY f.rank LIMIT :limit")
+        params = {'user': user_key, 'min': time_min, 'max': time_max, 'query': query, 'limit': limit}
+        return [json.loads(body) for body, in self.conn.execute(sql, params)]
+
+
+# Create the mirror configured by MIRROR_DB_PATH (default: mirror.db beside the app)
+def create_search_mirror(sequence=None):
+    return SearchMirror(database_path('MIRROR_DB_PATH', 'mirror.db'), sequence)
@@ -0,0 +1,401 @@
+# Durable write-behind outbox: event/task mutations are stored in SQLite, acknowledged at
+# once and sent to Google by a background worker pool with per-user rate limiting
+import json
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from googleapiclient.errors import HttpError
+from change_feed import CHANGE_ACTIONS, feed
+from event_store import get_event_store
+from google_clients import get_calendar_service, get_tasks_service
+from http_cache import make_etag
+from services import deserialize_credentials, serialize_credentials
+from sqlite_store import SQLiteStore, database_path
+
+WRITE_BEHIND = os.getenv('WRITE_BEHIND', '').lower() in ('1', 'true', 'yes')  # Queue every mutation
+OUTBOX_WORKERS = 4  # Sender threads per process
+RATE_PER_SECOND = 5.0  # Sustained Google writes per user
+BURST = 10  # Writes a user may send back to back
+MAX_ATTEMPTS = 8
+BACKOFF_BASE = 1.0  # Seconds before the first retry, doubled on each attempt
+BACKOFF_MAX = 300.0
+LEASE_SECONDS = 120  # A claimed operation is retried elsewhere if not finished in this time
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+RATE_LIMIT_REASONS = (b'rateLimitExceeded', b'userRateLimitExceeded')
+RETENTION_SECONDS = 24 * 60 * 60  # Finished operations kept for status lookups
+PROVISIONAL_PREFIX = 'pending-'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS operations (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_key TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    op TEXT NOT NULL,
+    collection TEXT NOT NULL,
+    target TEXT NOT NULL,
+    body TEXT,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt REAL NOT NULL,
+    lease_until REAL,
+    result TEXT,
+    error TEXT,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS operations_due ON operations (status, next_attempt);
+CREATE INDEX IF NOT EXISTS operations_target ON operations (user_key, kind, target, status);
+CREATE TABLE IF NOT EXISTS credentials (user_key TEXT PRIMARY KEY, credentials TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS provisional_ids (provisional TEXT PRIMARY KEY, resource_id TEXT NOT NULL);
+'''
+
+# The oldest due operation whose target has no earlier unfinished operation, so each
+# resource's writes reach Google in the order they were accepted
+CLAIM = '''
+UPDATE operations SET status = 'sending', lease_until = :lease, attempts = attempts + 1
+WHERE id = (
+    SELECT o.id FROM operations o
+    WHERE ((o.status = 'pending' AND o.next_attempt <= :now) OR (o.status = 'sending' AND o.lease_until < :now))
+      AND NOT EXISTS (
+          SELECT 1 FROM operations p
+          WHERE p.user_key = o.user_key AND p.kind = o.kind AND p.target = o.target
+            AND p.id < o.id AND p.status IN ('pending', 'sending'))
+    ORDER BY o.next_attempt, o.id LIMIT 1)
+RETURNING id, user_key, kind, op, collection, target, body, attempts
+'''
+
+
+def is_provisional_id(resource_id):
+    return bool(resource_id) and resource_id.startswith(PROVISIONAL_PREFIX)
+
+
+class TokenBucket:
+    """Token bucket allowing `burst` calls at once and `rate` calls per second after that."""
+
+    def __init__(self, rate=RATE_PER_SECOND, burst=BURST):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.stamp = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self):
+        """Take a token, returning 0, or the seconds until one will be available."""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+            self.stamp = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+
+class RetryLater(Exception):
+    """The operation hit a transient failure and should be attempted again."""
+
+    def __init__(self, message, delay=None):
+        super().__init__(message)
+        self.delay = delay
+
+
+class Outbox(SQLiteStore):
+    """SQLite-backed queue of Calendar/Tasks mutations drained by a pool of worker threads.
+
+    Pending writes to the same resource are coalesced on enqueue: a newer update
+    replaces the body of a queued create or update, and a delete cancels a queued
+    create outright or takes the place of a queued update.
+    """
+
+    schema = SCHEMA
+    row_factory = sqlite3.Row
+
+    def __init__(self, path, workers=OUTBOX_WORKERS):
+        super().__init__(path)
+        self.workers = workers
+        self.wakeup = threading.Event()
+        self.buckets = {}
+
+    def start_threads(self):
+        for number in range(self.workers):
+            threading.Thread(target=self._run, name=f'outbox-{number}', daemon=True).start()
+
+    def resume(self):
+        """Start this process's sender threads if operations from an earlier run are still unfinished.
+
+        Pending operations and those whose lease ran out (their sender died
+        mid-request) would otherwise wait for this process's next enqueue.
+        """
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT 1 FROM operations WHERE status IN ('pending', 'sending') LIMIT 1").fetchone()
+        if row is not None:
+            self.ensure_started()
+            self.wakeup.set()
+
+    def enqueue(self, user_key, credentials_json, kind, op, collection, target=None, body=None):
+        """Queue a mutation and return (operation id, resource id the client should use)."""
+        now = time.time()
+        with self.lock:
+            conn = self.conn
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                conn.execute('INSERT INTO credentials (user_key, credentials) VALUES (?, ?) '
+                             'ON CONFLICT(user_key) DO UPDATE SET credentials = excluded.credentials',
+                             (user_key, credentials_json))
+                if op == 'create':
+                    target = f'{PROVISIONAL_PREFIX}{uuid.uuid4().hex}'
+                else:
+                    target = self._resolve(target)
+                operation_id = self._coalesce(user_key, kind, op, collection, target, body, now)
+                if operation_id is None:
+                    operation_id = conn.execute(
+                        'INSERT INTO operations (user_key, kind, op, collection, target, body, next_attempt, updated) '
+                        'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                        (user_key, kind, op, collection, target, _dumps(body), now, now)).lastrowid
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+        self.ensure_started()
+        self.wakeup.set()
+        return operation_id, target
+
+    def _resolve(self, target):
+        row = self.conn.execute('SELECT resource_id FROM provisional_ids WHERE provisional = ?', (target,)).fetchone()
+        return row[0] if row else target
+
+    def _coalesce(self, user_key, kind, op, collection, target, body, now):
+        queued = self.conn.execute(
+            "SELECT id, op FROM operations WHERE user_key = ? AND kind = ? AND target = ? AND status = 'pending' "
+            "ORDER BY id DESC LIMIT 1", (user_key, kind, target)).fetchone()
+        if queued is None or op == 'create':
+            return None
+        if op == 'update':
+            # Updates replace the whole resource, so only the newest body needs sending
+            self.conn.execute('UPDATE operations SET body = ?, collection = ?, updated = ? WHERE id = ?',
+                              (_dumps(body), collection, now, queued['id']))
+        elif queued['op'] == 'create':
+            # Never sent, so nothing needs deleting upstream
+            self.conn.execute("UPDATE operations SET status = 'cancelled', updated = ? WHERE id = ?",
+                              (now, queued['id']))
+        else:
+            self.conn.execute("UPDATE operations SET op = 'delete', body = NULL, updated = ? WHERE id = ?",
+                              (now, queued['id']))
+        return queued['id']
+
+    def status(self, user_key, operation_id):
+        """Describe one of the user's operations, or None."""
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT id, kind, op, target, status, attempts, result, error FROM operations '
+                'WHERE id = ? AND user_key = ?', (operation_id, user_key)).fetchone()
+            resource_id = self._resolve(row['target']) if row else None
+        if row is None:
+            return None
+        return {"operation": row['id'], "kind": row['kind'], "op": row['op'], "id": resource_id,
+                "status": row['status'], "attempts": row['attempts'],
+                "result": json.loads(row['result']) if row['result'] else None, "error": row['error']}
+
+    def has_pending(self, user_key, kind, target):
+        """Whether writes to this resource are still queued, so later writes must queue behind them."""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT 1 FROM operations WHERE user_key = ? AND kind = ? AND target = ? "
+                "AND status IN ('pending', 'sending') LIMIT 1", (user_key, kind, self._resolve(target))).fetchone()
+        return row is not None
+
+    def pending_events(self, user_key):
+        """The user's unsent event operations, oldest first, for read-your-writes views."""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT id, op, target, body, updated FROM operations WHERE user_key = ? AND kind = 'event' "
+                "AND status IN ('pending', 'sending') ORDER BY id", (user_key,)).fetchall()
+            # Writes queued behind a create that has since been sent apply to its real id
+            return [dict(row, target=self._resolve(row['target']),
+                         body=json.loads(row['body']) if row['body'] else None) for row in rows]
+
+    def _claim(self):
+        now = time.time()
+        with self.lock:
+            return self.conn.execute(CLAIM, {'now': now, 'lease': now + LEASE_SECONDS}).fetchone()
+
+    def _finish(self, operation, status, result=None, error=None, provisional=None):
+        now = time.time()
+        with self.lock:
+            conn = self.conn
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute('UPDATE operations SET status = ?, result = ?, error = ?, lease_until = NULL, updated = ? '
+                         'WHERE id = ?', (status, _dumps(result), error, now, operation['id']))
+            if provisional:
+                conn.execute('INSERT OR REPLACE INTO provisional_ids (provisional, resource_id) VALUES (?, ?)',
+                             (operation['target'], provisional))
+            conn.execute("DELETE FROM operations WHERE status IN ('done', 'cancelled', 'failed') AND updated < ?",
+                         (now - RETENTION_SECONDS,))
+            conn.execute('COMMIT')
+
+    def _retry(self, operation, delay, error):
+        with self.lock:
+            self.conn.execute(
+                "UPDATE operations SET status = 'pending', next_attempt = ?, lease_until = NULL, error = ?, "
+                "updated = ? WHERE id = ?", (time.time() + delay, error, time.time(), operation['id']))
+
+    def _run(self):
+        while True:
+            try:
+                operation = self._claim()
+            except sqlite3.Error as e:
+                logging.error(f"Outbox claim failed: {e}")
+                operation = None
+            if operation is None:
+                self.wakeup.wait(1)
+                self.wakeup.clear()
+                continue
+            self._process(operation)
+
+    def _process(self, operation):
+        bucket = self.buckets.setdefault(operation['user_key'], TokenBucket())
+        wait = bucket.take()
+        if wait:
+            # Over this user's rate: hand the operation back without counting an attempt
+            with self.lock:
+                self.conn.execute("UPDATE operations SET status = 'pending', attempts = attempts - 1, "
+                                  "next_attempt = ?, lease_until = NULL WHERE id = ?",
+                                  (time.time() + wait, operation['id']))
+            return
+        try:
+            result = self._send(operation)
+        except RetryLater as e:
+            if operation['attempts'] >= MAX_ATTEMPTS:
+                self._finish(operation, 'failed', error=str(e))
+            else:
+                self._retry(operation, e.delay or backoff(operation['attempts']), str(e))
+            return
+        except Exception as e:
+            logging.error(f"Outbox operation {operation['id']} failed: {e}")
+            self._finish(operation, 'failed', error=str(e))
+            return
+        created = result.get('id') if operation['op'] == 'create' and isinstance(result, dict) else None
+        self._finish(operation, 'done', result=result, provisional=created)
+        self._apply(operation, result)
+
+    def _send(self, operation):
+        target = operation['target']
+        if is_provisional_id(target) and operation['op'] != 'create':
+            with self.lock:
+                target = self._resolve(target)
+            if is_provisional_id(target):
+                raise ValueError("The create this operation depends on did not succeed")
+        credentials = self._load_credentials(operation['user_key'])
+        token = credentials.token
+        body = json.loads(operation['body']) if operation['body'] else None
+        try:
+            result = self._request(credentials, operation, target, body).execute()
+        except HttpError as error:
+            status = error.resp.status
+            if operation['op'] == 'delete' and status in (404, 410):
+                return {}  # Already gone
+            if is_retryable(error):
+                retry_after = error.resp.get('retry-after')
+                raise RetryLater(str(error), float(retry_after) if retry_after and retry_after.isdigit() else None)
+            raise
+        except OSError as e:
+            raise RetryLater(str(e))
+        if credentials.token != token:
+            self._save_credentials(operation['user_key'], credentials)
+        return result or {}
+
+    def _request(self, credentials, operation, target, body):
+        op = operation['op']
+        collection = operation['collection']
+        if operation['kind'] == 'event':
+            events = get_calendar_service(credentials).events()
+            if op == 'create':
+                return events.insert(calendarId=collection, body=body)
+            if op == 'update':
+                return events.update(calendarId=collection, eventId=target, body=body)
+            return events.delete(calendarId=collection, eventId=target)
+        tasks = get_tasks_service(credentials).tasks()
+        if op == 'create':
+            return tasks.insert(tasklist=collection, body=body)
+        if op == 'update':
+            return tasks.update(tasklist=collection, task=target, body=body)
+        return tasks.delete(tasklist=collection, task=target)
+
+    def _load_credentials(self, user_key):
+        with self.lock:
+            row = self.conn.execute('SELECT credentials FROM credentials WHERE user_key = ?', (user_key,)).fetchone()
+        if row is None:
+            raise ValueError("No credentials stored for this user")
+        return deserialize_credentials(json.loads(row[0]))
+
+    def _save_credentials(self, user_key, credentials):
+        with self.lock:
+            self.conn.execute('UPDATE credentials SET credentials = ? WHERE user_key = ?',
+                              (json.dumps(serialize_credentials(credentials)), user_key))
+
+    def _apply(self, operation, result):
+        # Keep this process's event store and change feed current; other processes catch up on their next sync.
+        # Failed writes need no undo: queued writes are only overlaid on listings, never stored.
+        if operation['kind'] != 'event':
+            task = result or {'id': operation['target']}
+            feed.publish(operation['user_key'], 'task', CHANGE_ACTIONS[operation['op']], task)
+            return
+        store = get_event_store(operation['user_key'])
+        if operation['op'] == 'delete':
+            store.remove(operation['target'])
+        else:
+            store.apply(result)
+
+
+# Whether Google refused a call only for now: rate limits and transient server errors
+def is_retryable(error):
+    status = error.resp.status
+    return status in RETRY_STATUSES or (status == 403 and any(
+        reason in (error.content or b'') for reason in RATE_LIMIT_REASONS))
+
+
+# Seconds to wait before retry number `attempts`, with full jitter
+def backoff(attempts):
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (attempts - 1)))
+
+
+# Show the user's queued event writes on top of the synced events
+def overlay_pending(events, pending):
+    if not pending:
+        return events
+    by_id = {event['id']: index for index, event in enumerate(events)}
+    events = list(events)
+    removed = set()
+    for operation in pending:
+        target = operation['target']
+        if operation['op'] == 'delete':
+            removed.add(target)
+            continue
+        event = dict(operation['body'] or {}, id=target)
+        if target in by_id:
+            events[by_id[target]] = event
+        else:
+            by_id[target] = len(events)
+            events.append(event)
+        removed.discard(target)
+    return [event for event in events if event['id'] not in removed]
+
+
+# Fold queued writes into a listing's ETag, so the listing changes when they are queued and sent
+def pending_etag(etag, pending):
+    if not pending:
+        return etag
+    return make_etag([etag, *(f"{operation['id']}:{operation['updated']}" for operation in pending)])
+
+
+def _dumps(value):
+    return None if value is None else json.dumps(value)
+
+
+# Create the outbox configured by OUTBOX_DB_PATH (default: outbox.db beside the app)
+def create_outbox():
+    return Outbox(database_path('OUTBOX_DB_PATH', 'outbox.db'))
@@ -0,0 +1,129 @@
+# Field projection (Google partial-response `fields` syntax) and the compact columnar list format
+import re
+from freebusy import to_epoch
+
+# Columns sent in the compact format when no fields are requested
+EVENT_COMPACT_FIELDS = 'id,summary,start,end'
+TASK_COMPACT_FIELDS = 'id,title,status,due'
+# Fields holding a timestamp, sent as epoch seconds in the compact format
+TIME_FIELDS = frozenset(('start', 'end', 'originalStartTime', 'created', 'updated', 'due', 'completed'))
+MAX_SELECTOR_LENGTH = 1000
+
+_PATH = re.compile(r'\s*([A-Za-z_*][\w*]*(?:/[A-Za-z_*][\w*]*)*)\s*')
+
+
+# Parse a selector such as "id,summary,start/dateTime,attendees(email)" into a nested spec
+# of {name: sub-spec}, where a sub-spec of None keeps the whole value
+def parse_fields(selector):
+    if len(selector) > MAX_SELECTOR_LENGTH:
+        raise ValueError("fields selector is too long")
+    spec, pos = _parse_fields(selector, 0)
+    if pos != len(selector):
+        raise ValueError(f"Unexpected '{selector[pos]}' in fields selector at position {pos}")
+    return spec
+
+
+def _parse_fields(selector, pos):
+    spec = {}
+    while True:
+        match = _PATH.match(selector, pos)
+        if not match:
+            raise ValueError(f"Expected a field name in fields selector at position {pos}")
+        path = match.group(1).split('/')
+        pos = match.end()
+        sub = None
+        if selector.startswith('(', pos):
+            sub, pos = _parse_fields(selector, pos + 1)
+            if not selector.startswith(')', pos):
+                raise ValueError("Unbalanced parentheses in fields selector")
+            pos += 1
+            while selector.startswith(' ', pos):
+                pos += 1
+        _merge(spec, path, sub)
+        if not selector.startswith(',', pos):
+            return spec, pos
+        pos += 1
+
+
+def _merge(spec, path, sub):
+    node = spec
+    for name in path[:-1]:
+        if name in node and node[name] is None:
+            return  # The whole parent is already selected
+        node = node.setdefault(name, {})
+    name = path[-1]
+    if name not in node:
+        node[name] = sub
+    elif node[name] is None or sub is None:
+        node[name] = None
+    else:
+        for key, value in sub.items():
+            _merge(node[name], [key], value)
+
+
+# Render a spec back into selector syntax, e.g. for the upstream request
+def format_fields(spec):
+    return ','.join(name if sub is None else f'{name}({format_fields(sub)})' for name, sub in spec.items())
+
+
+# Keep only the selected fields of a resource (or of each resource in a list)
+def project(value, spec):
+    if spec is None or '*' in spec:
+        return value
+    if isinstance(value, list):
+        return [project(item, spec) for item in value]
+    if isinstance(value, dict):
+        return {name: project(value[name], sub) for name, sub in spec.items() if name in value}
+    return value
+
+
+def _compact_value(name, value):
+    if value is None or name not in TIME_FIELDS:
+        return value
+    if isinstance(value, dict):
+        value = value.get('dateTime') or value.get('date')
+        if value is None:
+            return None
+    return to_epoch(value)
+
+
+# Lay items out as one array per field, with timestamps as epoch seconds.
+# All-day events are flagged in an extra allDay column since their dates lose that distinction.
+def compact(items, spec):
+    columns = {name: [_compact_value(name, project(item.get(name), sub)) for item in items]
+               for name, sub in spec.items()}
+    if 'start' in spec:
+        columns['allDay'] = ['date' in item.get('start', {}) for item in items]
+    return columns
+
+
+class ListView:
+    """How a list route renders its items, from the `fields` and `format=compact` query parameters."""
+
+    def __init__(self, fields=None, compact=False, compact_fields=''):
+        self.fields = fields
+        self.compact = compact
+        self.spec = parse_fields(fields) if fields else None
+        if compact and self.spec is None:
+            self.spec = parse_fields(compact_fields)
+        if compact and '*' in self.spec:
+            raise ValueError("format=compact needs explicit field names")
+
+    @property
+    def variant(self):
+        """Identifies the representation, so responses differing only in view get distinct ETags."""
+        return f"{self.fields or ''}|{'compact' if self.compact else ''}"
+
+    def upstream_fields(self, required=('id', 'etag')):
+        """The `fields` selector for a Google list call, keeping what server-side caching needs."""
+        if self.spec is None:
+            return None
+        item_spec = dict(self.spec)
+        for name in required:
+            _merge(item_spec, [name], None)
+        return f'items({format_fields(item_spec)}),nextPageToken'
+
+    def render(self, items):
+        if self.compact:
+            return compact(items, self.spec)
+        return project(items, self.spec)
@@ -5,6 +5,8 @@ from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
+from google_clients import get_tasks_service
+from services import fetch_tasks_by_list, iter_items
 
 # If modifying these scopes, delete the file token.json.
 SCOPES = ["https://www.googleapis.com/auth/calendar",
@@ -60,25 +62,21 @@ def main():
 
     # Access Google Tasks
     try:
-        tasks_service = build("tasks", "v1", credentials=creds)
-        tasklists_result = tasks_service.tasklists().list().execute()
-        tasklists = tasklists_result.get('items', [])
+        # The pooled client is thread-safe, so all task lists are fetched concurrently
+        tasks_service = get_tasks_service(creds)
+        tasklists = list(iter_items(tasks_service.tasklists().list))
 
         if not tasklists:
             print('No task lists found.')
         else:
             print('Task lists:')
-            for tasklist in tasklists:
+            for tasklist, tasks in fetch_tasks_by_list(tasks_service, tasklists):
                 print(f"Task list: {tasklist['title']} ({tasklist['id']})")
-                tasks_result = tasks_service.tasks().list(
-                    tasklist=tasklist['id']).execute()
-                tasks = tasks_result.get('items', [])
                 if not tasks:
                     print('  No tasks found.')
                 else:
                     for task in tasks:
-                        print(f"  {task['title']} (due: {
-                              task.get('due', 'No due date')})")
+                        print(f"  {task['title']} (due: {task.get('due', 'No due date')})")
 
     except HttpError as error:
         print(f'An error occurred accessing Tasks API: {error}')
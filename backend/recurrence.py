@@ -0,0 +1,138 @@
+# Local expansion of recurring Calendar events (RRULE/RDATE/EXDATE) into their instances
+import logging
+import re
+from datetime import datetime, timedelta, timezone
+from itertools import islice
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+from dateutil.rrule import rrulestr
+from freebusy import to_epoch
+
+MAX_INSTANCES = 5000  # Instances generated per series and window, whatever the rule says
+
+_DATE_UNTIL = re.compile(r'UNTIL=(\d{8})(?=;|$)')
+_FLOATING_UNTIL = re.compile(r'UNTIL=(\d{8}T\d{6})(?=;|$)')
+
+
+def is_recurring_master(event):
+    return bool(event.get('recurrence'))
+
+
+# Identify an instance by its original start, so exceptions can be matched to generated instances
+def instance_key(start):
+    return to_epoch(start.get('dateTime') or start['date'])
+
+
+def _series_start(master):
+    start = master['start']
+    if 'dateTime' not in start:
+        return datetime.fromisoformat(start['date']), None
+    moment = datetime.fromisoformat(start['dateTime'].replace('Z', '+00:00'))
+    try:
+        tz = ZoneInfo(start['timeZone']) if start.get('timeZone') else None
+    except (ZoneInfoNotFoundError, ValueError):
+        tz = None
+    # Rules repeat on the event's wall clock, so expand in its own time zone across DST changes
+    return (moment.astimezone(tz) if tz else moment), tz
+
+
+def _series_duration(master, dtstart):
+    end = master.get('end', {})
+    if end.get('date'):
+        return datetime.fromisoformat(end['date']) - dtstart
+    if end.get('dateTime'):
+        return datetime.fromisoformat(end['dateTime'].replace('Z', '+00:00')) - dtstart
+    return timedelta(0)
+
+
+def _time_field(moment, all_day, tz_name):
+    if all_day:
+        return {'date': moment.date().isoformat()}
+    field = {'dateTime': moment.isoformat()}
+    if tz_name:
+        field['timeZone'] = tz_name
+    return field
+
+
+def _instance(master, template, occurrence, duration, all_day):
+    tz_name = master['start'].get('timeZone')
+    if all_day:
+        suffix = occurrence.strftime('%Y%m%d')
+    else:
+        suffix = occurrence.astimezone(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+    start = _time_field(occurrence, all_day, tz_name)
+    instance = dict(template)
+    instance.update(id=f"{master['id']}_{suffix}", recurringEventId=master['id'], originalStartTime=start,
+                    start=start, end=_time_field(occurrence + duration, all_day, tz_name))
+    return instance
+
+
+# Generate the instances of a recurring master overlapping [window_start, window_end) (aware datetimes),
+# stepping the rule only as far as the window requires
+def expand_series(master, window_start, window_end, limit=MAX_INSTANCES):
+    dtstart, tz = _series_start(master)
+    all_day = tz is None and dtstart.tzinfo is None
+    duration = _series_duration(master, dtstart)
+    template = {key: value for key, value in master.items() if key != 'recurrence'}
+    lines = master['recurrence']
+    if not all_day:
+        # dateutil needs a UTC UNTIL for timed series; a bare date means through that whole day
+        lines = [_FLOATING_UNTIL.sub(r'UNTIL=\1Z', _DATE_UNTIL.sub(r'UNTIL=\1T235959Z', line)) for line in lines]
+    if all_day:
+        # All-day rules run on naive dates; compare them as UTC midnights
+        window_start = window_start.astimezone(timezone.utc).replace(tzinfo=None)
+        window_end = window_end.astimezone(timezone.utc).replace(tzinfo=None)
+    instances = []
+    try:
+        rules = rrulestr('\n'.join(lines), dtstart=dtstart, forceset=True)
+        # A naive EXDATE or RDATE in an aware series only fails once the set is iterated
+        for occurrence in islice(rules.xafter(window_start - duration, inc=True), limit):
+            if occurrence >= window_end:
+                break
+            if occurrence + duration > window_start or occurrence >= window_start:
+                instances.append(_instance(master, template, occurrence, duration, all_day))
+    except (ValueError, TypeError) as e:
+        # Keep the first occurrence visible rather than dropping the whole series
+        logging.error(f"Cannot expand recurrence of event {master['id']}: {e}")
+        return [_instance(master, template, dtstart, duration, all_day)]
+    return instances
+
+
+class SeriesExpansions:
+    """Memoized expansions of recurring series, per series and window.
+
+    An entry is dropped whenever its master changes (detected by etag), so
+    instances are regenerated only for series that were actually updated.
+    """
+
+    MAX_WINDOWS = 4  # Distinct windows remembered per series
+
+    def __init__(self):
+        self._entries = {}  # master id -> (etag, {(window_start, window_end): instances})
+
+    def instances(self, master, window_start, window_end):
+        etag, windows = self._entries.get(master['id'], (None, None))
+        if windows is None or etag != master.get('etag'):
+            windows = {}
+            self._entries[master['id']] = (master.get('etag'), windows)
+        window = (window_start, window_end)
+        if window not in windows:
+            if len(windows) >= self.MAX_WINDOWS:
+                windows.pop(next(iter(windows)))
+            windows[window] = expand_series(master, window_start, window_end)
+        return windows[window]
+
+    def invalidate(self, master_id):
+        self._entries.pop(master_id, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    def find(self, instance_id):
+        """Return a memoized generated instance by id, or None."""
+        master_id = instance_id.rsplit('_', 1)[0]
+        _, windows = self._entries.get(master_id, (None, {}))
+        for instances in windows.values():
+            for instance in instances:
+                if instance['id'] == instance_id:
+                    return instance
+        return None
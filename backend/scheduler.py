@@ -0,0 +1,124 @@
+# Multi-task scheduling: heap-ordered greedy placement of tasks into free time
+import heapq
+from array import array
+
+PRIORITY_LEVELS = {'low': 1, 'medium': 2, 'high': 3}  # Larger numbers are scheduled first
+NO_DEADLINE = 2 ** 62
+
+
+class FreeSlots:
+    """Sorted, non-overlapping free gaps with a max segment tree over their lengths.
+
+    Finding the earliest gap that can hold a given duration and consuming time
+    from the front of a gap are both O(log n), so placing N tasks into G gaps
+    costs O((N + G) log G) instead of a scan of every gap per task.
+    """
+
+    def __init__(self, gaps):
+        self.starts = array('q', (start for start, _ in gaps))
+        self.ends = array('q', (end for _, end in gaps))
+        self.size = 1
+        while self.size < len(gaps):
+            self.size *= 2
+        self.tree = array('q', [0]) * (2 * self.size)
+        for index, (start, end) in enumerate(gaps):
+            self.tree[self.size + index] = end - start
+        for node in range(self.size - 1, 0, -1):
+            self.tree[node] = max(self.tree[2 * node], self.tree[2 * node + 1])
+
+    def __len__(self):
+        return len(self.starts)
+
+    def find(self, min_length, first=0):
+        """Index of the first gap at or after `first` at least min_length long, or None."""
+        if first >= len(self.starts) or self.tree[1] < min_length:
+            return None
+        return self._find(1, 0, self.size, min_length, first)
+
+    def _find(self, node, lo, hi, min_length, first):
+        if hi <= first or self.tree[node] < min_length:
+            return None
+        if hi - lo == 1:
+            return lo
+        mid = (lo + hi) // 2
+        found = self._find(2 * node, lo, mid, min_length, first)
+        if found is None:
+            found = self._find(2 * node + 1, mid, hi, min_length, first)
+        return found
+
+    def take(self, index, seconds, clearance=0):
+        """Consume seconds (plus clearance before the next placement) from the front of a gap."""
+        self.starts[index] = min(self.starts[index] + seconds + clearance, self.ends[index])
+        node = self.size + index
+        self.tree[node] = self.ends[index] - self.starts[index]
+        node //= 2
+        while node:
+            self.tree[node] = max(self.tree[2 * node], self.tree[2 * node + 1])
+            node //= 2
+
+
+class ScheduledTask:
+    """One task to place: duration, priority and deadline in epoch seconds."""
+
+    def __init__(self, task_id, duration, priority=PRIORITY_LEVELS['medium'], deadline=None, min_chunk=None):
+        self.id = task_id
+        self.duration = duration
+        self.priority = priority
+        self.deadline = NO_DEADLINE if deadline is None else deadline
+        self.min_chunk = min_chunk  # None keeps the task in one piece
+
+    def sort_key(self):
+        # Higher priority first, then earliest deadline, then longest first so big tasks get large gaps
+        return (-self.priority, self.deadline, -self.duration)
+
+
+def _place_whole(slots, task, clearance):
+    index = slots.find(task.duration)
+    if index is None or slots.starts[index] + task.duration > task.deadline:
+        return None
+    start = slots.starts[index]
+    slots.take(index, task.duration, clearance)
+    return [(start, start + task.duration)]
+
+
+def _place_chunks(slots, task, clearance):
+    # Plan every chunk before consuming any time, so a task that cannot finish leaves no trace
+    pieces = []
+    remaining = task.duration
+    index = 0
+    while remaining > 0:
+        # Every piece, the last included, is at least min_chunk long
+        index = slots.find(task.min_chunk, index)
+        if index is None or slots.starts[index] + task.min_chunk > task.deadline:
+            return None
+        start = slots.starts[index]
+        length = min(remaining, slots.ends[index] - start, task.deadline - start)
+        if 0 < remaining - length < task.min_chunk:
+            # Leave a whole chunk for the next piece, or skip a gap too short to split that way
+            length = remaining - task.min_chunk
+            if length < task.min_chunk:
+                index += 1
+                continue
+        pieces.append((index, start, start + length))
+        remaining -= length
+        index += 1
+    for index, start, end in pieces:
+        slots.take(index, end - start, clearance)
+    return [(start, end) for _, start, end in pieces]
+
+
+# Place every task into the free gaps in one pass, returning each task's (start, end) pieces
+# in input order (None for a task that cannot be placed before its deadline)
+def schedule(tasks, gaps, clearance=0):
+    slots = FreeSlots(gaps)
+    heap = [(task.sort_key(), index) for index, task in enumerate(tasks)]
+    heapq.heapify(heap)
+    placements = [None] * len(tasks)
+    while heap and len(slots):
+        _, index = heapq.heappop(heap)
+        task = tasks[index]
+        if task.min_chunk and task.min_chunk < task.duration:
+            placements[index] = _place_chunks(slots, task, clearance)
+        else:
+            placements[index] = _place_whole(slots, task, clearance)
+    return placements
@@ -1,9 +1,12 @@
 # Import necessary modules
-from datetime import datetime, timedelta, timezone
+from datetime import datetime, timezone
 from googleapiclient.errors import HttpError
 from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
 import json
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from freebusy import BusyIndex, from_epoch, to_epoch
+from scheduler import PRIORITY_LEVELS, ScheduledTask, schedule
 
 
 # Functions that handle credentials
@@ -37,11 +40,17 @@ def get_credentials_from_session(session):
     creds_json = session.get('credentials')
     if creds_json:
         creds_info = json.loads(creds_json)
-        print("Retrieved credentials from session:", creds_info)  # Debug log
         return deserialize_credentials(creds_info)
     return None
 
 
+# Get a stable key identifying the user behind this session for server-side caches
+def get_user_key(session):
+    if 'user_key' not in session:
+        session['user_key'] = uuid.uuid4().hex
+    return session['user_key']
+
+
 # Validate event input data
 def validate_event_input(event_data):
     required_fields = ['summary', 'start', 'end']
@@ -59,60 +68,135 @@ def validate_event_input(event_data):
     return errors
 
 
+# Pagination helpers
+# Yield each response page of a Google list call, following nextPageToken
+def iter_pages(list_method, **params):
+    page_token = params.pop('pageToken', None)
+    while True:
+        result = list_method(pageToken=page_token, **params).execute()
+        yield result
+        page_token = result.get('nextPageToken')
+        if not page_token:
+            return
+
+
+# Yield every item of a Google list call, one upstream page at a time
+def iter_items(list_method, **params):
+    for page in iter_pages(list_method, **params):
+        yield from page.get('items', [])
+
+
+# Batch-related functions
+BATCH_LIMIT = 50  # Calendar and Tasks APIs accept at most 50 calls per batch request
+
+
+# Send (key, HttpRequest) pairs as Google batch requests and collect each item's outcome
+def execute_batch(service, requests, limit=BATCH_LIMIT):
+    outcomes = {}
+
+    def callback(request_id, response, exception):
+        outcomes[request_id] = (response, exception)
+
+    for start in range(0, len(requests), limit):
+        chunk = requests[start:start + limit]
+        batch = service.new_batch_http_request(callback=callback)
+        for key, request in chunk:
+            batch.add(request, request_id=str(key))
+        try:
+            batch.execute()
+        except HttpError as error:
+            # The batch call itself failed, so every item in this chunk failed with it
+            for key, _ in chunk:
+                outcomes.setdefault(str(key), (None, error))
+    return outcomes
+
+
+# Describe one batch item's outcome for the client
+def batch_item_result(index, response, exception, status=200):
+    if exception is None:
+        return {"index": index, "status": status, "result": response}
+    if isinstance(exception, HttpError):
+        return {"index": index, "status": exception.resp.status, "error": str(exception)}
+    return {"index": index, "status": 500, "error": str(exception)}
+
+
 # Task-related functions
+TASKS_PAGE_SIZE = 100  # Largest page the Tasks API will return
+TASKLIST_WORKERS = 8  # Task lists fetched concurrently by get_tasks
+
+
 # Create a new task
 def create_task(service, tasklist='@default', title="New Task", due=None):
     new_task = {'title': title, 'due': due}
-    try:
-        return service.tasks().insert(tasklist=tasklist, body=new_task).execute()
-    except Exception as e:
-        return None
+    return service.tasks().insert(tasklist=tasklist, body=new_task).execute()
 
 
 # Calendar-related functions
+FREEBUSY_CALENDAR_LIMIT = 50  # Calendars the freebusy API accepts per query
+
+
+# Get the ids of the calendars the user has selected for display
+def get_selected_calendar_ids(calendar_service):
+    calendar_ids = [calendar['id'] for calendar in iter_items(calendar_service.calendarList().list)
+                    if calendar.get('selected') or calendar.get('primary')]
+    return calendar_ids or ['primary']
+
+
+# Build a BusyIndex for [time_min, time_max) from freebusy data across the user's calendars
+def get_busy_index(calendar_service, time_min, time_max, calendar_ids=None):
+    if calendar_ids is None:
+        calendar_ids = get_selected_calendar_ids(calendar_service)
+    busy_lists = []
+    for start in range(0, len(calendar_ids), FREEBUSY_CALENDAR_LIMIT):
+        result = calendar_service.freebusy().query(body={
+            'timeMin': time_min,
+            'timeMax': time_max,
+            'items': [{'id': calendar_id} for calendar_id in calendar_ids[start:start + FREEBUSY_CALENDAR_LIMIT]],
+        }).execute()
+        for calendar in result.get('calendars', {}).values():
+            # Each calendar's busy list is already sorted by start
+            busy_lists.append([(to_epoch(busy['start']), to_epoch(busy['end'])) for busy in calendar.get('busy', [])])
+    return BusyIndex.from_busy_lists(busy_lists)
+
+
 # Get free time slots within a specified time range
 def get_free_times(calendar_service, time_min, time_max, duration=60):
     try:
-        events_result = calendar_service.events().list(
-            calendarId='primary', timeMin=time_min, timeMax=time_max, singleEvents=True, orderBy='startTime').execute()
-        events = events_result.get('items', [])
-        free_times = []
-        start_time = datetime.fromisoformat(time_min[:-1])
-        end_time = datetime.fromisoformat(time_max[:-1])
-        last_end_time = start_time
-        for event in events:
-            event_start = datetime.fromisoformat(
-                event['start'].get('dateTime')[:-1])
-            event_end = datetime.fromisoformat(
-                event['end'].get('dateTime')[:-1])
-            if last_end_time + timedelta(minutes=duration) <= event_start:
-                free_times.append((last_end_time, event_start))
-            last_end_time = max(last_end_time, event_end)
-        if last_end_time + timedelta(minutes=duration) <= end_time:
-            free_times.append((last_end_time, end_time))
-        return free_times
+        index = get_busy_index(calendar_service, time_min, time_max)
+        gaps = index.free_gaps(to_epoch(time_min), to_epoch(time_max), duration * 60)
+        return [(from_epoch(start).replace(tzinfo=None), from_epoch(end).replace(tzinfo=None))
+                for start, end in gaps]
     except HttpError as error:
         return []
 
 
+# Fetch every task of each list in parallel, returning (task_list, tasks) pairs in list order
+def fetch_tasks_by_list(task_service, task_lists, max_workers=TASKLIST_WORKERS, **filters):
+    def fetch(task_list):
+        # Pages of one list are chained by token, so they are walked in order by one worker
+        return list(iter_items(task_service.tasks().list, tasklist=task_list['id'],
+                               maxResults=TASKS_PAGE_SIZE, **filters))
+
+    if len(task_lists) <= 1:
+        return [(task_list, fetch(task_list)) for task_list in task_lists]
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(task_lists))) as executor:
+        return list(zip(task_lists, executor.map(fetch, task_lists)))
+
+
 # Get tasks within a specified due date range
 def get_tasks(task_service, due_min, due_max):
     try:
-        task_lists = task_service.tasklists().list().execute()
-        all_tasks = []
-        for task_list in task_lists['items']:
-            tasks = task_service.tasks().list(
-                tasklist=task_list['id']).execute()
-            for task in tasks.get('items', []):
-                if 'due' in task and due_min <= task['due'] <= due_max:
-                    all_tasks.append(task)
-        return all_tasks
+        task_lists = list(iter_items(task_service.tasklists().list, maxResults=TASKS_PAGE_SIZE))
+        # The due date filter is applied by the Tasks API instead of after download
+        results = fetch_tasks_by_list(task_service, task_lists, dueMin=due_min, dueMax=due_max)
+        return [task for _, tasks in results for task in tasks if 'due' in task]
     except HttpError as error:
         return []
 
 
 # Suggest time slots for tasks based on calendar events and other parameters
-def suggest_time_slots(calendar_service, task_duration_minutes, latest_possible_date, priority, deadline, timeMin=None):
+def suggest_time_slots(calendar_service, task_duration_minutes, latest_possible_date, priority, deadline, timeMin=None,
+                       buffer_minutes=0, working_hours=None):
     try:
         task_duration_minutes = int(task_duration_minutes)
 
@@ -130,42 +214,72 @@ def suggest_time_slots(calendar_service, task_duration_minutes, latest_possible_
 
         end_search_date = min(deadline, latest_date)
 
-        events_result = calendar_service.events().list(
-            calendarId='primary',
-            timeMin=timeMin.isoformat(),
-            timeMax=end_search_date.isoformat(),
-            singleEvents=True,
-            orderBy='startTime'
-        ).execute()
-
-        events = events_result.get('items', [])
-        free_times = []
-        last_end_time = timeMin
+        # Only busy intervals are fetched, for every selected calendar in one query
+        index = get_busy_index(calendar_service, timeMin.isoformat(), end_search_date.isoformat())
+        free_times = index.free_gaps(
+            int(timeMin.timestamp()), int(end_search_date.timestamp()), task_duration_minutes * 60,
+            buffer_seconds=buffer_minutes * 60, working_hours=working_hours)
 
-        for event in events:
-            # Extract start and end times, checking if 'dateTime' or 'date' is used
-            event_start_str = event['start'].get(
-                'dateTime') or event['start'].get('date') + 'T00:00:00Z'
-            event_end_str = event['end'].get(
-                'dateTime') or event['end'].get('date') + 'T00:00:00Z'
+        return [(from_epoch(start).isoformat(), from_epoch(end).isoformat()) for start, end in free_times]
+    except Exception as e:
+        raise ValueError(f"Error processing time slots: {str(e)}")
 
-            # Parse datetime strings, ensuring timezone info is handled properly
-            event_start = datetime.fromisoformat(
-                event_start_str).astimezone(utc_zone)
-            event_end = datetime.fromisoformat(
-                event_end_str).astimezone(utc_zone)
 
-            if (event_start - last_end_time).total_seconds() >= task_duration_minutes * 60:
-                free_times.append((last_end_time, event_start))
+# Multi-task scheduling
+SCHEDULE_HORIZON_DAYS = 90  # Default search horizon for schedule_tasks
+MAX_SCHEDULE_TASKS = 1000  # Tasks accepted by one schedule_tasks call
 
-            last_end_time = max(last_end_time, event_end)
 
-        if (end_search_date - last_end_time).total_seconds() >= task_duration_minutes * 60:
-            free_times.append((last_end_time, end_search_date))
+# Convert a JSON-style task ({"id", "durationMinutes", "priority", "deadline", "minChunkMinutes"})
+# to a ScheduledTask; priority is low/medium/high or a number where larger is more urgent
+def parse_schedule_task(task, index):
+    if not isinstance(task, dict):
+        raise ValueError(f"Task {index} must be an object")
+    try:
+        duration = int(task['durationMinutes']) * 60
+    except (KeyError, TypeError, ValueError):
+        raise ValueError(f"Task {index} needs an integer durationMinutes")
+    if duration <= 0:
+        raise ValueError(f"Task {index} durationMinutes must be positive")
+    priority = task.get('priority', 'medium')
+    if isinstance(priority, str):
+        if priority not in PRIORITY_LEVELS:
+            raise ValueError(f"Task {index} priority must be one of {', '.join(PRIORITY_LEVELS)} or a number")
+        priority = PRIORITY_LEVELS[priority]
+    elif not isinstance(priority, (int, float)):
+        raise ValueError(f"Task {index} priority must be one of {', '.join(PRIORITY_LEVELS)} or a number")
+    deadline = to_epoch(task['deadline']) if task.get('deadline') else None
+    min_chunk = int(task['minChunkMinutes']) * 60 if task.get('minChunkMinutes') else None
+    if min_chunk is not None and min_chunk <= 0:
+        raise ValueError(f"Task {index} minChunkMinutes must be positive")
+    return ScheduledTask(task.get('id', index), duration, priority, deadline, min_chunk)
+
+
+# Place many tasks into the user's free time at once, honouring priority and deadline.
+# Returns one {"id", "scheduled", "slots"} entry per task, in input order.
+def schedule_tasks(calendar_service, tasks, time_min=None, time_max=None, buffer_minutes=0, working_hours=None):
+    if len(tasks) > MAX_SCHEDULE_TASKS:
+        raise ValueError(f"At most {MAX_SCHEDULE_TASKS} tasks can be scheduled at once")
+    if buffer_minutes < 0:
+        raise ValueError("bufferMinutes must not be negative")
+    parsed = [parse_schedule_task(task, index) for index, task in enumerate(tasks)]
+    window_start = to_epoch(time_min) if time_min else int(datetime.now(timezone.utc).timestamp())
+    window_end = to_epoch(time_max) if time_max else window_start + SCHEDULE_HORIZON_DAYS * 86400
+    if window_end <= window_start:
+        raise ValueError("timeMax must be after timeMin")
+    if not parsed:
+        return []
 
-        return [(slot[0].isoformat(), slot[1].isoformat()) for slot in free_times]
-    except Exception as e:
-        raise ValueError(f"Error processing time slots: {str(e)}")
+    index = get_busy_index(calendar_service, from_epoch(window_start).isoformat(), from_epoch(window_end).isoformat())
+    # Gaps shorter than the smallest piece any task can be split into are never usable
+    shortest = min(min(task.min_chunk or task.duration, task.duration) for task in parsed)
+    gaps = index.free_gaps(window_start, window_end, shortest,
+                           buffer_seconds=buffer_minutes * 60, working_hours=working_hours)
+    placements = schedule(parsed, gaps, clearance=buffer_minutes * 60)
+    return [{"id": task.id, "scheduled": pieces is not None,
+             "slots": [{"start": from_epoch(start).isoformat(), "end": from_epoch(end).isoformat()}
+                       for start, end in pieces or []]}
+            for task, pieces in zip(parsed, placements)]
 
 
 # Validate event input data
@@ -184,14 +298,13 @@ def validate_event_input(event_data):
     return errors
 
 
-# Handle event planning based on suggested time slots
-def handle_event_planning(calendar_service, task_service, suggest_time_slots, create_task):
-    suggested_slots = suggest_time_slots(
-        calendar_service, duration=60, latest_possible_date="2024-10-01T00:00:00Z")
+# Schedule the given tasks into free time and create one Google task for each task placed,
+# due at the start of its first slot
+def handle_event_planning(calendar_service, task_service, tasks, time_min=None, time_max=None):
+    plan = schedule_tasks(calendar_service, tasks, time_min, time_max)
     results = []
-    for slot in suggested_slots:
-        due_date = slot.isoformat() if isinstance(slot, datetime) else slot
-        result = create_task(
-            task_service, title="Prepare for event", due=due_date)
-        results.append(result)
+    for task, placement in zip(tasks, plan):
+        if placement['scheduled']:
+            results.append(create_task(task_service, title=task.get('title', "New Task"),
+                                       due=placement['slots'][0]['start']))
     return results
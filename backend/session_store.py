@@ -0,0 +1,181 @@
+# Session storage: an in-memory LRU tier in front of a SQLite (WAL) persistent tier
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+import msgspec
+from cachelib.base import BaseCache
+from metrics import record_cache
+from sqlite_store import SQLiteStore, database_path
+
+MEMORY_MAX_ENTRIES = 10000  # Sessions kept decoded in memory per process
+EXPIRY_SLACK = 60 * 60  # Seconds an unchanged session's expiry may lag before it is rewritten
+CLEANUP_EVERY = 500  # Writes between sweeps of expired rows
+
+_encoder = msgspec.msgpack.Encoder()
+_decoder = msgspec.msgpack.Decoder()
+UNCHANGED = object()  # SQLiteSessionStore.get's value for a session still at the caller's version
+
+
+# Encode a session dict as MessagePack, storing the credentials JSON as a native map
+def encode_session(data):
+    data = dict(data)
+    credentials = data.pop('credentials', None)
+    if credentials is not None:
+        data['__credentials__'] = json.loads(credentials)
+    return _encoder.encode(data)
+
+
+def decode_session(payload):
+    data = _decoder.decode(payload)
+    credentials = data.pop('__credentials__', None)
+    if credentials is not None:
+        # Rebuilt exactly as save_credentials_to_session wrote it
+        data['credentials'] = json.dumps(credentials)
+    return data
+
+
+class SQLiteSessionStore(SQLiteStore):
+    """Persistent session tier: one row per session in a WAL-mode SQLite database.
+
+    Every write gives the row a new random version, so a process holding a
+    decoded copy can tell whether anyone has written that session since.
+    """
+
+    schema = '''
+    CREATE TABLE IF NOT EXISTS sessions (id TEXT PRIMARY KEY, data BLOB NOT NULL, expires REAL NOT NULL,
+                                         version INTEGER NOT NULL DEFAULT 0);
+    CREATE INDEX IF NOT EXISTS sessions_expires ON sessions (expires);
+    '''
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.writes = 0
+
+    def connect(self):
+        conn = super().connect()
+        if 'version' not in [column[1] for column in conn.execute('PRAGMA table_info(sessions)')]:
+            conn.execute('ALTER TABLE sessions ADD COLUMN version INTEGER NOT NULL DEFAULT 0')
+        return conn
+
+    def get(self, key, known_version=None):
+        """Return (value, expires, version), or Nones if there is no live session.
+
+        value is UNCHANGED, and the payload is not read, when the row is still at known_version.
+        """
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT CASE WHEN version = ? THEN NULL ELSE data END, expires, version FROM sessions WHERE id = ?',
+                (known_version, key)).fetchone()
+        if row is None or row[1] <= time.time():
+            return None, None, None
+        if row[2] == known_version:
+            return UNCHANGED, row[1], row[2]
+        return decode_session(row[0]), row[1], row[2]
+
+    def set(self, key, value, expires):
+        """Write a session and return its new version."""
+        payload = encode_session(value)
+        version = int.from_bytes(os.urandom(8), 'big') >> 1  # Never reused, unlike a counter restarted by a delete
+        with self.lock:
+            self.conn.execute(
+                'INSERT INTO sessions (id, data, expires, version) VALUES (?, ?, ?, ?) ON CONFLICT(id) DO UPDATE '
+                'SET data = excluded.data, expires = excluded.expires, version = excluded.version',
+                (key, payload, expires, version))
+            self.writes += 1
+            if self.writes % CLEANUP_EVERY == 0:
+                self.conn.execute('DELETE FROM sessions WHERE expires <= ?', (time.time(),))
+        return version
+
+    def delete(self, key):
+        with self.lock:
+            return self.conn.execute('DELETE FROM sessions WHERE id = ?', (key,)).rowcount > 0
+
+    def clear(self):
+        with self.lock:
+            self.conn.execute('DELETE FROM sessions')
+
+
+class TieredSessionCache(BaseCache):
+    """cachelib-compatible session cache for Flask-Session's 'cachelib' session type.
+
+    Reads are served from a decoded in-memory LRU, after checking against
+    the persistent tier that the session's version has not moved; writes go
+    through to both. A session written by another process is reloaded the
+    next time it is read here, without disturbing the rest of the LRU, so
+    several workers can share one database.
+    """
+
+    def __init__(self, persistent, max_entries=MEMORY_MAX_ENTRIES, default_timeout=300):
+        super().__init__(default_timeout)
+        self.persistent = persistent
+        self.max_entries = max_entries
+        self._memory = OrderedDict()  # key -> (value, expires, version)
+        self._lock = threading.Lock()
+
+    def _expires(self, timeout):
+        timeout = self._normalize_timeout(timeout)
+        # cachelib treats a timeout of 0 as "never expires"
+        return time.time() + timeout if timeout else float('inf')
+
+    def _remember(self, key, value, expires, version):
+        with self._lock:
+            self._memory[key] = (value, expires, version)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._memory.get(key)
+        value, expires, version = self.persistent.get(key, entry[2] if entry is not None else None)
+        if value is UNCHANGED:
+            with self._lock:
+                if key in self._memory:
+                    self._memory.move_to_end(key)
+            record_cache('sessions', True)
+            return entry[0]
+        record_cache('sessions', False)
+        if value is None:
+            with self._lock:
+                self._memory.pop(key, None)
+            return None
+        self._remember(key, value, expires, version)
+        return value
+
+    def set(self, key, value, timeout=None):
+        expires = self._expires(timeout)
+        with self._lock:
+            entry = self._memory.get(key)
+        # Flask refreshes the session on every request; skip writes that change nothing
+        if entry is not None and entry[0] == value and expires - entry[1] < EXPIRY_SLACK:
+            return True
+        version = self.persistent.set(key, value, expires)
+        self._remember(key, dict(value), expires, version)
+        return True
+
+    def add(self, key, value, timeout=None):
+        if self.has(key):
+            return False
+        return self.set(key, value, timeout)
+
+    def has(self, key):
+        return self.get(key) is not None
+
+    def delete(self, key):
+        with self._lock:
+            self._memory.pop(key, None)
+        self.persistent.delete(key)
+        return True
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+        self.persistent.clear()
+        return True
+
+
+# Create the session cache configured by SESSION_DB_PATH (default: sessions.db beside the app)
+def create_session_cache():
+    return TieredSessionCache(SQLiteSessionStore(database_path('SESSION_DB_PATH', 'sessions.db')))
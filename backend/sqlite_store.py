@@ -0,0 +1,58 @@
+# Base for state kept in one WAL-mode SQLite database shared by every worker process
+import os
+import sqlite3
+import threading
+
+
+# The database path named by an environment variable, or `filename` beside the app
+def database_path(variable, filename):
+    return os.getenv(variable, os.path.join(os.path.dirname(os.path.abspath(__file__)), filename))
+
+
+class SQLiteStore:
+    """A SQLite database shared by every worker process, with this process's connection and threads.
+
+    Neither connections nor threads survive a fork, so each process opens its
+    own connection on first use and starts its own background threads through
+    ensure_started(). Subclasses set schema (and row_factory) and implement
+    start_threads() if they run any.
+    """
+
+    schema = ''
+    row_factory = None
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+        self._started_pid = None
+
+    @property
+    def conn(self):
+        if self._pid != os.getpid():
+            self._conn = self.connect()
+            self._pid = os.getpid()
+        return self._conn
+
+    def connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=30)
+        if self.row_factory is not None:
+            conn.row_factory = self.row_factory
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.executescript(self.schema)
+        return conn
+
+    def ensure_started(self):
+        """Start this process's background threads if they are not running yet."""
+        if self._started_pid == os.getpid():
+            return
+        with self.lock:
+            if self._started_pid == os.getpid():
+                return
+            self._started_pid = os.getpid()
+            self.start_threads()
+
+    def start_threads(self):
+        raise NotImplementedError
@@ -0,0 +1,52 @@
+# Shared setup: the backend modules are imported from the parent directory, and every
+# test session talks to its own fake Google server and keeps its databases in a temp dir
+import json
+import os
+import sys
+import tempfile
+
+import pytest
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND)
+sys.path.insert(0, os.path.join(BACKEND, 'benchmarks'))
+
+from fake_google import start_fake_google  # noqa: E402
+
+DATA_DIR = tempfile.mkdtemp(prefix='duratasks-tests-')
+SERVER, GOOGLE, ROOT_URL = start_fake_google(events=50, recurring=2, task_lists=2, tasks_per_list=5)
+# Read when the modules are first imported, so set before any test module imports them
+os.environ['GOOGLE_API_ROOT_URL'] = ROOT_URL
+for name in ('SESSION', 'OUTBOX', 'WATCH', 'MIRROR'):
+    os.environ[f'{name}_DB_PATH'] = os.path.join(DATA_DIR, f'{name.lower()}.db')
+os.environ.setdefault('APP_SECRET_KEY', 'tests')
+
+
+@pytest.fixture
+def google():
+    """The fake Google server's data, with error injection reset after each test."""
+    yield GOOGLE
+    GOOGLE.error_rate = 0.0
+
+
+
+@pytest.fixture
+def credentials_json():
+    """Serialized credentials the fake Google server accepts."""
+    from datetime import datetime, timedelta
+    from google.oauth2.credentials import Credentials
+    from services import serialize_credentials
+    credentials = Credentials(token='fake-token', token_uri=ROOT_URL + 'token', client_id='tests',
+                              client_secret='tests', expiry=datetime.utcnow() + timedelta(days=1))
+    return json.dumps(serialize_credentials(credentials))
+
+
+@pytest.fixture
+def client():
+    """A Flask test client signed in with credentials the fake Google server accepts."""
+    from app import app
+    from load_test import create_session
+    sid, _ = create_session(app)
+    test_client = app.test_client()
+    test_client.set_cookie('session', sid)
+    return test_client
@@ -0,0 +1,59 @@
+import asyncio
+import json
+
+import pytest
+
+from load_test import create_session
+
+
+def call(application, path, cookie):
+    scope = {'type': 'http', 'method': 'GET', 'path': path, 'query_string': b'page_size=5',
+             'headers': [(b'cookie', f'session={cookie}'.encode())]}
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    async def serve():
+        from async_google import close_async_client
+        try:
+            await application(scope, receive, send)
+        finally:
+            await close_async_client()  # As at server shutdown; the client belongs to this loop
+
+    asyncio.run(serve())
+    return messages
+
+
+@pytest.fixture
+def sid():
+    from app import app
+    return create_session(app)[0]
+
+
+def test_events_are_served_by_the_async_handler(sid):
+    from asgi import application
+    start, body = call(application, '/events', sid)
+    assert start['status'] == 200
+    page = json.loads(body['body'])
+    assert len(page['items']) == 5 and page['nextCursor']
+
+
+def test_credentials_are_loaded_off_the_event_loop(sid, monkeypatch):
+    import asgi
+    from credential_cache import get_cached_credentials
+    loops = []
+
+    def record(session):
+        try:
+            loops.append(asyncio.get_running_loop())
+        except RuntimeError:
+            loops.append(None)
+        return get_cached_credentials(session)
+
+    monkeypatch.setattr(asgi, 'get_cached_credentials', record)
+    start, _ = call(asgi.application, '/events', sid)
+    assert start['status'] == 200 and loops == [None]
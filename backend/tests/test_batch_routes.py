@@ -0,0 +1,65 @@
+from event_store import get_event_store
+
+EVENT = {'summary': 'Batch', 'start': {'dateTime': '2030-01-07T09:00:00Z'}, 'end': {'dateTime': '2030-01-07T10:00:00Z'}}
+
+
+def sign_in_as(client, user_key):
+    with client.session_transaction() as session:
+        session['user_key'] = user_key
+
+
+def post_batch(client, route, operations):
+    response = client.post(route, json={'operations': operations})
+    assert response.status_code == 200
+    return response.json['results']
+
+
+def test_batch_events_report_each_operation(client, google):
+    sign_in_as(client, 'batch-events')
+    store = get_event_store('batch-events')
+    existing = dict(EVENT, id='batch-existing')
+    google.calendars['primary']['batch-existing'] = existing
+    store.apply(existing)
+
+    results = post_batch(client, '/batch/events', [
+        {'op': 'create', 'body': EVENT},
+        {'op': 'move', 'id': 'batch-existing'},
+        {'op': 'update', 'body': EVENT},
+        {'op': 'create', 'body': {'summary': 'No times'}},
+        {'op': 'update', 'id': 'batch-missing', 'body': EVENT},
+        {'op': 'delete', 'id': 'batch-existing'},
+        'not an operation',
+    ])
+    assert [result['index'] for result in results] == list(range(7))
+    assert [result['status'] for result in results] == [201, 400, 400, 400, 404, 200, 400]
+    assert results[2]['error'] == 'id is required' and results[3]['error'] == 'Invalid event data'
+
+    created = results[0]['result']
+    assert google.calendars['primary'][created['id']]['summary'] == 'Batch'
+    assert created['id'] in store.events
+    assert 'batch-existing' not in store.events and 'batch-existing' not in google.calendars['primary']
+    assert 'batch-missing' not in store.events
+
+
+def test_batch_tasks_report_each_operation(client, google):
+    sign_in_as(client, 'batch-tasks')
+    list_id = google.task_lists[0]['id']
+    existing = google.tasks[list_id][0]['id']
+
+    results = post_batch(client, '/batch/tasks', [
+        {'op': 'create', 'tasklist': list_id, 'body': {'title': 'Batch'}},
+        {'op': 'delete', 'tasklist': list_id},
+        {'op': 'update', 'tasklist': list_id, 'id': existing, 'body': {'id': existing, 'title': 'Renamed'}},
+        {'op': 'delete', 'tasklist': list_id, 'id': 'batch-missing'},
+        {'op': 'create', 'tasklist': 'no-such-list', 'body': {'title': 'Lost'}},
+    ])
+    assert [result['status'] for result in results] == [201, 400, 200, 404, 404]
+    titles = {task['id']: task['title'] for task in google.tasks[list_id]}
+    assert titles[results[0]['result']['id']] == 'Batch' and titles[existing] == 'Renamed'
+
+
+def test_batch_without_operations_is_rejected(client):
+    for payload in ({}, {'operations': []}, {'operations': {'op': 'create'}}):
+        response = client.post('/batch/events', json=payload)
+        assert response.status_code == 400
+        assert response.json['error'] == 'Invalid batch request'
@@ -0,0 +1,77 @@
+import io
+import json
+
+from bulk_transfer import (fold, format_ics, format_ndjson, import_items, iter_text_lines, parse_ics, parse_ndjson,
+                           unfold)
+
+EVENT = {'kind': 'calendar#event', 'id': 'abc', 'etag': '"1"', 'iCalUID': 'abc@tests', 'status': 'confirmed',
+         'summary': 'Review; plan, ship', 'description': 'Line one\nLine two', 'location': 'Room 1',
+         'start': {'dateTime': '2026-10-20T09:00:00', 'timeZone': 'Europe/Paris'},
+         'end': {'dateTime': '2026-10-20T10:00:00', 'timeZone': 'Europe/Paris'},
+         'recurrence': ['RRULE:FREQ=WEEKLY;COUNT=3']}
+TASK = {'kind': 'tasks#task', 'id': 't1', 'title': 'File report', 'notes': 'Before Friday',
+        'status': 'needsAction', 'due': '2026-10-23T00:00:00.000Z'}
+
+
+def read(text):
+    return iter_text_lines(io.BytesIO(text.encode()))
+
+
+def services(credentials_json):
+    from google_clients import get_calendar_service, get_tasks_service
+    from services import deserialize_credentials
+    credentials = deserialize_credentials(json.loads(credentials_json))
+    return get_calendar_service(credentials), get_tasks_service(credentials)
+
+
+def test_fold_keeps_lines_within_75_octets_without_splitting_characters():
+    line = 'DESCRIPTION:' + 'é' * 100
+    folded = fold(line)
+    assert all(len(part.encode()) <= 75 for part in folded.split('\r\n'))
+    assert list(unfold(read(folded + '\r\n'))) == [line]
+
+
+def test_ics_round_trip():
+    text = ''.join(format_ics([EVENT, TASK]))
+    (event_kind, event, event_errors), (task_kind, task, task_errors) = parse_ics(read(text))
+    assert (event_kind, task_kind, event_errors, task_errors) == ('event', 'task', [], [])
+    for field in ('iCalUID', 'summary', 'description', 'location', 'start', 'end', 'recurrence'):
+        assert event[field] == EVENT[field]
+    assert task['title'] == TASK['title'] and task['notes'] == TASK['notes'] and task['due'].startswith('2026-10-23')
+
+
+def test_ndjson_round_trip_reports_bad_lines():
+    text = ''.join(format_ndjson([EVENT, TASK])) + 'not json\n[1]\n'
+    parsed = list(parse_ndjson(read(text)))
+    assert [(kind, body) for kind, body, _ in parsed[:2]] == [('event', EVENT), ('task', TASK)]
+    assert [errors != [] for _, _, errors in parsed] == [False, False, True, True]
+
+
+def test_reimporting_an_export_updates_instead_of_duplicating(credentials_json, google):
+    calendar, tasks = services(credentials_json)
+    event = dict(EVENT, iCalUID='reimport@tests', recurrence=None)
+    for _ in range(2):
+        reports = list(import_items(calendar, tasks, [('event', event, [])]))
+        assert reports[-1] == {'type': 'done', 'processed': 1, 'imported': 1, 'failed': 0}
+    copies = [item for item in google.calendars['primary'].values() if item.get('iCalUID') == 'reimport@tests']
+    assert len(copies) == 1
+
+
+def test_invalid_items_are_reported_and_valid_ones_imported(credentials_json, google):
+    calendar, tasks = services(credentials_json)
+    instance = dict(EVENT, iCalUID=None, recurringEventId='series', originalStartTime=EVENT['start'])
+    created = []
+    reports = list(import_items(calendar, tasks, [('event', instance, []), ('task', TASK, []), (None, None, ['bad'])],
+                                on_created=lambda kind, body: created.append(kind)))
+    assert [report['index'] for report in reports if report['type'] == 'error'] == [0, 2]
+    assert reports[-1] == {'type': 'done', 'processed': 3, 'imported': 1, 'failed': 2}
+    assert created == ['task']
+
+
+def test_rate_limited_items_are_retried(credentials_json, google):
+    calendar, tasks = services(credentials_json)
+    errors = google.errors
+    google.error_rate = 0.1
+    items = [('task', dict(TASK, title=f'Retried {i}'), []) for i in range(20)]
+    reports = list(import_items(calendar, tasks, items, batch_size=10))
+    assert reports[-1]['imported'] == 20 and google.errors > errors
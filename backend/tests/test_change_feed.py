@@ -0,0 +1,54 @@
+from change_feed import ChangeFeed, format_id
+
+
+def publish(feed, user_key, event_id):
+    feed.publish(user_key, 'event', 'updated', {'id': event_id})
+
+
+def test_changes_are_replayed_after_the_cursor():
+    feed = ChangeFeed()
+    publish(feed, 'user', 'a')
+    cursor = feed.cursor()
+    publish(feed, 'other', 'b')
+    publish(feed, 'user', 'c')
+    assert [change['id'] for _, change in feed.since('user', cursor)] == ['c']
+
+
+def test_cursor_older_than_a_users_history_is_not_served():
+    feed = ChangeFeed(length=2)
+    cursor = feed.cursor()
+    for event_id in 'abc':
+        publish(feed, 'user', event_id)
+    assert feed.since('user', cursor) is None
+    assert feed.since('user', format_id(1)) is not None
+
+
+def test_least_recently_changed_users_are_forgotten():
+    feed = ChangeFeed(max_users=2)
+    cursor = feed.cursor()
+    publish(feed, 'first', 'a')
+    publish(feed, 'second', 'b')
+    publish(feed, 'first', 'c')
+    publish(feed, 'third', 'd')
+    assert list(feed.changes) == ['first', 'third'] and feed.evicted == {}
+    assert feed.since('second', cursor) is None  # Its changes may have been dropped
+    assert feed.since('second', feed.cursor()) == []
+    assert [change['id'] for _, change in feed.since('first', cursor)] == ['a', 'c']
+
+
+def test_forked_worker_does_not_resume_the_parents_ids():
+    import os
+    import change_feed
+    parent_id = ChangeFeed().cursor()
+    read, write = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            os.write(write, (change_feed.GENERATION + (' resumed' if change_feed.parse_id(parent_id) is not None
+                                                       else ' reset')).encode())
+        finally:
+            os._exit(0)
+    os.close(write)
+    generation, outcome = os.read(read, 100).decode().split()
+    os.waitpid(pid, 0)
+    assert generation != change_feed.GENERATION and outcome == 'reset'
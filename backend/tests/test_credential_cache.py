@@ -0,0 +1,53 @@
+import json
+from datetime import datetime, timedelta
+
+from google.oauth2.credentials import Credentials
+
+from credential_cache import CredentialCache
+from services import serialize_credentials
+
+
+def make_session(expires_in):
+    credentials = Credentials(token='old', refresh_token='refresh', client_id='client', client_secret='secret',
+                              token_uri='https://oauth2.googleapis.com/token',
+                              expiry=datetime.utcnow() + expires_in)
+    return {'user_key': 'user', 'credentials': json.dumps(serialize_credentials(credentials))}
+
+
+def fake_refresh(monkeypatch):
+    calls = []
+
+    def refresh(credentials, request):
+        calls.append(credentials)
+        credentials.token = 'new'
+        credentials.expiry = datetime.utcnow() + timedelta(hours=1)
+
+    monkeypatch.setattr(Credentials, 'refresh', refresh)
+    return calls
+
+
+# google-auth reports a token as expired 3m45s before its expiry; such a token must be refreshed inline
+def test_token_inside_refresh_threshold_is_refreshed(monkeypatch):
+    calls = fake_refresh(monkeypatch)
+    session = make_session(timedelta(minutes=2))
+    credentials = CredentialCache().get(session)
+    assert len(calls) == 1
+    assert credentials.valid and credentials.token == 'new'
+    assert json.loads(session['credentials'])['token'] == 'new'
+
+
+def test_valid_token_is_not_refreshed_on_request_path(monkeypatch):
+    calls = fake_refresh(monkeypatch)
+    credentials = CredentialCache().get(make_session(timedelta(minutes=30)))
+    assert calls == []
+    assert credentials.token == 'old'
+
+
+def test_token_missing_is_refreshed(monkeypatch):
+    calls = fake_refresh(monkeypatch)
+    session = make_session(timedelta(minutes=30))
+    blob = json.loads(session['credentials'])
+    blob['token'] = None
+    session['credentials'] = json.dumps(blob)
+    assert CredentialCache().get(session).token == 'new'
+    assert len(calls) == 1
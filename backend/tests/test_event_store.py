@@ -0,0 +1,53 @@
+import event_store
+from event_store import find_event_store, get_event_store
+
+
+def test_least_recently_used_stores_are_evicted(monkeypatch):
+    monkeypatch.setattr(event_store, '_stores', event_store.OrderedDict())
+    monkeypatch.setattr(event_store, 'MAX_EVENT_STORES', 2)
+    first = get_event_store('first')
+    get_event_store('second')
+    assert get_event_store('first') is first  # Now the most recently used
+    get_event_store('third')
+    assert find_event_store('second') is None
+    assert find_event_store('first') is first and find_event_store('third') is not None
+    assert get_event_store('second') is not None and find_event_store('first') is None
+
+
+def test_async_sync_waits_for_a_threaded_sync(credentials_json):
+    import asyncio
+    import json
+    from google_clients import get_calendar_service
+    from services import deserialize_credentials
+    service = get_calendar_service(deserialize_credentials(json.loads(credentials_json)))
+    store = event_store.EventStore()
+    store.sync_lock.acquire()  # As a sync running in a request thread would
+
+    async def run():
+        syncing = asyncio.ensure_future(store.sync_async(service, lambda request: asyncio.to_thread(request.execute)))
+        await asyncio.sleep(0.2)
+        assert not syncing.done() and store.needs_full_sync()
+        store.sync_lock.release()
+        await syncing
+
+    asyncio.run(run())
+    assert not store.needs_full_sync() and store.events
+    assert store.sync_lock.acquire(blocking=False)
+
+
+def test_streaming_a_cold_store_does_not_hold_the_sync_lock_while_consumed(credentials_json):
+    import json
+    import time
+    from google_clients import get_calendar_service
+    from services import deserialize_credentials
+    service = get_calendar_service(deserialize_credentials(json.loads(credentials_json)))
+    store = event_store.EventStore(expand_recurrence=False)
+    events = store.stream(service)
+    first = next(events)  # The client then stalls
+    deadline = time.monotonic() + 10
+    while not store.sync_lock.acquire(blocking=False):
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    store.sync_lock.release()
+    store.sync(service)  # Does not wait for the stalled client
+    assert [first] + list(events) == [event for event in store.events.values() if event.get('status') != 'cancelled']
@@ -0,0 +1,60 @@
+import json
+import time
+
+import pytest
+
+from google_clients import get_tasks_service
+from mirror import ACTIVE_FOR, SearchMirror, fts_query
+from services import deserialize_credentials
+
+
+@pytest.fixture
+def credentials(credentials_json):
+    return deserialize_credentials(json.loads(credentials_json))
+
+
+@pytest.fixture
+def mirror(tmp_path):
+    return SearchMirror(str(tmp_path / 'mirror.db'))
+
+
+def test_fts_query_quotes_words_as_prefixes():
+    assert fts_query('weekly "sync" OR x*') == '"weekly"* "sync"* "OR"* "x"*'
+    with pytest.raises(ValueError):
+        fts_query('  ?! ')
+
+
+def test_search_by_text_and_time(mirror, credentials):
+    mirror.refresh('mirror-user', credentials)
+    events = mirror.search('mirror-user', fts_query('event'), kinds=('events',), limit=500)['events']
+    assert events and all('Event' in event['summary'] for event in events)
+    assert mirror.search('mirror-user', time_min=0, time_max=1, kinds=('events',)) == {'events': []}
+    assert mirror.search('someone-else', fts_query('event')) == {'events': [], 'tasks': []}
+
+
+def test_active_users_are_synced_in_the_background(mirror, credentials):
+    mirror.refresh('mirror-user', credentials)
+    get_tasks_service(credentials).tasks().insert(tasklist='@default', body={'title': 'Zanzibar trip'}).execute()
+    assert mirror.search('mirror-user', fts_query('zanzibar'))['tasks'] == []
+    mirror.checked['mirror-user'] -= 60 * 60  # As if the last sync was long ago
+    mirror.sync_active()
+    assert [task['title'] for task in mirror.search('mirror-user', fts_query('zanzibar'))['tasks']] == ['Zanzibar trip']
+
+
+def test_idle_users_are_forgotten(mirror, credentials):
+    mirror.refresh('mirror-user', credentials)
+    mirror.sync_active(now=time.monotonic() + ACTIVE_FOR + 1)
+    assert mirror.active == {} and mirror.checked == {} and mirror.mirrored == {}
+
+
+def test_store_recreated_after_eviction_does_not_empty_the_mirror(mirror, credentials):
+    import event_store
+    mirror.refresh('evicted-user', credentials)
+    count = len(mirror.search('evicted-user', kinds=('events',), limit=500)['events'])
+    assert count
+    with event_store._stores_lock:
+        del event_store._stores['evicted-user']
+    mirror.refresh('evicted-user', credentials)  # Within SYNC_INTERVAL of the last sync
+    assert len(mirror.search('evicted-user', kinds=('events',), limit=500)['events']) == count
+    mirror.mirror_events('evicted-user', event_store.EventStore())
+    assert len(mirror.search('evicted-user', kinds=('events',), limit=500)['events']) == count
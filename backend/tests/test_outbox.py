@@ -0,0 +1,91 @@
+import sqlite3
+import time
+
+import pytest
+
+from outbox import Outbox, TokenBucket, backoff, overlay_pending
+
+EVENT = {'summary': 'Queued', 'start': {'dateTime': '2026-10-20T10:00:00Z'},
+         'end': {'dateTime': '2026-10-20T11:00:00Z'}}
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / 'outbox.db')
+
+
+def test_updates_coalesce_into_queued_create(path, credentials_json):
+    outbox = Outbox(path, workers=0)
+    operation_id, provisional = outbox.enqueue('user', credentials_json, 'event', 'create', 'primary', body=EVENT)
+    updated = dict(EVENT, summary='Renamed')
+    assert outbox.enqueue('user', credentials_json, 'event', 'update', 'primary', provisional, updated)[0] \
+        == operation_id
+    pending = outbox.pending_events('user')
+    assert len(pending) == 1 and pending[0]['body']['summary'] == 'Renamed'
+
+
+def test_delete_cancels_queued_create(path, credentials_json):
+    outbox = Outbox(path, workers=0)
+    operation_id, provisional = outbox.enqueue('user', credentials_json, 'event', 'create', 'primary', body=EVENT)
+    outbox.enqueue('user', credentials_json, 'event', 'delete', 'primary', provisional)
+    assert outbox.status('user', operation_id)['status'] == 'cancelled'
+    assert not outbox.has_pending('user', 'event', provisional)
+
+
+def test_status_is_private_to_the_user(path, credentials_json):
+    outbox = Outbox(path, workers=0)
+    operation_id, _ = outbox.enqueue('user', credentials_json, 'event', 'create', 'primary', body=EVENT)
+    assert outbox.status('someone-else', operation_id) is None
+
+
+# Operations stored by a process that stopped before sending them are sent once the outbox is reopened
+def test_reopened_outbox_drains_operations_left_by_earlier_run(path, credentials_json, google):
+    earlier = Outbox(path, workers=0)
+    created, _ = earlier.enqueue('user', credentials_json, 'event', 'create', 'primary', body=EVENT)
+    task, _ = earlier.enqueue('user', credentials_json, 'task', 'create', '@default', body={'title': 'Queued task'})
+    # An operation whose sender died mid-request: claimed, with its lease run out
+    abandoned, _ = earlier.enqueue('user', credentials_json, 'task', 'create', '@default', body={'title': 'Abandoned'})
+    with sqlite3.connect(path) as conn:
+        conn.execute("UPDATE operations SET status = 'sending', lease_until = ? WHERE id = ?",
+                     (time.time() - 1, abandoned))
+
+    restarted = Outbox(path, workers=2)
+    restarted.resume()
+    assert wait_for(lambda: all(restarted.status('user', operation)['status'] == 'done'
+                                for operation in (created, task, abandoned)))
+    event_id = restarted.status('user', created)['id']
+    assert google.calendars['primary'][event_id]['summary'] == 'Queued'
+
+
+def test_resume_without_unfinished_operations_starts_nothing(path):
+    outbox = Outbox(path, workers=2)
+    outbox.resume()
+    assert outbox._started_pid is None
+
+
+def test_token_bucket_allows_burst_then_rate():
+    bucket = TokenBucket(rate=10, burst=2)
+    assert bucket.take() == 0 and bucket.take() == 0
+    assert 0 < bucket.take() <= 0.1
+
+
+def test_backoff_is_capped():
+    assert all(0 <= backoff(attempt) <= 300 for attempt in range(1, 20))
+
+
+def test_overlay_pending_shows_queued_writes():
+    events = [{'id': 'a', 'summary': 'A', 'start': {'dateTime': '2026-10-20T09:00:00Z'}}]
+    pending = [{'id': 1, 'op': 'update', 'target': 'a', 'body': {'summary': 'A2'}, 'updated': 0},
+               {'id': 2, 'op': 'create', 'target': 'pending-x', 'body': EVENT, 'updated': 0}]
+    overlaid = overlay_pending(events, pending)
+    assert {event['id']: event['summary'] for event in overlaid} == {'a': 'A2', 'pending-x': 'Queued'}
+    assert overlay_pending(events, [{'id': 3, 'op': 'delete', 'target': 'a', 'body': None, 'updated': 0}]) == []
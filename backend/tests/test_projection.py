@@ -0,0 +1,86 @@
+import pytest
+
+from freebusy import to_epoch
+from projection import ListView, compact, format_fields, parse_fields, project
+
+EVENT = {'id': 'e1', 'etag': '"1"', 'summary': 'Review', 'location': 'Room 1',
+         'start': {'dateTime': '2026-10-20T10:00:00Z', 'timeZone': 'UTC'}, 'end': {'dateTime': '2026-10-20T11:00:00Z'},
+         'attendees': [{'email': 'a@example.com', 'responseStatus': 'accepted', 'self': True},
+                       {'email': 'b@example.com', 'responseStatus': 'declined'}]}
+ALL_DAY = {'id': 'e2', 'summary': 'Holiday', 'start': {'date': '2026-10-21'}, 'end': {'date': '2026-10-22'}}
+
+
+def test_nested_selectors_and_paths():
+    spec = parse_fields('id, summary,start/dateTime,attendees(email,responseStatus)')
+    assert spec == {'id': None, 'summary': None, 'start': {'dateTime': None},
+                    'attendees': {'email': None, 'responseStatus': None}}
+    assert project(EVENT, spec) == {
+        'id': 'e1', 'summary': 'Review', 'start': {'dateTime': '2026-10-20T10:00:00Z'},
+        'attendees': [{'email': 'a@example.com', 'responseStatus': 'accepted'},
+                      {'email': 'b@example.com', 'responseStatus': 'declined'}]}
+    assert format_fields(spec) == 'id,summary,start(dateTime),attendees(email,responseStatus)'
+
+
+@pytest.mark.parametrize('selector, spec', [
+    ('start/dateTime,start/timeZone', {'start': {'dateTime': None, 'timeZone': None}}),
+    ('start/dateTime,start', {'start': None}),
+    ('start,start/dateTime', {'start': None}),
+    ('attendees(email),attendees(self)', {'attendees': {'email': None, 'self': None}}),
+    ('id,id', {'id': None}),
+])
+def test_duplicates_are_merged(selector, spec):
+    assert parse_fields(selector) == spec
+
+
+def test_wildcard_keeps_everything_at_its_level():
+    assert project(EVENT, parse_fields('*')) == EVENT
+    assert project(EVENT, parse_fields('attendees(*)'))['attendees'] == EVENT['attendees']
+
+
+@pytest.mark.parametrize('selector', ['', 'id,', ',id', 'attendees(email', 'id)', 'attendees()', 'a((b))',
+                                      'start//dateTime', 'id;summary', 'x' * 1001])
+def test_malformed_selectors_are_rejected(selector):
+    with pytest.raises(ValueError):
+        parse_fields(selector)
+
+
+def test_compact_columns_flag_all_day_events():
+    columns = compact([EVENT, ALL_DAY], parse_fields('id,summary,start,end'))
+    assert columns == {'id': ['e1', 'e2'], 'summary': ['Review', 'Holiday'],
+                       'start': [to_epoch('2026-10-20T10:00:00Z'), to_epoch('2026-10-21')],
+                       'end': [to_epoch('2026-10-20T11:00:00Z'), to_epoch('2026-10-22')],
+                       'allDay': [False, True]}
+
+
+def test_compact_view_needs_explicit_fields():
+    assert ListView(compact=True, compact_fields='id,summary').render([EVENT]) == {'id': ['e1'],
+                                                                                 'summary': ['Review']}
+    with pytest.raises(ValueError):
+        ListView('*', compact=True)
+
+
+def test_upstream_fields_always_keep_id_and_etag():
+    assert ListView('title').upstream_fields() == 'items(title,id,etag),nextPageToken'
+    assert ListView('etag(x),id').upstream_fields() == 'items(etag,id),nextPageToken'
+    assert ListView().upstream_fields() is None
+
+
+def test_tasks_route_projects_and_asks_google_for_id_and_etag(client, google):
+    response = client.get('/tasks?fields=title')
+    assert response.status_code == 200
+    assert response.json and all(list(task) == ['title'] for task in response.json)
+    fields = google.last_args[('GET', '/tasks/v1/lists/@default/tasks')]['fields']
+    assert fields == 'items(title,id,etag),nextPageToken'
+    compact_columns = client.get('/tasks?format=compact').json
+    assert set(compact_columns) == {'id', 'title', 'status', 'due'}
+
+
+def test_tasks_route_rejects_a_malformed_selector(client):
+    response = client.get('/tasks?fields=title(')
+    assert response.status_code == 400 and response.json['error'] == 'Invalid fields parameter'
+
+
+def test_events_route_compact_format(client):
+    columns = client.get('/events?format=compact').json
+    assert set(columns) == {'id', 'summary', 'start', 'end', 'allDay'}
+    assert len(columns['id']) == len(columns['allDay']) > 0
@@ -0,0 +1,62 @@
+from datetime import datetime, timezone
+
+from recurrence import SeriesExpansions, expand_series, instance_key
+
+WINDOW = (datetime(2026, 10, 1, tzinfo=timezone.utc), datetime(2026, 11, 1, tzinfo=timezone.utc))
+
+
+def series(recurrence, start='2026-10-20T10:00:00Z', end='2026-10-20T11:00:00Z', **fields):
+    return dict({'id': 'series', 'etag': '"1"', 'summary': 'Standup', 'recurrence': recurrence,
+                 'start': {'dateTime': start}, 'end': {'dateTime': end}}, **fields)
+
+
+def starts(instances):
+    return [instance['start'].get('dateTime') or instance['start']['date'] for instance in instances]
+
+
+def test_daily_series_with_exdate():
+    master = series(['RRULE:FREQ=DAILY;COUNT=4', 'EXDATE:20261021T100000Z'])
+    instances = expand_series(master, *WINDOW)
+    assert starts(instances) == ['2026-10-20T10:00:00+00:00', '2026-10-22T10:00:00+00:00',
+                                 '2026-10-23T10:00:00+00:00']
+    assert instances[0]['id'] == 'series_20261020T100000Z' and instances[0]['recurringEventId'] == 'series'
+    assert 'recurrence' not in instances[0]
+    assert instance_key(instances[0]['originalStartTime']) == instance_key(master['start'])
+
+
+def test_series_keeps_wall_clock_time_across_dst():
+    master = series(['RRULE:FREQ=WEEKLY;COUNT=2'], start='2026-10-20T09:00:00-04:00', end='2026-10-20T10:00:00-04:00')
+    master['start']['timeZone'] = master['end']['timeZone'] = 'America/New_York'
+    assert starts(expand_series(master, *WINDOW)) == ['2026-10-20T09:00:00-04:00', '2026-10-27T09:00:00-04:00']
+    later = (datetime(2026, 11, 1, tzinfo=timezone.utc), datetime(2026, 12, 1, tzinfo=timezone.utc))
+    master['recurrence'] = ['RRULE:FREQ=WEEKLY;COUNT=3']
+    assert starts(expand_series(master, *later)) == ['2026-11-03T09:00:00-05:00']
+
+
+def test_all_day_series_with_date_until():
+    master = {'id': 'day', 'recurrence': ['RRULE:FREQ=DAILY;UNTIL=20261022'],
+              'start': {'date': '2026-10-20'}, 'end': {'date': '2026-10-21'}}
+    assert starts(expand_series(master, *WINDOW)) == ['2026-10-20', '2026-10-21', '2026-10-22']
+
+
+def test_naive_exdate_in_aware_series_falls_back_to_the_first_occurrence():
+    master = series(['RRULE:FREQ=DAILY;COUNT=4', 'EXDATE:20261021T100000'])
+    assert starts(expand_series(master, *WINDOW)) == ['2026-10-20T10:00:00+00:00']
+
+
+def test_invalid_rule_falls_back_to_the_first_occurrence():
+    assert len(expand_series(series(['RRULE:FREQ=SOMETIMES']), *WINDOW)) == 1
+
+
+def test_expansion_limit():
+    assert len(expand_series(series(['RRULE:FREQ=DAILY']), *WINDOW, limit=5)) == 5
+
+
+def test_expansions_are_regenerated_when_the_master_changes():
+    expansions = SeriesExpansions()
+    master = series(['RRULE:FREQ=DAILY;COUNT=2'])
+    first = expansions.instances(master, *WINDOW)
+    assert expansions.instances(master, *WINDOW) is first
+    assert expansions.find('series_20261021T100000Z')['start']['dateTime'] == '2026-10-21T10:00:00+00:00'
+    changed = dict(master, etag='"2"', recurrence=['RRULE:FREQ=DAILY;COUNT=3'])
+    assert len(expansions.instances(changed, *WINDOW)) == 3
@@ -0,0 +1,25 @@
+import pytest
+
+TASKS = [{'id': 'a', 'durationMinutes': 30}]
+
+
+@pytest.mark.parametrize('payload, detail', [
+    ({'tasks': TASKS, 'workingHours': [1]}, 'workingHours must be an object'),
+    ({'tasks': TASKS, 'bufferMinutes': -5}, 'bufferMinutes must not be negative'),
+    ({'tasks': [{'durationMinutes': 90, 'minChunkMinutes': -30}]}, 'minChunkMinutes must be positive'),
+])
+def test_invalid_options_are_rejected(client, payload, detail):
+    response = client.post('/schedule_tasks', json=payload)
+    assert response.status_code == 400
+    assert detail in response.json['details']
+
+
+def test_tasks_are_scheduled_within_working_hours(client):
+    response = client.post('/schedule_tasks', json={
+        'tasks': TASKS, 'timeMin': '2030-01-07T00:00:00Z', 'timeMax': '2030-01-08T00:00:00Z',
+        'workingHours': {'start': 9, 'end': 17, 'timeZone': 'UTC'}})
+    assert response.status_code == 200
+    result, = response.json['results']
+    slot, = result['slots']
+    assert result['scheduled']
+    assert '2030-01-07T09:00' <= slot['start'][:16] and slot['end'][:16] <= '2030-01-07T17:00'
@@ -0,0 +1,59 @@
+from scheduler import PRIORITY_LEVELS, FreeSlots, ScheduledTask, schedule
+
+HOUR = 3600
+MINUTE = 60
+
+
+def test_free_slots_find_earliest_gap_long_enough():
+    slots = FreeSlots([(0, 30 * MINUTE), (HOUR, 3 * HOUR), (4 * HOUR, 5 * HOUR)])
+    assert slots.find(HOUR) == 1
+    assert slots.find(HOUR, first=2) == 2
+    assert slots.find(3 * HOUR) is None
+    slots.take(1, 90 * MINUTE)
+    assert slots.starts[1] == HOUR + 90 * MINUTE
+    assert slots.find(HOUR) == 2
+
+
+def test_higher_priority_is_placed_first():
+    tasks = [ScheduledTask('low', HOUR, PRIORITY_LEVELS['low']), ScheduledTask('high', HOUR, PRIORITY_LEVELS['high'])]
+    low, high = schedule(tasks, [(0, HOUR), (2 * HOUR, 3 * HOUR)])
+    assert high == [(0, HOUR)]
+    assert low == [(2 * HOUR, 3 * HOUR)]
+
+
+def test_task_that_cannot_meet_its_deadline_is_not_placed():
+    tasks = [ScheduledTask('late', HOUR, deadline=2 * HOUR)]
+    assert schedule(tasks, [(90 * MINUTE, 5 * HOUR)]) == [None]
+
+
+def test_clearance_is_left_after_each_placement():
+    tasks = [ScheduledTask('a', HOUR, PRIORITY_LEVELS['high']), ScheduledTask('b', HOUR)]
+    a, b = schedule(tasks, [(0, 4 * HOUR)], clearance=15 * MINUTE)
+    assert a == [(0, HOUR)]
+    assert b == [(HOUR + 15 * MINUTE, 2 * HOUR + 15 * MINUTE)]
+
+
+def test_chunks_fill_gaps_too_short_for_the_whole_task():
+    pieces, = schedule([ScheduledTask('split', 2 * HOUR, min_chunk=HOUR)], [(0, HOUR), (2 * HOUR, 3 * HOUR)])
+    assert pieces == [(0, HOUR), (2 * HOUR, 3 * HOUR)]
+
+
+# A 90 minute task in 60 minute chunks must not become 70 + 20 minutes
+def test_every_chunk_is_at_least_min_chunk():
+    gaps = [(0, 70 * MINUTE), (2 * HOUR, 5 * HOUR)]
+    pieces, = schedule([ScheduledTask('split', 90 * MINUTE, min_chunk=HOUR)], gaps)
+    assert pieces == [(2 * HOUR, 2 * HOUR + 90 * MINUTE)]
+
+
+def test_last_chunk_leaves_room_for_a_whole_chunk():
+    gaps = [(0, 100 * MINUTE), (2 * HOUR, 5 * HOUR)]
+    pieces, = schedule([ScheduledTask('split', 150 * MINUTE, min_chunk=HOUR)], gaps)
+    assert pieces == [(0, 90 * MINUTE), (2 * HOUR, 3 * HOUR)]
+    assert all(end - start >= HOUR for start, end in pieces)
+
+
+def test_chunked_task_that_cannot_finish_consumes_no_time():
+    tasks = [ScheduledTask('split', 3 * HOUR, PRIORITY_LEVELS['high'], min_chunk=HOUR), ScheduledTask('whole', HOUR)]
+    split, whole = schedule(tasks, [(0, HOUR), (2 * HOUR, 3 * HOUR)])
+    assert split is None
+    assert whole == [(0, HOUR)]
@@ -0,0 +1,49 @@
+import sqlite3
+
+import pytest
+
+from session_store import SQLiteSessionStore, TieredSessionCache
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / 'sessions.db')
+
+
+# Two caches over one database stand in for two worker processes
+def test_write_elsewhere_reloads_only_that_session(path):
+    here, elsewhere = TieredSessionCache(SQLiteSessionStore(path)), TieredSessionCache(SQLiteSessionStore(path))
+    here.set('a', {'n': 1})
+    here.set('b', {'n': 1})
+    kept = here.get('b')
+    elsewhere.set('a', {'n': 2})
+    assert here.get('a') == {'n': 2}
+    assert here.get('b') is kept
+
+
+def test_delete_elsewhere_is_seen(path):
+    here, elsewhere = TieredSessionCache(SQLiteSessionStore(path)), TieredSessionCache(SQLiteSessionStore(path))
+    here.set('a', {'n': 1})
+    elsewhere.delete('a')
+    assert here.get('a') is None and 'a' not in here._memory
+    # A session recreated after a delete gets a new version rather than restarting a counter
+    elsewhere.set('a', {'n': 1})
+    here.set('a', {'n': 3})
+    assert elsewhere.get('a') == {'n': 3}
+
+
+def test_unchanged_session_is_not_rewritten(path):
+    cache = TieredSessionCache(SQLiteSessionStore(path))
+    cache.set('a', {'n': 1}, timeout=3600)
+    cache.set('a', {'n': 1}, timeout=3600)
+    assert cache.persistent.writes == 1
+
+
+def test_database_without_version_column_is_upgraded(path):
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE sessions (id TEXT PRIMARY KEY, data BLOB NOT NULL, expires REAL NOT NULL)')
+    conn.commit()
+    conn.close()
+    cache = TieredSessionCache(SQLiteSessionStore(path))
+    cache.set('a', {'n': 1})
+    assert cache.get('a') == {'n': 1}
@@ -0,0 +1,36 @@
+import os
+
+import sqlite_store
+from sqlite_store import SQLiteStore, database_path
+
+
+class Counter(SQLiteStore):
+    schema = 'CREATE TABLE IF NOT EXISTS counts (n INTEGER);'
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.starts = 0
+
+    def start_threads(self):
+        self.starts += 1
+
+
+def test_each_process_opens_its_own_connection_and_threads(tmp_path, monkeypatch):
+    store = Counter(str(tmp_path / 'counter.db'))
+    conn = store.conn
+    store.ensure_started()
+    store.ensure_started()
+    assert store.conn is conn and store.starts == 1
+    assert conn.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+    child = os.getpid() + 1
+    monkeypatch.setattr(sqlite_store.os, 'getpid', lambda: child)  # As in a forked worker
+    store.ensure_started()
+    assert store.conn is not conn and store.starts == 2
+
+
+def test_database_path(monkeypatch):
+    monkeypatch.delenv('EXAMPLE_DB_PATH', raising=False)
+    assert database_path('EXAMPLE_DB_PATH', 'example.db') == os.path.join(os.path.dirname(sqlite_store.__file__),
+                                                                          'example.db')
+    monkeypatch.setenv('EXAMPLE_DB_PATH', '/tmp/elsewhere.db')
+    assert database_path('EXAMPLE_DB_PATH', 'example.db') == '/tmp/elsewhere.db'
@@ -0,0 +1,94 @@
+import json
+import time
+
+import pytest
+
+from services import deserialize_credentials
+from watch_channels import IDLE_AFTER, RENEW_BEFORE, WATCH_RETRY_AFTER, WatchRegistry
+
+ADDRESS = 'http://127.0.0.1:9/notifications'  # Nothing listens; the fake's deliveries are dropped
+
+
+@pytest.fixture
+def credentials(credentials_json):
+    return deserialize_credentials(json.loads(credentials_json))
+
+
+@pytest.fixture
+def registry(tmp_path):
+    return WatchRegistry(str(tmp_path / 'watch.db'), address=ADDRESS)
+
+
+def channels(registry):
+    return [dict(row) for row in registry.conn.execute('SELECT * FROM channels ORDER BY expiration')]
+
+
+def test_push_is_off_without_an_address(tmp_path, credentials):
+    assert WatchRegistry(str(tmp_path / 'watch.db'), address=None).sequence('user', credentials) is None
+
+
+def test_first_request_opens_one_channel(registry, credentials, google):
+    sequence = registry.sequence('user', credentials)
+    assert registry.sequence('user', credentials) == sequence
+    channel, = channels(registry)
+    assert google.watches[channel['id']]['token'] == channel['token']
+
+
+def test_genuine_notifications_bump_the_sequence(registry, credentials):
+    sequence = registry.sequence('user', credentials)
+    channel, = channels(registry)
+
+    def notify(token, state):
+        return registry.notify(channel['id'], token, channel['resource_id'], state)
+
+    assert notify('forged', 'exists') is None
+    assert registry.notify('unknown', channel['token'], channel['resource_id'], 'exists') is None
+    assert notify(channel['token'], 'sync') == 'user'
+    assert registry.sequence('user', credentials) == sequence
+    assert notify(channel['token'], 'exists') == 'user'
+    assert registry.sequence('user', credentials) == sequence + 1
+
+
+def test_channels_close_to_expiry_are_replaced(registry, credentials, google):
+    registry.sequence('user', credentials)
+    old, = channels(registry)
+    registry.renew_due(now=old['expiration'] - RENEW_BEFORE + 1)
+    new, = channels(registry)
+    assert new['id'] != old['id'] and old['id'] not in google.watches and new['id'] in google.watches
+
+
+def test_idle_users_are_no_longer_watched(registry, credentials, google):
+    registry.sequence('user', credentials)
+    old, = channels(registry)
+    registry.conn.execute('UPDATE watched_users SET last_seen = last_seen - ?', (IDLE_AFTER + 1,))
+    registry.renew_due(now=old['expiration'] - RENEW_BEFORE + 1)
+    assert channels(registry) == [] and old['id'] not in google.watches
+
+
+def test_forged_non_ascii_token_is_rejected(credentials, client, monkeypatch):
+    from app import watches
+    monkeypatch.setattr(watches, 'address', ADDRESS)
+    watches.watch('forged-user', credentials)
+    row = watches.conn.execute("SELECT id, resource_id FROM channels WHERE user_key = 'forged-user'").fetchone()
+    assert watches.notify(row['id'], 'jeton-é', row['resource_id'], 'exists') is None
+    response = client.post('/notifications', headers={
+        'X-Goog-Channel-ID': row['id'], 'X-Goog-Channel-Token': 'jeton-é'.encode().decode('latin-1'),
+        'X-Goog-Resource-ID': row['resource_id'], 'X-Goog-Resource-State': 'exists'})
+    assert response.status_code == 404
+
+
+def test_failed_watch_is_not_retried_on_every_request(registry, credentials, google, monkeypatch):
+    from googleapiclient.errors import HttpError
+    attempts = []
+
+    def refuse(credentials):
+        attempts.append(credentials)
+        raise HttpError(type('Response', (), {'status': 400, 'reason': 'Bad Request'})(), b'{}')
+
+    monkeypatch.setattr(registry, '_open_channel', refuse)
+    assert registry.sequence('user', credentials) is None
+    assert registry.sequence('user', credentials) is None
+    assert len(attempts) == 1
+    registry.renew_due(now=time.time() + WATCH_RETRY_AFTER)  # Forgets failures older than the backoff
+    monkeypatch.undo()
+    assert registry.sequence('user', credentials) is not None and registry.failed == {}
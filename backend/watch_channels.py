@@ -0,0 +1,210 @@
+# Calendar push notifications: per-user events().watch channels, their renewal, and the
+# notification sequence that tells event stores whether a delta sync is needed
+import hmac
+import json
+import logging
+import os
+import secrets
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from googleapiclient.errors import HttpError
+from event_store import find_event_store
+from google_clients import get_calendar_service
+from metrics import push_notifications
+from services import deserialize_credentials, serialize_credentials
+from sqlite_store import SQLiteStore, database_path
+
+NOTIFICATION_URL = os.getenv('NOTIFICATION_URL')  # Public HTTPS address of /notifications; push is off without it
+CHANNEL_TTL = 7 * 24 * 60 * 60  # Lifetime requested for a channel; Google may grant less
+RENEW_BEFORE = 60 * 60  # Channels are replaced this long before they expire
+RENEW_INTERVAL = 60  # Seconds between renewal scans
+IDLE_AFTER = 7 * 24 * 60 * 60  # Users not seen for this long are no longer watched
+SEEN_RESOLUTION = 60 * 60  # A user's last_seen (and stored credentials) are rewritten at most this often
+RESYNC_WORKERS = 2  # Threads running the delta syncs triggered by notifications
+WATCH_RETRY_AFTER = 15 * 60  # Seconds before watching a user's calendar is tried again after a failure
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS channels (
+    id TEXT PRIMARY KEY,
+    user_key TEXT NOT NULL,
+    token TEXT NOT NULL,
+    resource_id TEXT NOT NULL,
+    expiration REAL NOT NULL,
+    renewing_until REAL
+);
+CREATE INDEX IF NOT EXISTS channels_user ON channels (user_key, expiration);
+CREATE INDEX IF NOT EXISTS channels_expiration ON channels (expiration);
+CREATE TABLE IF NOT EXISTS watched_users (
+    user_key TEXT PRIMARY KEY,
+    sequence INTEGER NOT NULL DEFAULT 0,
+    last_seen REAL NOT NULL,
+    credentials TEXT NOT NULL
+);
+'''
+
+
+class WatchRegistry(SQLiteStore):
+    """Watch channels and notification sequences, shared by all processes through SQLite.
+
+    Every notification for a user bumps their sequence. An event store that
+    has synced at the current sequence is known to be up to date, so the
+    per-request delta sync to Google is skipped until the next notification.
+    """
+
+    schema = SCHEMA
+    row_factory = sqlite3.Row
+
+    def __init__(self, path, address=NOTIFICATION_URL):
+        super().__init__(path)
+        self.address = address
+        self.resyncs = ThreadPoolExecutor(max_workers=RESYNC_WORKERS, thread_name_prefix='resync')
+        self.failed = {}  # user key -> time watching their calendar last failed in this process
+
+    def sequence(self, user_key, credentials):
+        """The user's notification sequence, watching their calendar first if needed.
+
+        Returns None when push is not configured or the watch cannot be set up,
+        in which case callers sync on every request as before.
+        """
+        if not self.address:
+            return None
+        self.ensure_started()
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT sequence, last_seen, (SELECT MAX(expiration) FROM channels WHERE user_key = :user) AS expiration '
+                'FROM watched_users WHERE user_key = :user', {'user': user_key}).fetchone()
+        if row is None or row['expiration'] is None or row['expiration'] <= now:
+            if now - self.failed.get(user_key, float('-inf')) < WATCH_RETRY_AFTER:
+                return None  # Not retried on every request, which would double the upstream calls
+            try:
+                sequence = self.watch(user_key, credentials)
+            except HttpError as error:
+                logging.error(f"Cannot watch calendar for push notifications: {error}")
+                self.failed[user_key] = now
+                return None
+            self.failed.pop(user_key, None)
+            return sequence
+        if now - row['last_seen'] > SEEN_RESOLUTION:
+            with self.lock:
+                self.conn.execute('UPDATE watched_users SET last_seen = ?, credentials = ? WHERE user_key = ?',
+                                  (now, json.dumps(serialize_credentials(credentials)), user_key))
+        return row['sequence']
+
+    def watch(self, user_key, credentials):
+        """Open a channel on the user's primary calendar and return their new sequence."""
+        channel = self._open_channel(credentials)
+        with self.lock:
+            conn = self.conn
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute('INSERT INTO channels (id, user_key, token, resource_id, expiration) VALUES (?, ?, ?, ?, ?)',
+                         (channel['id'], user_key, channel['token'], channel['resource_id'], channel['expiration']))
+            # Changes made before the channel existed were never notified, so stores must sync once more
+            sequence = conn.execute(
+                'INSERT INTO watched_users (user_key, last_seen, credentials) VALUES (?, ?, ?) '
+                'ON CONFLICT(user_key) DO UPDATE SET sequence = sequence + 1, last_seen = excluded.last_seen, '
+                'credentials = excluded.credentials RETURNING sequence',
+                (user_key, time.time(), json.dumps(serialize_credentials(credentials)))).fetchone()[0]
+            conn.execute('COMMIT')
+        return sequence
+
+    def _open_channel(self, credentials):
+        channel_id = uuid.uuid4().hex
+        token = secrets.token_urlsafe(32)
+        body = {'id': channel_id, 'type': 'web_hook', 'address': self.address, 'token': token,
+                'params': {'ttl': str(CHANNEL_TTL)}}
+        result = get_calendar_service(credentials).events().watch(calendarId='primary', body=body).execute()
+        expiration = int(result['expiration']) / 1000 if result.get('expiration') else time.time() + CHANNEL_TTL
+        return {'id': channel_id, 'token': token, 'resource_id': result['resourceId'], 'expiration': expiration}
+
+    def notify(self, channel_id, token, resource_id, state):
+        """Record a notification, returning the user it belongs to, or None if it is not genuine."""
+        with self.lock:
+            row = self.conn.execute('SELECT user_key, token, resource_id FROM channels WHERE id = ?',
+                                    (channel_id,)).fetchone()
+        # Compared as bytes: compare_digest refuses str with non-ASCII characters, which a forged header may carry
+        if (row is None or not hmac.compare_digest(row['token'].encode(), (token or '').encode())
+                or row['resource_id'] != resource_id):
+            push_notifications.inc('rejected')
+            return None
+        push_notifications.inc(state or 'unknown')
+        if state == 'sync':
+            return row['user_key']  # Sent once when a channel opens; nothing has changed
+        with self.lock:
+            sequence = self.conn.execute(
+                'UPDATE watched_users SET sequence = sequence + 1 WHERE user_key = ? RETURNING sequence, credentials',
+                (row['user_key'],)).fetchone()
+        store = find_event_store(row['user_key'])
+        if sequence is not None and store is not None:
+            # Bring this process's copy up to date now; other processes sync on their next request
+            credentials = deserialize_credentials(json.loads(sequence['credentials']))
+            self.resyncs.submit(self._resync, store, credentials, sequence['sequence'])
+        return row['user_key']
+
+    def _resync(self, store, credentials, sequence):
+        try:
+            store.sync(get_calendar_service(credentials), sequence)
+        except Exception as e:
+            logging.error(f"Sync after push notification failed: {e}")
+
+    def start_threads(self):
+        threading.Thread(target=self._run, name='watch-renewal', daemon=True).start()
+
+    def _run(self):
+        while True:
+            time.sleep(RENEW_INTERVAL)
+            try:
+                self.renew_due()
+            except Exception as e:
+                logging.error(f"Watch channel renewal failed: {e}")
+
+    def renew_due(self, now=None):
+        """Replace channels close to expiry, close those of users who have gone idle and forget old failures."""
+        now = time.time() if now is None else now
+        for user_key, failed in list(self.failed.items()):
+            if now - failed >= WATCH_RETRY_AFTER:
+                self.failed.pop(user_key, None)
+        with self.lock:
+            conn = self.conn
+            conn.execute('DELETE FROM channels WHERE expiration <= ?', (now,))
+            # Claiming with a lease keeps two processes from renewing the same channel
+            due = conn.execute(
+                'UPDATE channels SET renewing_until = :lease WHERE expiration <= :due '
+                'AND (renewing_until IS NULL OR renewing_until <= :now) '
+                'RETURNING id, user_key, resource_id',
+                {'now': now, 'due': now + RENEW_BEFORE, 'lease': now + 5 * RENEW_INTERVAL}).fetchall()
+        for channel in due:
+            with self.lock:
+                user = self.conn.execute('SELECT last_seen, credentials FROM watched_users WHERE user_key = ?',
+                                         (channel['user_key'],)).fetchone()
+            credentials = deserialize_credentials(json.loads(user['credentials']))
+            try:
+                if now - user['last_seen'] <= IDLE_AFTER:
+                    # The new channel is open before the old one closes, so no change goes unnotified
+                    replacement = self._open_channel(credentials)
+                    with self.lock:
+                        self.conn.execute(
+                            'INSERT INTO channels (id, user_key, token, resource_id, expiration) VALUES (?, ?, ?, ?, ?)',
+                            (replacement['id'], channel['user_key'], replacement['token'],
+                             replacement['resource_id'], replacement['expiration']))
+                self._close_channel(credentials, channel)
+            except HttpError as error:
+                logging.error(f"Cannot renew watch channel {channel['id']}: {error}")
+
+    def _close_channel(self, credentials, channel):
+        try:
+            get_calendar_service(credentials).channels().stop(
+                body={'id': channel['id'], 'resourceId': channel['resource_id']}).execute()
+        except HttpError as error:
+            if error.resp.status != 404:
+                raise
+        with self.lock:
+            self.conn.execute('DELETE FROM channels WHERE id = ?', (channel['id'],))
+
+
+# Create the registry configured by WATCH_DB_PATH (default: watch.db beside the app)
+def create_watch_registry():
+    return WatchRegistry(database_path('WATCH_DB_PATH', 'watch.db'))
@@ -10,6 +10,7 @@ import 'react-datepicker/dist/react-datepicker.css';
 
 // Sets up moment.js for date handling within the calendar
 const localizer = momentLocalizer(moment);
+const REFRESH_DELAY_MS = 300; // Wait after a reported change, so a burst of changes is fetched once
 
 function Calendar() {
     // State variables to store calendar data, form inputs, and UI state
@@ -37,6 +38,45 @@ function Calendar() {
         fetchData();
     }, []);
 
+    // Refetch when the backend reports a change, instead of polling for one
+    useEffect(() => {
+        const source = new EventSource('https://127.0.0.1:5000/stream', { withCredentials: true });
+        let timer = null;
+        let fetching = false;
+        let changedWhileFetching = false;
+        const refresh = async () => {
+            timer = null;
+            if (fetching) {
+                changedWhileFetching = true;
+                return;
+            }
+            fetching = true;
+            try {
+                const fetchedEvents = await fetchEvents();
+                const fetchedTasks = await fetchTasks();
+                setEvents([...fetchedEvents, ...fetchedTasks]);
+            } finally {
+                fetching = false;
+                if (changedWhileFetching) {
+                    changedWhileFetching = false;
+                    scheduleRefresh();
+                }
+            }
+        };
+        // A batch or an import reports one change per item, so changes arriving close together share one refetch
+        const scheduleRefresh = () => {
+            if (timer === null) {
+                timer = setTimeout(refresh, REFRESH_DELAY_MS);
+            }
+        };
+        source.addEventListener('change', scheduleRefresh);
+        source.addEventListener('reset', scheduleRefresh);
+        return () => {
+            source.close();
+            clearTimeout(timer);
+        };
+    }, []);
+
     // Fetches events from the backend
     const fetchEvents = async () => {
         try {
@@ -88,7 +128,7 @@ function Calendar() {
             };
 
             const response = await axios.post('https://127.0.0.1:5000/create_event', eventToCreate, { withCredentials: true });
-            if (response.status === 201) {
+            if (response.status === 201 || response.status === 202) {
                 const newEvents = await fetchEvents();
                 setEvents(newEvents);
                 setShowEventModal(false);
@@ -139,7 +179,7 @@ function Calendar() {
             };
 
             const response = await axios.put(`https://127.0.0.1:5000/update_event/${selectedEvent.id}?updateOption=${updateOption}`, eventToUpdate, { withCredentials: true });
-            if (response.status === 200) {
+            if (response.status === 200 || response.status === 202) {
                 setMessage('Event updated successfully!');
                 const updatedEvents = await fetchEvents();
                 const updatedTasks = await fetchTasks();
@@ -178,7 +218,7 @@ function Calendar() {
         setLoading(true);
         try {
             const response = await axios.delete(`https://127.0.0.1:5000/events/${selectedEvent.id}`, { withCredentials: true });
-            if (response.status === 200) {
+            if (response.status === 200 || response.status === 202) {
                 setMessage('Event deleted successfully!');
                 const updatedEvents = await fetchEvents();
                 const updatedTasks = await fetchTasks();
@@ -231,7 +271,7 @@ function Calendar() {
         setLoading(true);
         try {
             const response = await axios.post('https://127.0.0.1:5000/create_task', newTask, { withCredentials: true });
-            if (response.status === 201) {
+            if (response.status === 201 || response.status === 202) {
                 const newTasks = await fetchTasks();
                 setEvents(prev => [...prev, ...newTasks]);
                 setShowTaskModal(false);